@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""قياس أداء مسار البث محلياً: مصدر HLS اصطناعي ← StreamManager ← مستقبل RTMP محلي
+
+أمثلة:
+    python bench.py
+    python bench.py --resolutions 720,1080 --logo both --streams 1,2 --duration 30
+    python bench.py --output bench_results.jsonl --label "بعد تعديل الأمر"
+
+كل تشغيل يُضاف كسطر JSON إلى ملف النتائج للمقارنة بين الإصدارات.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+import stream
+from stream import StreamManager
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.WARNING)
+logger = logging.getLogger("bench")
+
+RESOLUTIONS = {
+    480: (854, 480),
+    720: (1280, 720),
+    1080: (1920, 1080),
+}
+# ما يغير أمر FFmpeg أو يعيد تشغيله أثناء القياس - قيم ثابتة لتبقى التشغيلات قابلة للمقارنة
+PINNED_SETTINGS = {
+    "DVR_ENABLED": False,
+    "SNAPSHOT_ENABLED": False,
+    "GOVERNOR_ENABLED": False,
+    "LADDER_ENABLED": False,
+    "MEMORY_BUDGET_ENABLED": False,
+    "EDGE_SELECTION_ENABLED": False,
+}
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+SOURCE_CACHE_DIR = os.path.join(tempfile.gettempdir(), "fbstream_bench_sources")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def generate_source(height, seconds, fps=30):
+    """مصدر HLS اصطناعي ثابت (testsrc2 + نغمة) - يُولّد مرة واحدة لكل إعداد"""
+    width = RESOLUTIONS[height][0]
+    folder = os.path.join(SOURCE_CACHE_DIR, f"{height}p_{seconds}s_{fps}fps")
+    playlist = os.path.join(folder, "index.m3u8")
+    if os.path.exists(playlist):
+        return folder
+    os.makedirs(folder, exist_ok=True)
+    cmd = [
+        "ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        "-t", str(seconds),
+        "-c:v", "libx264", "-preset", "veryfast", "-g", str(fps * 2), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k", "-ac", "2",
+        "-f", "hls", "-hls_time", "2", "-hls_list_size", "0", "-hls_playlist_type", "vod",
+        playlist,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise RuntimeError(f"فشل توليد المصدر: {result.stderr[-500:]}")
+    return folder
+
+
+def serve_folder(folder):
+    """خادم HTTP محلي للمصدر في خيط منفصل"""
+    handler = functools.partial(QuietHandler, directory=folder)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+async def start_sink(port):
+    """مستقبل RTMP محلي: FFmpeg في وضع الاستماع يستقبل ويتخلص من البيانات"""
+    return await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-listen", "1", "-f", "flv", "-i", f"rtmp://127.0.0.1:{port}/live/bench",
+        "-c", "copy", "-f", "null", "-",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+
+def cpu_ticks(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime و stime بعد اسم العملية
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+async def run_one(index, source_url, measure_seconds):
+    """بث واحد: زمن أول حزمة، ثم قياس السرعة والمعالج والذاكرة خلال فترة ثابتة"""
+    port = free_port()
+    sink = await start_sink(port)
+    await asyncio.sleep(0.3)
+    manager = StreamManager(0, f"bench{index}")
+    result = {"stream": index, "ok": False}
+    started = time.time()
+    try:
+        ok, msg = await manager.start_stream(source_url, [f"rtmp://127.0.0.1:{port}/live/bench"])
+        if not ok:
+            result["error"] = msg.splitlines()[0]
+            return result
+        # tee لا يعطي total_size - تقدم out_time يعني أن الحزم وصلت للمُخرج
+        first = next((s for s in manager.telemetry.samples if s["out_time_s"] > 0), None)
+        result["first_packet_s"] = round(first["time"] - started, 3) if first else None
+        result["ready_s"] = round(time.time() - started, 3)
+        result["mode"] = manager.mode
+
+        pid = manager.process.pid
+        ticks_before = cpu_ticks(pid)
+        measure_start = time.time()
+        await asyncio.sleep(measure_seconds)
+        ticks_after = cpu_ticks(pid)
+        wall = time.time() - measure_start
+        result["peak_rss_mb"] = peak_rss_mb(pid)
+
+        window = [s for s in manager.telemetry.window(wall) if s["speed"] is not None]
+        latest = manager.telemetry.latest()
+        if ticks_before is not None and ticks_after is not None:
+            result["cpu_cores"] = round((ticks_after - ticks_before) / CLK_TCK / wall, 3)
+        result["speed_median"] = round(statistics.median(s["speed"] for s in window), 3) if window else None
+        result["speed_min"] = round(min(s["speed"] for s in window), 3) if window else None
+        result["fps_median"] = round(statistics.median(s["fps"] for s in window if s["fps"] is not None), 2) if window else None
+        result["drop_frames"] = latest["drop_frames"] if latest else None
+        result["dup_frames"] = latest["dup_frames"] if latest else None
+        result["restarts"] = manager.restarts
+        result["ok"] = True
+        return result
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    finally:
+        await manager.stop_stream()
+        if sink.returncode is None:
+            sink.kill()
+        await sink.wait()
+
+
+async def run_case(source_url, streams, measure_seconds):
+    results = await asyncio.gather(*[
+        run_one(i, source_url, measure_seconds) for i in range(streams)
+    ])
+    return list(results)
+
+
+def summarize(results):
+    ok = [r for r in results if r["ok"]]
+
+    def avg(key):
+        values = [r[key] for r in ok if r.get(key) is not None]
+        return round(statistics.mean(values), 3) if values else None
+
+    return {
+        "streams_ok": len(ok),
+        "first_packet_s": avg("first_packet_s"),
+        "speed_median": avg("speed_median"),
+        "speed_min": min((r["speed_min"] for r in ok if r.get("speed_min") is not None), default=None),
+        "cpu_cores_per_stream": avg("cpu_cores"),
+        "peak_rss_mb": max((r["peak_rss_mb"] for r in ok if r.get("peak_rss_mb") is not None), default=None),
+        "drop_frames": sum(r.get("drop_frames") or 0 for r in ok),
+    }
+
+
+def environment():
+    def command_output(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    ffmpeg_version = command_output(["ffmpeg", "-version"])
+    return {
+        "commit": command_output(["git", "rev-parse", "--short", "HEAD"]),
+        "ffmpeg": ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "pinned": PINNED_SETTINGS,
+    }
+
+
+async def main(args):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    # القياس يخص مسار الترميز - النسخ المباشر اختياري
+    config.PASSTHROUGH_ENABLED = args.passthrough
+    config.HLS_RELAY_ENABLED = args.relay
+    for name, value in PINNED_SETTINGS.items():
+        setattr(config, name, value)
+
+    resolutions = [int(r) for r in args.resolutions.split(",")]
+    stream_counts = [int(n) for n in args.streams.split(",")]
+    logo_modes = {"on": [True], "off": [False], "both": [False, True]}[args.logo]
+    source_seconds = args.duration + 30
+
+    env = environment()
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+    print(f"📏 {env['commit']} | {env['ffmpeg']} | {env['cpus']} CPU")
+
+    for height in resolutions:
+        folder = generate_source(height, source_seconds)
+        server = serve_folder(folder)
+        source_url = f"http://127.0.0.1:{server.server_address[1]}/index.m3u8"
+        try:
+            for logo in logo_modes:
+                for streams in stream_counts:
+                    config.LOGO_ENABLED = logo
+                    config.RESOLUTION_WIDTH, config.RESOLUTION_HEIGHT = RESOLUTIONS[height]
+                    # كل حالة تبدأ بفحص كامل ليكون زمن أول حزمة قابلاً للمقارنة
+                    stream.probe_cache.items.clear()
+                    results = await run_case(source_url, streams, args.duration)
+                    record = {
+                        "run_id": run_id,
+                        "label": args.label,
+                        "time": time.time(),
+                        "env": env,
+                        "case": {
+                            "resolution": height,
+                            "logo": logo,
+                            "streams": streams,
+                            "duration_s": args.duration,
+                            "passthrough": args.passthrough,
+                            "relay": args.relay,
+                        },
+                        "summary": summarize(results),
+                        "streams": results,
+                    }
+                    with open(args.output, "a") as f:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    s = record["summary"]
+                    print(
+                        f"{height}p logo={'on' if logo else 'off'} x{streams}: "
+                        f"ok={s['streams_ok']}/{streams} first={s['first_packet_s']}s "
+                        f"speed={s['speed_median']} (min {s['speed_min']}) "
+                        f"cpu={s['cpu_cores_per_stream']} rss={s['peak_rss_mb']}MB drop={s['drop_frames']}"
+                    )
+                    for r in results:
+                        if not r["ok"]:
+                            print(f"   ❌ #{r['stream']}: {r.get('error')}")
+        finally:
+            server.shutdown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="قياس أداء مسار البث")
+    parser.add_argument("--resolutions", default="720", help="مثال: 480,720,1080")
+    parser.add_argument("--logo", choices=["on", "off", "both"], default="both")
+    parser.add_argument("--streams", default="1", help="أعداد البثوث المتزامنة، مثال: 1,2,4")
+    parser.add_argument("--duration", type=int, default=20, help="ثواني القياس بعد الاستقرار")
+    parser.add_argument("--passthrough", action="store_true", help="السماح بالنسخ المباشر")
+    parser.add_argument("--relay", action=argparse.BooleanOptionalAction, default=config.HLS_RELAY_ENABLED)
+    parser.add_argument("--output", default="bench_results.jsonl")
+    parser.add_argument("--label", default="")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
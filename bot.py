@@ -1,13 +1,19 @@
+import asyncio
+import hmac
+import json
 import logging
 import os
+import secrets
 import time
-import requests
 from telegram import Update
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, ContextTypes
 import config
-from stream import StreamManager
+from stream import StreamRegistry
+from telemetry import render_prometheus
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import web
+from preview_app import config_route
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -15,22 +21,33 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 M3U8, KEY = range(2)
-stream_manager = StreamManager()
+stream_registry = StreamRegistry()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(
         "👋 مرحباً!\n\n"
         "📋 الأوامر:\n"
-        "/stream - بدء البث\n"
-        "/stop - إيقاف البث\n"
-        "/status - حالة البث\n"
-        "/reset - إعادة تعيين"
+        "/stream - بدء بث جديد\n"
+        "/stop [رقم] - إيقاف بث\n"
+        "/status [رقم] - حالة البث\n"
+        "/dests [رقم] - وجهات البث\n"
+        "/adddest [رقم] <key> - إضافة وجهة\n"
+        "/rmdest [رقم] <n> - حذف وجهة\n"
+        "/enqueue [رقم] <رابط> [HH:MM] - مصدر تالٍ (أو مجدول)\n"
+        "/skip [رقم] - الانتقال للمصدر التالي\n"
+        "/sources [رقم] - قائمة المصادر\n"
+        "/backup [رقم] <رابط|off> - مصدر احتياطي\n"
+        "/clip [رقم] <ثواني> - مقطع من آخر ما بُث\n"
+        "/logo [رقم] on|off | pos X Y | opacity 0-1 - تعديل اللوجو أثناء البث\n"
+        "/snapshot [رقم] - صورة حية من البث\n"
+        "/reset - إيقاف كل بثوثك"
     )
     return ConversationHandler.END
 
 async def start_stream_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if stream_manager.is_running:
-        await update.message.reply_text("⚠️ البث يعمل! استخدم /stop أولاً.")
+    ok, msg = stream_registry.check_admission()
+    if not ok:
+        await update.message.reply_text(msg)
         return ConversationHandler.END
     
     await update.message.reply_text("🚀 أرسل رابط البث (M3U8 أو TS)")
@@ -38,38 +55,258 @@ async def start_stream_command(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def get_m3u8(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['m3u8'] = update.message.text.strip()
-    await update.message.reply_text("✅ تم.\n\nالآن أرسل Stream Key من فيسبوك")
+    await update.message.reply_text("✅ تم.\n\nالآن أرسل Stream Key من فيسبوك\n(يمكنك إرسال عدة مفاتيح أو روابط RTMP، واحد في كل سطر)")
     return KEY
 
 async def get_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     m3u8 = context.user_data['m3u8']
-    key = update.message.text.strip()
+    # عدة مفاتيح أو روابط RTMP (سطر لكل وجهة) = ترميز واحد لكل الوجهات
+    keys = update.message.text.split()
     
-    if len(key) < 10:
+    if not keys or any(len(k) < 10 for k in keys):
         await update.message.reply_text("❌ Stream Key قصير! تأكد منه.")
         return KEY
     
-    await update.message.reply_text("⏳ جاري الاتصال...")
+    status_msg = await update.message.reply_text("⏳ جاري الاتصال...")
     
-    best_m3u8 = stream_manager.parse_m3u8_for_best_quality(m3u8)
-    success, msg = stream_manager.start_stream(best_m3u8, key)
-    
-    await update.message.reply_text(msg)
+    # البدء في الخلفية حتى لا يتوقف البوت لباقي المستخدمين
+    context.application.create_task(
+        run_stream_start(update.effective_chat.id, m3u8, keys, status_msg),
+        update=update,
+    )
     return ConversationHandler.END
 
+async def run_stream_start(chat_id, m3u8, keys, status_msg):
+    """تشغيل البث وتحديث رسالة الحالة بمراحل التقدم"""
+    async def on_progress(text):
+        try:
+            await status_msg.edit_text(text)
+        except TelegramError as e:
+            logger.warning(f"⚠️ تعذر تحديث الرسالة: {e}")
+    
+    _, msg, _ = await stream_registry.start_stream(chat_id, m3u8, keys, on_progress)
+    await on_progress(msg)
+
+def resolve_stream(update: Update, args, command):
+    """تحديد البث المطلوب من رقم الأمر أو البث الوحيد للمحادثة"""
+    chat_id = update.effective_chat.id
+    if args:
+        return stream_registry.get(chat_id, args[0]), None
+    streams = stream_registry.list_streams(chat_id)
+    if not streams:
+        return None, "⚠️ لا يوجد بث نشط."
+    if len(streams) == 1:
+        return streams[0], None
+    ids = ", ".join(m.stream_id for m in streams)
+    return None, f"🔢 لديك عدة بثوث: {ids}\nحدد الرقم، مثال: /{command} {streams[0].stream_id}"
+
 async def stop_stream_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    _, msg = stream_manager.stop_stream()
+    manager, error = resolve_stream(update, context.args, "stop")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    _, msg = await stream_registry.stop_stream(update.effective_chat.id, manager.stream_id)
     await update.message.reply_text(msg)
     return ConversationHandler.END
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    msg = stream_manager.get_detailed_status()
+    if not context.args:
+        streams = stream_registry.list_streams(update.effective_chat.id)
+        if len(streams) > 1:
+            lines = [m.get_detailed_status() for m in streams]
+            await update.message.reply_text("📊 " + "\n".join(lines))
+            return ConversationHandler.END
+    manager, error = resolve_stream(update, context.args, "status")
+    if manager is None:
+        await update.message.reply_text(f"📊 {error or '⚠️ لا يوجد بث بهذا الرقم.'}")
+        return ConversationHandler.END
+    msg = manager.get_detailed_status()
     await update.message.reply_text(f"📊 {msg}")
     return ConversationHandler.END
 
+async def destinations_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    manager, error = resolve_stream(update, context.args, "dests")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    await update.message.reply_text(f"🎯 وجهات البث #{manager.stream_id}:\n{manager.describe_destinations()}")
+    return ConversationHandler.END
+
+async def add_destination_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if not context.args or len(context.args[-1]) < 10:
+        await update.message.reply_text("📝 الاستخدام: /adddest [رقم البث] <Stream Key أو رابط RTMP>")
+        return ConversationHandler.END
+    manager, error = resolve_stream(update, context.args[:-1], "adddest")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    await update.message.reply_text("🔁 جاري إعادة تشغيل المرمّز مع الوجهة الجديدة...")
+    _, msg = await manager.add_destination(context.args[-1])
+    await update.message.reply_text(msg)
+    return ConversationHandler.END
+
+async def remove_destination_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if not context.args or not context.args[-1].isdigit():
+        await update.message.reply_text("📝 الاستخدام: /rmdest [رقم البث] <رقم الوجهة>")
+        return ConversationHandler.END
+    manager, error = resolve_stream(update, context.args[:-1], "rmdest")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    _, msg = await manager.remove_destination(int(context.args[-1]) - 1)
+    await update.message.reply_text(msg)
+    return ConversationHandler.END
+
+def parse_schedule(text):
+    """HH:MM بالتوقيت المحلي - أقرب موعد قادم (اليوم أو غداً)"""
+    hour, _, minute = text.partition(':')
+    if not (hour.isdigit() and minute.isdigit()) or int(hour) > 23 or int(minute) > 59:
+        return None
+    now = time.localtime()
+    at = time.mktime((now.tm_year, now.tm_mon, now.tm_mday, int(hour), int(minute), 0, 0, 0, -1))
+    return at if at > time.time() else at + 86400
+
+async def enqueue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    args = context.args or []
+    url_index = next((i for i, a in enumerate(args) if '://' in a), None)
+    if url_index is None:
+        await update.message.reply_text("📝 الاستخدام: /enqueue [رقم البث] <رابط M3U8> [HH:MM]")
+        return ConversationHandler.END
+    at = None
+    if len(args) > url_index + 1:
+        at = parse_schedule(args[url_index + 1])
+        if at is None:
+            await update.message.reply_text("⚠️ الوقت بصيغة HH:MM، مثال: 21:30")
+            return ConversationHandler.END
+    manager, error = resolve_stream(update, args[:url_index], "enqueue")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    _, msg = manager.enqueue(args[url_index], at)
+    await update.message.reply_text(msg)
+    return ConversationHandler.END
+
+async def skip_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    manager, error = resolve_stream(update, context.args, "skip")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    if manager.queue:
+        await update.message.reply_text("🔀 جاري التبديل للمصدر التالي...")
+    _, msg = await manager.skip()
+    await update.message.reply_text(msg)
+    return ConversationHandler.END
+
+async def sources_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    manager, error = resolve_stream(update, context.args, "sources")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    await update.message.reply_text(f"📼 مصادر البث #{manager.stream_id}:\n{manager.describe_sources()}")
+    return ConversationHandler.END
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    args = context.args or []
+    if not args or ('://' not in args[-1] and args[-1] != 'off'):
+        await update.message.reply_text("📝 الاستخدام: /backup [رقم البث] <رابط M3U8> أو /backup [رقم البث] off")
+        return ConversationHandler.END
+    manager, error = resolve_stream(update, args[:-1], "backup")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    if args[-1] == 'off':
+        _, msg = await manager.clear_backup()
+    else:
+        await update.message.reply_text("⏳ جاري تجهيز المصدر الاحتياطي...")
+        _, msg = await manager.set_backup(args[-1])
+    await update.message.reply_text(msg)
+    return ConversationHandler.END
+
+async def clip_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    args = context.args or []
+    if not args or not args[-1].isdigit():
+        await update.message.reply_text(f"📝 الاستخدام: /clip [رقم البث] <ثواني حتى {config.DVR_CLIP_MAX}>")
+        return ConversationHandler.END
+    manager, error = resolve_stream(update, args[:-1], "clip")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    ok, msg, path = await manager.export_clip(int(args[-1]))
+    if not ok:
+        await update.message.reply_text(msg)
+        return ConversationHandler.END
+    try:
+        with open(path, 'rb') as f:
+            await update.message.reply_video(f, caption=f"{msg} - البث #{manager.stream_id}", supports_streaming=True)
+    except TelegramError as e:
+        await update.message.reply_text(f"❌ تعذر إرسال المقطع: {e}")
+    finally:
+        os.remove(path)
+    return ConversationHandler.END
+
+async def snapshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    manager, error = resolve_stream(update, context.args, "snapshot")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    snapshot = manager.latest_snapshot()
+    if snapshot is None:
+        await update.message.reply_text(f"⚠️ لا توجد لقطة حديثة للبث #{manager.stream_id}")
+        return ConversationHandler.END
+    age, data = snapshot
+    await update.message.reply_photo(
+        data, caption=f"📸 البث #{manager.stream_id} - قبل {age:.0f} ثانية\n🔗 /snapshot/{manager.web_key()}"
+    )
+    return ConversationHandler.END
+
+LOGO_ACTIONS = ('on', 'off', 'pos', 'opacity')
+
+def parse_logo_args(args):
+    """/logo on|off أو pos X Y أو opacity 0-1 - يرجع التغييرات أو None"""
+    if not args:
+        return None
+    action, values = args[0].lower(), args[1:]
+    try:
+        if action in ('on', 'off') and not values:
+            return {'enabled': action == 'on'}
+        if action == 'pos' and len(values) == 2:
+            return {'x': int(values[0]), 'y': int(values[1])}
+        if action == 'opacity' and len(values) == 1:
+            return {'opacity': float(values[0])}
+    except ValueError:
+        pass
+    return None
+
+async def logo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    args = context.args or []
+    # رقم البث اختياري قبل الإجراء
+    stream_args = args[:1] if len(args) > 1 and args[0].isdigit() and args[1].lower() in LOGO_ACTIONS else []
+    rest = args[len(stream_args):]
+    manager, error = resolve_stream(update, stream_args, "logo")
+    if manager is None:
+        await update.message.reply_text(error or "⚠️ لا يوجد بث بهذا الرقم.")
+        return ConversationHandler.END
+    if not rest:
+        state = manager.overlay
+        await update.message.reply_text(
+            f"🖼️ اللوجو على البث #{manager.stream_id}: {'ظاهر' if state['enabled'] else 'مخفي'}\n"
+            f"📍 الموضع: {state['x']}, {state['y']} | الشفافية: {state['opacity']:.0%}\n"
+            f"{'⚡ التعديل مباشر دون انقطاع' if manager.live_overlay else '🔁 التعديل يحتاج إعادة اتصال قصيرة'}\n"
+            f"🔑 رقم البث في صفحة المعاينة: {manager.web_key()}"
+        )
+        return ConversationHandler.END
+    changes = parse_logo_args(rest)
+    if changes is None:
+        await update.message.reply_text(
+            "📝 الاستخدام:\n/logo [رقم البث] on|off\n/logo [رقم البث] pos <X> <Y>\n/logo [رقم البث] opacity <0-1>"
+        )
+        return ConversationHandler.END
+    _, msg = await manager.set_overlay(**changes)
+    await update.message.reply_text(msg)
+    return ConversationHandler.END
+
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    stream_manager.stop_stream()
-    stream_manager.is_running = False
+    await stream_registry.stop_all(update.effective_chat.id)
     await update.message.reply_text("🔄 تم إعادة التعيين!\n\nاستخدم /stream للبدء")
     return ConversationHandler.END
 
@@ -77,76 +314,177 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("❌ تم الإلغاء.")
     return ConversationHandler.END
 
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'OK')
-        elif self.path == '/' or self.path == '/preview':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            try:
-                with open('templates/preview.html', 'r', encoding='utf-8') as f:
-                    self.wfile.write(f.read().encode('utf-8'))
-            except:
-                self.wfile.write(b'<h1>Bot Running</h1>')
-        elif self.path.startswith('/static/'):
-            file_path = self.path[1:]
-            if os.path.exists(file_path):
-                self.send_response(200)
-                ct = 'image/png' if file_path.endswith('.png') else 'application/octet-stream'
-                self.send_header('Content-type', ct)
-                self.end_headers()
-                with open(file_path, 'rb') as f:
-                    self.wfile.write(f.read())
-            else:
-                self.send_response(404)
-                self.end_headers()
-        else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def log_message(self, format, *args):
-        pass
+def health_route():
+    return 200, 'text/plain', b'OK'
+
+def metrics_route():
+    return 200, 'text/plain; version=0.0.4', render_prometheus(stream_registry).encode('utf-8')
+
+def status_route():
+    data = {
+        'capacity': stream_registry.capacity(),
+        'streams': [m.status_dict() for m in stream_registry.list_streams()],
+    }
+    return 200, 'application/json', json.dumps(data).encode('utf-8')
 
-def run_server(port):
+def find_stream(key):
+    """البث الجاري من المفتاح <المحادثة>_<رقم البث> - رقم البث وحده يتكرر بين المحادثات"""
+    owner, _, stream_id = key.rpartition('_')
     try:
-        server = HTTPServer(('0.0.0.0', port), HealthHandler)
-        server.allow_reuse_address = True
-        logger.info(f"✅ Server on port {port}")
-        server.serve_forever()
+        manager = stream_registry.get(int(owner), stream_id)
+    except ValueError:
+        return None
+    return manager if manager is not None and manager.is_running else None
+
+def overlay_route(body, headers):
+    """تعديل اللوجو من صفحة المعاينة - نفس /logo على البثوث الجارية"""
+    if not config.OVERLAY_API_TOKEN or headers.get('X-Overlay-Token') != config.OVERLAY_API_TOKEN:
+        return 403, 'text/plain', b'Forbidden'
+    loop = stream_registry.loop
+    if loop is None:
+        return 503, 'text/plain', b'Bot not ready'
+    data = json.loads(body)
+    changes = {
+        'enabled': data.get('enabled'),
+        'x': int(data['offset_x']) if data.get('offset_x') is not None else None,
+        'y': int(data['offset_y']) if data.get('offset_y') is not None else None,
+        'opacity': float(data['opacity']) if data.get('opacity') is not None else None,
+    }
+    # بث واحد محدد دائماً - الرمز مشترك بين كل المحادثات
+    manager = find_stream(str(data.get('stream') or ''))
+    if manager is None:
+        return 404, 'text/plain', b'Unknown stream'
+    # الأوامر تُكتب لعملية FFmpeg من حلقة البوت - خيط الخادم ينتظر النتيجة
+    future = asyncio.run_coroutine_threadsafe(manager.set_overlay(**changes), loop)
+    ok, msg = future.result(timeout=config.FIRST_PACKET_TIMEOUT + 15)
+    results = [{'stream': manager.web_key(), 'ok': ok, 'message': msg}]
+    return 200, 'application/json', json.dumps({'streams': results}, ensure_ascii=False).encode('utf-8')
+
+def snapshot_route(key, headers):
+    """/snapshot/<المحادثة>_<رقم البث> - آخر لقطة JPEG يكتبها المرمّز على القرص"""
+    if not config.SNAPSHOT_API_TOKEN or headers.get('X-Snapshot-Token') != config.SNAPSHOT_API_TOKEN:
+        return 403, 'text/plain', b'Forbidden'
+    manager = find_stream(key)
+    snapshot = manager.latest_snapshot() if manager is not None else None
+    if snapshot is None:
+        return 404, 'text/plain', b'No snapshot'
+    return 200, 'image/jpeg', snapshot[1]
+
+WEB_ROUTES = {
+    '/health': health_route,
+    '/metrics': metrics_route,
+    '/api/status': status_route,
+    '/api/config': config_route,
+    '/snapshot/': snapshot_route,
+}
+
+POST_ROUTES = {
+    '/api/overlay': overlay_route,
+}
+
+def run_server(port, post_routes=None):
+    try:
+        web.serve(port, WEB_ROUTES, post_routes={**POST_ROUTES, **(post_routes or {})})
     except Exception as e:
         logger.error(f"Server error: {e}")
 
+async def on_startup(app):
+    stream_registry.loop = asyncio.get_running_loop()
+    # المرمّزات التي بقيت تعمل أثناء إعادة تشغيل البوت
+    await stream_registry.restore()
+
+def build_application():
+    app = Application.builder().token(config.BOT_TOKEN).post_init(on_startup).build()
+    
+    async def notify_chat(chat_id, text):
+        await app.bot.send_message(chat_id, text)
+    
+    stream_registry.notifier = notify_chat
+    
+    conv = ConversationHandler(
+        entry_points=[CommandHandler("stream", start_stream_command)],
+        states={
+            M3U8: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_m3u8)],
+            KEY: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_key)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+    )
+    
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("stop", stop_stream_command))
+    app.add_handler(CommandHandler("status", status_command))
+    app.add_handler(CommandHandler("reset", reset_command))
+    app.add_handler(CommandHandler("dests", destinations_command))
+    app.add_handler(CommandHandler("adddest", add_destination_command))
+    app.add_handler(CommandHandler("rmdest", remove_destination_command))
+    app.add_handler(CommandHandler("enqueue", enqueue_command))
+    app.add_handler(CommandHandler("skip", skip_command))
+    app.add_handler(CommandHandler("sources", sources_command))
+    app.add_handler(CommandHandler("backup", backup_command))
+    app.add_handler(CommandHandler("clip", clip_command))
+    app.add_handler(CommandHandler("logo", logo_command))
+    app.add_handler(CommandHandler("snapshot", snapshot_command))
+    app.add_handler(conv)
+    return app
+
 def run_bot():
     try:
-        app = Application.builder().token(config.BOT_TOKEN).build()
-        
-        conv = ConversationHandler(
-            entry_points=[CommandHandler("stream", start_stream_command)],
-            states={
-                M3U8: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_m3u8)],
-                KEY: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_key)],
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-        )
-        
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(CommandHandler("stop", stop_stream_command))
-        app.add_handler(CommandHandler("status", status_command))
-        app.add_handler(CommandHandler("reset", reset_command))
-        app.add_handler(conv)
-        
+        app = build_application()
         logger.info("✅ Bot started")
         app.run_polling(allowed_updates=Update.ALL_TYPES, timeout=30)
     except Exception as e:
         logger.error(f"❌ Bot error: {e}")
 
+def webhook_route(app, loop):
+    """مسار POST للتحديثات - يُسلّم التحديث لحلقة البوت فوراً دون انتظار المعالجة"""
+    def handle(body, headers):
+        token = headers.get('X-Telegram-Bot-Api-Secret-Token') or ''
+        if not config.WEBHOOK_SECRET or not hmac.compare_digest(token.encode(), config.WEBHOOK_SECRET.encode()):
+            return 403, 'text/plain', b'Forbidden'
+        update = Update.de_json(json.loads(body), app.bot)
+        if update is None:
+            raise ValueError("empty update")
+        loop.call_soon_threadsafe(app.update_queue.put_nowait, update)
+        return 200, 'text/plain', b'OK'
+    return handle
+
+async def run_webhook(port):
+    """وضع webhook: تيليجرام يرسل التحديثات لنفس خادم /health - بدون polling ولا keep-alive"""
+    if not config.WEBHOOK_SECRET:
+        # المسار عام - بدون سر يستطيع أي أحد حقن تحديثات بمعرف أي محادثة
+        config.WEBHOOK_SECRET = secrets.token_urlsafe(32)
+        logger.warning("🔐 WEBHOOK_SECRET غير محدد - تم توليد سر عشوائي لهذا التشغيل (حدده لإرسال تحديثات يدوياً)")
+    app = build_application()
+    await app.initialize()
+    await app.start()
+    
+    loop = asyncio.get_running_loop()
+    # post_init لا يُستدعى مع initialize اليدوي
+    await on_startup(app)
+    post_routes = {config.WEBHOOK_PATH: webhook_route(app, loop)}
+    threading.Thread(target=run_server, args=(port, post_routes), daemon=True).start()
+    
+    base_url = config.WEBHOOK_URL or os.getenv('RENDER_EXTERNAL_URL', '')
+    if base_url:
+        await app.bot.set_webhook(
+            url=f"{base_url.rstrip('/')}{config.WEBHOOK_PATH}",
+            secret_token=config.WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"✅ Bot started (webhook {config.WEBHOOK_PATH})")
+    else:
+        # بدون رابط عام: الخادم يستقبل التحديثات المرسلة يدوياً فقط (للاختبار المحلي)
+        logger.warning(f"⚠️ WEBHOOK_URL غير محدد - التحديثات تُقبل محلياً فقط على {config.WEBHOOK_PATH}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await app.stop()
+        await app.shutdown()
+
 def keep_alive():
     """منع Render من إيقاف الخدمة - ping كل 5 دقائق"""
+    import requests
     url = os.getenv('RENDER_EXTERNAL_URL', '')
     while True:
         time.sleep(300)
@@ -161,6 +499,15 @@ def main():
     logger.info("🚀 Starting...")
     PORT = int(os.getenv('PORT', 8000))
     
+    if config.WEBHOOK_ENABLED:
+        try:
+            asyncio.run(run_webhook(PORT))
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            logger.error(f"❌ Bot error: {e}")
+        return
+    
     t = threading.Thread(target=run_server, args=(PORT,), daemon=True)
     t.start()
     
@@ -8,8 +8,10 @@ FACEBOOK_RTMP_URL = "rtmps://live-api-s.facebook.com:443/rtmp/"
 
 # إعدادات الدقة - 720p لتوفير الذاكرة على 512MB
 # غيّر إلى 1080 إذا كان لديك RAM أكثر من 1GB
+# (وضع ميزانية الذاكرة بالأسفل يخفض الدقة تلقائياً إذا لم تكفِ الذاكرة)
 RESOLUTION_WIDTH = 1280
 RESOLUTION_HEIGHT = 720
+VIDEO_BITRATE_KBPS = 3500
 
 # تعطيل اللوجو مؤقتاً - غيّر إلى True عندما تريد تفعيله
 LOGO_ENABLED = False
@@ -18,3 +20,146 @@ LOGO_OFFSET_X = -27
 LOGO_OFFSET_Y = -36
 LOGO_SIZE = "200:-1"
 LOGO_OPACITY = 1.0
+
+# التحكم في القبول - عدد البثوث لكل نواة (ترميز 720p ultrafast ≈ نواة كاملة)
+STREAMS_PER_CPU = float(os.getenv("STREAMS_PER_CPU", "1"))
+MAX_CPU_LOAD = float(os.getenv("MAX_CPU_LOAD", "0.85"))
+
+# وضع النسخ المباشر - بدون إعادة ترميز إذا كان المصدر مطابقاً للمخرج
+PASSTHROUGH_ENABLED = os.getenv("PASSTHROUGH_ENABLED", "1") == "1"
+PROBE_TIMEOUT = 15
+OUTPUT_FPS = 30
+
+# مدة صلاحية قوائم HLS الرئيسية المحللة (ثوانٍ)
+PLAYLIST_CACHE_TTL = 300
+
+# جاهزية البث - من تقدم المخرج الفعلي بدل الانتظار الثابت
+FIRST_PACKET_TIMEOUT = 20
+STABLE_TIMEOUT = 10
+STABLE_OUT_TIME = 1.0
+
+# عدد عينات -progress المحفوظة لكل بث (كل 0.5 ثانية = 5 دقائق)
+TELEMETRY_SAMPLES = 600
+
+# منظم المرمّز - تعديل preset/threads حسب speed وحمل المعالج
+GOVERNOR_ENABLED = os.getenv("GOVERNOR_ENABLED", "1") == "1"
+GOVERNOR_MAX_THREADS = 8
+GOVERNOR_WINDOW = 20
+GOVERNOR_COOLDOWN = 120
+GOVERNOR_MIN_SPEED = 0.97
+GOVERNOR_HEADROOM_LOAD = 0.5
+
+# اللوجو المجهز مسبقاً (الحجم والشفافية) - يُعاد رسمه فقط عند تغير الملف أو الإعدادات
+LOGO_CACHE_DIR = "/tmp/fbstream_logo_cache"
+
+# وسيط HLS المحلي - جلب المقاطع مسبقاً لامتصاص بطء الـ CDN
+HLS_RELAY_ENABLED = os.getenv("HLS_RELAY_ENABLED", "1") == "1"
+RELAY_BUFFER_SEGMENTS = 8
+RELAY_BUFFER_BYTES = 48 * 1024 * 1024
+RELAY_START_SEGMENTS = 3
+RELAY_FETCH_TIMEOUT = 10
+
+# المراقب - كشف خروج FFmpeg أو توقف المخرج وإعادة التشغيل
+WATCHDOG_INTERVAL = 0.5
+STALL_SECONDS = 3
+WATCHDOG_BACKOFF_BASE = 1
+WATCHDOG_BACKOFF_MAX = 30
+WATCHDOG_MAX_RESTARTS = 10
+WATCHDOG_BUDGET_WINDOW = 600
+
+# ذاكرة نتائج فحص المصادر - إعادة التشغيل السريع لمصدر معروف
+PROBE_CACHE_PATH = os.getenv("PROBE_CACHE_PATH", "/tmp/fbstream_probe_cache.json")
+PROBE_CACHE_TTL = 6 * 3600
+FAST_PROBE_ANALYZEDURATION = 200000
+FAST_PROBE_SIZE = 200000
+
+# ميزانية الذاكرة - حد الحاوية (cgroup) يحدد الدقة والطوابير لكل بث
+MEMORY_BUDGET_ENABLED = os.getenv("MEMORY_BUDGET_ENABLED", "1") == "1"
+MEMORY_LIMIT_MB = int(os.getenv("MEMORY_LIMIT_MB", "0"))  # 0 = قراءة الحد من cgroup
+MEMORY_RESERVE_MB = 150  # البوت و Python والوسيط
+MEMORY_SAMPLE_INTERVAL = 2
+MEMORY_DEGRADE_RATIO = 0.85
+MEMORY_COOLDOWN = 60
+
+# لوج FFmpeg - حلقة ثابتة في الذاكرة وحفظ محدود على القرص
+LOG_RING_LINES = 500
+LOG_PERSIST = os.getenv("LOG_PERSIST", "1") == "1"
+LOG_FLUSH_INTERVAL = 5
+LOG_FILE_MAX_BYTES = 1024 * 1024
+
+# وضع webhook - التحديثات تصل إلى نفس خادم /health بدل polling
+# الرابط العام من WEBHOOK_URL أو RENDER_EXTERNAL_URL
+WEBHOOK_ENABLED = os.getenv("WEBHOOK_ENABLED", "0") == "1"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # فارغ = سر عشوائي عند التشغيل
+
+# قائمة المصادر لكل بث - التبديل عبر الوسيط دون قطع اتصال RTMP
+SOURCE_QUEUE_MAX = 20
+
+# المصدر الاحتياطي وشاشة الانتظار - التبديل داخل الوسيط دون قطع المخرج
+FAILOVER_GRACE = 1.0  # ثوانٍ بعد موعد المقطع التالي قبل اعتبار المصدر متوقفاً
+FAILOVER_CHECK_INTERVAL = 0.25
+FAILBACK_POLLS = 2  # تحديثات متتالية بمقاطع جديدة قبل العودة للأساسي
+SLATE_ENABLED = os.getenv("SLATE_ENABLED", "1") == "1"
+SLATE_IMAGE = "static/slate.png"  # اختياري - لون ثابت إذا لم توجد
+SLATE_COLOR = "0x101010"
+SLATE_SECONDS = 2
+
+# تسجيل DVR محلي - مقاطع من نفس الترميز على القرص لتصدير آخر الدقائق
+DVR_ENABLED = os.getenv("DVR_ENABLED", "1") == "1"
+DVR_DIR = "/tmp/fbstream_dvr"
+DVR_SEGMENT_SECONDS = 2
+DVR_MAX_BYTES = int(os.getenv("DVR_MAX_MB", "200")) * 1024 * 1024
+DVR_MAX_AGE = 600
+DVR_LIST_SIZE = 400
+DVR_PRUNE_INTERVAL = 5
+DVR_CLIP_MAX = 90  # حد ملفات البوت في تيليجرام 50MB
+DVR_EXPORT_TIMEOUT = 60
+
+# تعديل اللوجو أثناء البث (الموضع والإظهار) بأوامر لفلاتر FFmpeg عبر stdin - الشفافية تعيد رسم الصورة والتشغيل
+# (البثوث التي بدأت واللوجو ظاهر فقط - إظهار لوجو مخفي يعيد التشغيل مرة واحدة)
+OVERLAY_LIVE_ENABLED = os.getenv("OVERLAY_LIVE_ENABLED", "1") == "1"
+# رمز صفحة المعاينة لتعديل البث الجاري (/api/overlay) - فارغ = معطل
+OVERLAY_API_TOKEN = os.getenv("OVERLAY_API_TOKEN", "")
+
+# لقطة حية من المرمّز: فرع منخفض المعدل والدقة من نفس الرسم، آخر صورة فقط في ملف JPEG يُستبدل
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "1") == "1"
+# رمز GET /snapshot/<المحادثة>_<رقم البث> (ترويسة X-Snapshot-Token) - فارغ = معطل
+SNAPSHOT_API_TOKEN = os.getenv("SNAPSHOT_API_TOKEN", OVERLAY_API_TOKEN)
+SNAPSHOT_FPS = 1
+SNAPSHOT_WIDTH = 480
+SNAPSHOT_QUALITY = 6  # -q:v لـ mjpeg (2 أفضل، 31 أسوأ)
+SNAPSHOT_MAX_AGE = 10  # لقطة أقدم من ذلك = المخرج متوقف
+
+# اختيار أسرع مصدر قبل البدء: قياس متزامن للبدائل (نسخ الجودة المكررة والمضيفات البديلة)
+EDGE_SELECTION_ENABLED = os.getenv("EDGE_SELECTION_ENABLED", "1") == "1"
+# مجموعات مضيفات تقدم نفس المسارات: "a.cdn.com,b.cdn.com;c.net,d.net"
+EDGE_MIRRORS = [
+    [host.strip() for host in group.split(",") if host.strip()]
+    for group in os.getenv("EDGE_MIRRORS", "").split(";")
+    if group.strip()
+]
+EDGE_TIMEOUT = 6  # مهلة قياس كل مرشح (القائمة + المقطع)
+EDGE_SAMPLE_BYTES = 2 * 1024 * 1024  # حد التحميل من المقطع
+EDGE_MAX_CANDIDATES = 6
+EDGE_SWITCH_MARGIN = 1.2  # البديل يجب أن يتفوق بهذه النسبة لنترك الرابط الأصلي
+EDGE_CACHE_PATH = os.getenv("EDGE_CACHE_PATH", "/tmp/fbstream_edge_cache.json")
+EDGE_CACHE_TTL = 30 * 60
+
+# استعادة البثوث بعد إعادة تشغيل البوت: المرمّزات تعمل في جلسة مستقلة وحالتها في ملف
+REATTACH_ENABLED = os.getenv("REATTACH_ENABLED", "1") == "1"
+STATE_PATH = os.getenv("STATE_PATH", "/tmp/fbstream_state.json")
+# نافذة إعادة اتصال المرمّز بالوسيط المحلي - تغطي فترة غياب البوت
+RELAY_RECONNECT_DELAY_MAX = 30
+
+# سلم معدل المخرج حسب قدرة الرفع: "ارتفاع:kbps" من الأعلى للأقل، الدرجة الأولى هي الأساس
+LADDER_ENABLED = os.getenv("LADDER_ENABLED", "1") == "1"
+# فارغ = الدقة والمعدل المطلوبان ثم 720:2500,540:1500 - الدرجات تُبنى لكل بث من الإعدادات الحالية
+LADDER_SPEC = os.getenv("LADDER", "")
+LADDER_SAMPLE_INTERVAL = 2
+LADDER_CONGESTED_BACKLOG = 1.0  # ثوانٍ من معدل الدرجة تنتظر في طوابير الإرسال = ازدحام
+LADDER_CLEAR_BACKLOG = 0.2  # أقل من ذلك = فائض في الرفع
+LADDER_DOWN_SECONDS = 6  # ازدحام مستمر قبل النزول
+LADDER_UP_SECONDS = 60  # فائض مستمر قبل الصعود
+LADDER_SETTLE = 10  # تجاهل العينات بعد تغيير الدرجة (إعادة الاتصال)
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_RE = re.compile(r"^dvr_(\d{10})\.ts$")
+
+
+class DvrRing:
+    """حلقة مقاطع MPEG-TS على القرص من نفس الترميز (مخرج segment إضافي في tee)"""
+
+    def __init__(self, name):
+        self.dir = os.path.join(config.DVR_DIR, name)
+        self.list_file = os.path.join(self.dir, "segments.csv")
+        self.last_prune = 0.0
+        self.evicted = 0
+        self.clips = 0
+
+    def segment_files(self):
+        """المقاطع مرتبة من الأقدم للأحدث"""
+        try:
+            names = [n for n in os.listdir(self.dir) if SEGMENT_RE.match(n)]
+        except OSError:
+            return []
+        return sorted(names)
+
+    def next_index(self):
+        """الترقيم يستمر بعد إعادة تشغيل FFmpeg - لا يكتب فوق المقاطع السابقة"""
+        files = self.segment_files()
+        return int(SEGMENT_RE.match(files[-1]).group(1)) + 1 if files else 0
+
+    def output_slave(self):
+        """مواصفات مخرج segment داخل tee - المقاطع تبدأ عند الإطارات المفتاحية"""
+        os.makedirs(self.dir, exist_ok=True)
+        options = ":".join([
+            "f=segment",
+            f"segment_time={config.DVR_SEGMENT_SECONDS}",
+            "segment_format=mpegts",
+            f"segment_start_number={self.next_index()}",
+            f"segment_list={self.list_file}",
+            "segment_list_type=csv",
+            f"segment_list_size={config.DVR_LIST_SIZE}",
+            # فشل القرص لا يوقف البث للوجهات
+            "onfail=ignore",
+        ])
+        return f"[{options}]{os.path.join(self.dir, 'dvr_%010d.ts')}"
+
+    def durations(self):
+        """مدة كل مقطع مكتمل من قائمة segment (اسم،بداية،نهاية)"""
+        result = {}
+        try:
+            with open(self.list_file) as f:
+                for line in f:
+                    parts = line.strip().split(",")
+                    if len(parts) >= 3:
+                        try:
+                            result[parts[0]] = float(parts[2]) - float(parts[1])
+                        except ValueError:
+                            pass
+        except OSError:
+            pass
+        return result
+
+    def prune(self, force=False):
+        """حذف الأقدم حسب الحجم والعمر - آخر مقطع (قيد الكتابة) لا يُحذف"""
+        now = time.time()
+        if not force and now - self.last_prune < config.DVR_PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        entries = []
+        for name in self.segment_files():
+            try:
+                stat = os.stat(os.path.join(self.dir, name))
+            except OSError:
+                continue
+            entries.append((name, stat.st_size, stat.st_mtime))
+        total = sum(size for _, size, _ in entries)
+        for name, size, mtime in entries[:-1]:
+            if total <= config.DVR_MAX_BYTES and now - mtime <= config.DVR_MAX_AGE:
+                break
+            try:
+                os.remove(os.path.join(self.dir, name))
+                total -= size
+                self.evicted += 1
+            except OSError:
+                pass
+
+    def stats(self):
+        files = self.segment_files()
+        durations = self.durations()
+        total = 0
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(self.dir, name))
+            except OSError:
+                pass
+        seconds = sum(durations.get(n, config.DVR_SEGMENT_SECONDS) for n in files[:-1])
+        return {"segments": len(files), "bytes": total, "seconds": round(seconds, 1)}
+
+    async def export(self, seconds):
+        """مقطع لآخر عدد من الثواني بالنسخ المباشر (concat) - بدون إعادة ترميز"""
+        # آخر ملف ما زال يُكتب - نأخذ المقاطع المكتملة فقط
+        files = self.segment_files()[:-1]
+        if not files:
+            return False, "⚠️ لا توجد مقاطع مسجلة بعد.", None
+        durations = self.durations()
+        chosen = []
+        covered = 0.0
+        for name in reversed(files):
+            chosen.append(name)
+            covered += durations.get(name, config.DVR_SEGMENT_SECONDS)
+            if covered >= seconds:
+                break
+        chosen.reverse()
+
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        concat_list = os.path.join(self.dir, f"clip_{stamp}.txt")
+        output = os.path.join(self.dir, f"clip_{stamp}.mp4")
+        with open(concat_list, "w") as f:
+            for name in chosen:
+                f.write(f"file '{os.path.join(self.dir, name)}'\n")
+
+        started = time.time()
+        done = False
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-hide_banner", "-nostdin", "-y",
+                "-f", "concat", "-safe", "0", "-i", concat_list,
+                "-map", "0", "-c", "copy",
+                "-movflags", "+faststart",
+                output,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=config.DVR_EXPORT_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return False, "❌ انتهت مهلة تجهيز المقطع", None
+            if process.returncode != 0:
+                error = stderr.decode(errors="replace").strip().splitlines()[-1:] or [f"code {process.returncode}"]
+                return False, f"❌ فشل تجهيز المقطع: {error[0][:200]}", None
+            done = True
+        finally:
+            # ملف ناقص بعد الفشل لا يبقى على القرص
+            for path in (concat_list,) if done else (concat_list, output):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        self.clips += 1
+        logger.info(f"✂️ مقطع {covered:.0f} ثانية ({len(chosen)} أجزاء) خلال {time.time() - started:.1f} ثانية")
+        return True, f"✂️ آخر {covered:.0f} ثانية", output
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def to_dict(self):
+        return {**self.stats(), "evicted": self.evicted, "clips": self.clips}
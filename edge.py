@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+import httpx
+import config
+from hls import MAX_PLAYLIST_BYTES, parse_media_playlist
+from probe import ProbeCache
+
+logger = logging.getLogger(__name__)
+
+# نتيجة القياس لكل مضيف - البدء التالي من نفس الخوادم لا يقيس من جديد
+edge_cache = ProbeCache(config.EDGE_CACHE_PATH, config.EDGE_CACHE_TTL)
+
+
+def host_of(url):
+    return urlparse(url).netloc
+
+
+def mirror_urls(url):
+    """نفس الرابط على المضيفات البديلة المعرّفة في EDGE_MIRRORS"""
+    parsed = urlparse(url)
+    for group in config.EDGE_MIRRORS:
+        if parsed.netloc in group:
+            return [parsed._replace(netloc=host).geturl() for host in group if host != parsed.netloc]
+    return []
+
+
+async def _read_playlist(client, url):
+    # قراءة محدودة كما في الوسيط - رابط TS مباشر لا ينتهي
+    body = b""
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            if len(body) > MAX_PLAYLIST_BYTES:
+                raise ValueError("ليس قائمة HLS")
+        final_url = str(response.url)
+    text = body.decode("utf-8", errors="replace")
+    if not text.lstrip("\ufeff").startswith("#EXTM3U"):
+        raise ValueError("ليس قائمة HLS")
+    return parse_media_playlist(text, final_url)
+
+
+async def _measure(client, url):
+    """زمن القائمة ثم تحميل مقطع على نفس الاتصال - الإنتاجية بعد أول بايت"""
+    started = time.perf_counter()
+    playlist = await _read_playlist(client, url)
+    playlist_ms = (time.perf_counter() - started) * 1000
+    if playlist["unsupported"] or not playlist["segments"]:
+        raise ValueError(playlist["unsupported"] or "قائمة بدون مقاطع")
+    # أحدث مقطع في البث المباشر هو ما سيُقرأ فعلاً، وأول مقطع في التسجيل
+    segment = playlist["segments"][0] if playlist["endlist"] else playlist["segments"][-1]
+
+    requested = time.perf_counter()
+    first_byte = None
+    size = 0
+    async with client.stream("GET", segment["url"]) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            size += len(chunk)
+            if size >= config.EDGE_SAMPLE_BYTES:
+                break
+    finished = time.perf_counter()
+    if not size:
+        raise ValueError("مقطع فارغ")
+
+    transfer = finished - first_byte
+    if transfer < 0.05:
+        # المقطع وصل في دفعة واحدة - زمن الطلب كاملاً أدق من فرق لحظي
+        transfer = max(finished - requested, 0.001)
+    throughput_kbps = size * 8 / 1000 / transfer
+    # كم مرة أسرع من الزمن الحقيقي - معدل المقطع من حجمه ومدته
+    segment_kbps = size * 8 / 1000 / segment["duration"] if segment["duration"] else None
+    return {
+        "playlist_ms": round(playlist_ms),
+        "ttfb_ms": round((first_byte - requested) * 1000),
+        "segment_ms": round((finished - requested) * 1000),
+        "bytes": size,
+        "throughput_kbps": round(throughput_kbps),
+        "speed": round(throughput_kbps / segment_kbps, 1) if segment_kbps else None,
+    }
+
+
+async def measure_source(client, url):
+    result = {"url": url, "host": host_of(url), "ok": False}
+    try:
+        result.update(await asyncio.wait_for(_measure(client, url), timeout=config.EDGE_TIMEOUT))
+        result["ok"] = True
+    except asyncio.TimeoutError:
+        result["error"] = "انتهت المهلة"
+    except Exception as e:
+        result["error"] = str(e)[:200]
+    return result
+
+
+async def select_edge(candidates, user_agent=None):
+    """قياس المرشحين معاً واختيار الأعلى إنتاجية - يرجع (الرابط، النتيجة أو None، كل النتائج)"""
+    candidates = list(dict.fromkeys(candidates))[:config.EDGE_MAX_CANDIDATES]
+    results = []
+    pending = []
+    for url in candidates:
+        cached = edge_cache.get(host_of(url))
+        if cached is not None:
+            results.append({**cached, "url": url, "cached": True})
+        else:
+            pending.append(url)
+
+    if pending:
+        # اتصال واحد لكل مضيف يعاد استخدامه بين القائمة والمقطع
+        async with httpx.AsyncClient(
+            headers={"User-Agent": user_agent} if user_agent else None,
+            timeout=httpx.Timeout(config.EDGE_TIMEOUT),
+            limits=httpx.Limits(max_connections=len(pending) * 2, max_keepalive_connections=len(pending) * 2),
+            follow_redirects=True,
+        ) as client:
+            measured = await asyncio.gather(*[measure_source(client, url) for url in pending])
+        for result in measured:
+            if result["ok"]:
+                edge_cache.set(result["host"], {k: v for k, v in result.items() if k != "url"})
+            else:
+                logger.info(f"🌐 {result['host']}: {result['error']}")
+        results.extend(measured)
+
+    working = [r for r in results if r["ok"]]
+    if not working:
+        return candidates[0], None, results
+    best = max(working, key=lambda r: r["throughput_kbps"])
+    default = next((r for r in working if r["url"] == candidates[0]), None)
+    if default is not None and best["throughput_kbps"] < default["throughput_kbps"] * config.EDGE_SWITCH_MARGIN:
+        # فرق صغير ضمن تذبذب القياس - البقاء على الرابط الذي أرسله المستخدم
+        best = default
+    logger.info(
+        f"🌐 أسرع مصدر: {best['host']} {best['throughput_kbps'] / 1000:.1f} Mbps "
+        f"(من {len(results)}، {len(pending)} قياس جديد)"
+    )
+    return best["url"], best, results
+
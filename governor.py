@@ -0,0 +1,134 @@
+import logging
+import os
+import time
+from collections import deque
+import config
+
+logger = logging.getLogger(__name__)
+
+# من الأرخص إلى الأغلى في استهلاك المعالج
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster"]
+
+
+def host_load():
+    """متوسط حمل المعالج لكل نواة خلال الدقيقة الأخيرة"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return 0.0
+
+
+class EncoderGovernor:
+    """اختيار الـ threads والـ preset حسب الأنوية المتاحة ومراقبة speed لتعديلها"""
+
+    def __init__(self, concurrent_streams=1):
+        self.decisions = deque(maxlen=50)
+        self.changes = 0
+        self.speeds = deque()
+        self.last_change = time.time()
+        self.profile = self.initial_profile(concurrent_streams)
+        # رفع الجودة لا يستحق إعادة اتصال RTMP - ينتظر إعادة التشغيل التالية لأي سبب
+        self.pending = None
+
+    @staticmethod
+    def initial_profile(concurrent_streams):
+        """توزيع الأنوية على البثوث الجارية"""
+        cores = os.cpu_count() or 1
+        per_stream = cores / max(1, concurrent_streams)
+        threads = max(1, min(config.GOVERNOR_MAX_THREADS, int(per_stream)))
+        if per_stream >= 4:
+            preset = "veryfast"
+        elif per_stream >= 2:
+            preset = "superfast"
+        else:
+            preset = "ultrafast"
+        return {
+            "preset": preset,
+            "threads": threads,
+            "filter_threads": max(1, threads // 2),
+        }
+
+    def _record(self, new_profile, reason, deferred=False):
+        old = self.profile
+        if deferred:
+            self.pending = new_profile
+        else:
+            self.profile = new_profile
+            self.pending = None
+        self.last_change = time.time()
+        self.speeds.clear()
+        self.changes += 1
+        decision = {
+            "time": self.last_change,
+            "from": dict(old),
+            "to": dict(new_profile),
+            "reason": reason,
+            "deferred": deferred,
+        }
+        self.decisions.append(decision)
+        logger.info(
+            f"🎚️ المنظم: {old['preset']}/{old['threads']}t → "
+            f"{new_profile['preset']}/{new_profile['threads']}t ({reason})"
+            f"{' - مع إعادة التشغيل التالية' if deferred else ''}"
+        )
+        return decision
+
+    def apply_pending(self):
+        """قبل تشغيل عملية جديدة: تطبيق رفع الجودة المؤجل"""
+        if self.pending is None:
+            return False
+        self.profile, self.pending = self.pending, None
+        return True
+
+    def step_down(self, reason):
+        """تقليل تكلفة الإطار: preset أسرع، ثم threads أكثر إن توفرت أنوية"""
+        profile = dict(self.profile)
+        level = PRESETS.index(profile["preset"])
+        cores = os.cpu_count() or 1
+        if level > 0:
+            profile["preset"] = PRESETS[level - 1]
+        elif profile["threads"] < min(cores, config.GOVERNOR_MAX_THREADS):
+            profile["threads"] += 1
+            profile["filter_threads"] = max(1, profile["threads"] // 2)
+        else:
+            return None
+        return self._record(profile, reason)
+
+    def step_up(self, reason):
+        """رفع الجودة عند وجود فائض في المعالج - مؤجل حتى إعادة التشغيل التالية"""
+        profile = dict(self.profile)
+        level = PRESETS.index(profile["preset"])
+        if level + 1 >= len(PRESETS):
+            return None
+        profile["preset"] = PRESETS[level + 1]
+        return self._record(profile, reason, deferred=True)
+
+    def observe(self, sample):
+        """تسجيل عينة speed - يرجع قراراً جديداً إذا تغير الإعداد"""
+        now = sample["time"]
+        self.speeds.append((now, sample["speed"]))
+        while self.speeds and now - self.speeds[0][0] > config.GOVERNOR_WINDOW:
+            self.speeds.popleft()
+
+        if now - self.last_change < config.GOVERNOR_COOLDOWN:
+            return None
+        # نافذة كاملة فقط - تجنب القرار من عينات البداية
+        if now - self.speeds[0][0] < config.GOVERNOR_WINDOW * 0.9:
+            return None
+
+        speeds = sorted(s for _, s in self.speeds)
+        median = speeds[len(speeds) // 2]
+        if median < config.GOVERNOR_MIN_SPEED:
+            return self.step_down(f"speed {median:.2f}x أقل من الوقت الحقيقي")
+        if self.pending is None and median >= 0.99 and host_load() < config.GOVERNOR_HEADROOM_LOAD:
+            self.step_up(f"فائض في المعالج (حمل {host_load():.0%})")
+        # فقط النزول يعيد التشغيل - الرفع ينتظر
+        return None
+
+    def to_dict(self):
+        return {
+            "profile": dict(self.profile),
+            "pending": dict(self.pending) if self.pending else None,
+            "changes": self.changes,
+            "decisions": list(self.decisions),
+        }
@@ -0,0 +1,172 @@
+import logging
+import re
+import time
+import urllib.request
+from collections import OrderedDict
+from urllib.parse import urljoin
+
+logger = logging.getLogger(__name__)
+
+MAX_PLAYLIST_BYTES = 256 * 1024
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class TTLCache:
+    """ذاكرة مؤقتة صغيرة (LRU) مع مدة صلاحية لكل عنصر"""
+
+    def __init__(self, ttl, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.items = OrderedDict()
+
+    def get(self, key):
+        entry = self.items.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.time() - stored_at > self.ttl:
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.items[key] = (time.time(), value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_entries:
+            self.items.popitem(last=False)
+
+    def invalidate(self, key):
+        self.items.pop(key, None)
+
+
+def parse_attributes(line):
+    """تحليل قائمة الخصائص في سطر مثل #EXT-X-STREAM-INF"""
+    _, _, attrs = line.partition(":")
+    return {k: v.strip('"') for k, v in ATTRIBUTE_RE.findall(attrs)}
+
+
+def is_master_playlist(text):
+    return "#EXT-X-STREAM-INF" in text
+
+
+def parse_master_playlist(text, base_url):
+    """استخراج الجودات المتاحة من قائمة HLS الرئيسية"""
+    variants = []
+    audio_groups = set()
+    pending = None
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA:"):
+            attrs = parse_attributes(line)
+            if attrs.get("TYPE") == "AUDIO" and attrs.get("URI"):
+                audio_groups.add(attrs.get("GROUP-ID"))
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            pending = parse_attributes(line)
+        elif pending is not None and not line.startswith("#"):
+            width, height = 0, 0
+            if "x" in pending.get("RESOLUTION", ""):
+                w, _, h = pending["RESOLUTION"].partition("x")
+                width, height = int(w or 0), int(h or 0)
+            variants.append({
+                "url": urljoin(base_url, line),
+                "bandwidth": int(pending.get("AVERAGE-BANDWIDTH") or pending.get("BANDWIDTH") or 0),
+                "width": width,
+                "height": height,
+                "fps": float(pending.get("FRAME-RATE") or 0),
+                "codecs": pending.get("CODECS", ""),
+                "audio_group": pending.get("AUDIO"),
+            })
+            pending = None
+
+    # الصوت المنفصل في مجموعة EXT-X-MEDIA لا يصل إذا مررنا قائمة الفيديو وحدها
+    for v in variants:
+        v["separate_audio"] = v["audio_group"] in audio_groups
+    return variants
+
+
+def select_variant(variants, width, height, fps, bitrate_kbps):
+    """اختيار الجودة الأقرب لدقة ومعدل إطارات ومعدل بت المخرج"""
+    target_bw = bitrate_kbps * 1000
+
+    def score(v):
+        penalty = 0.0
+        if v["height"]:
+            if v["height"] >= height:
+                penalty += (v["height"] - height) / height
+            else:
+                # التكبير يضيّع الجودة - عقوبة مضاعفة
+                penalty += 2 * (height - v["height"]) / height
+        if v["fps"]:
+            penalty += abs(v["fps"] - fps) / fps
+        if v["bandwidth"]:
+            penalty += 0.5 * abs(v["bandwidth"] - target_bw) / target_bw
+        return penalty, v["bandwidth"]
+
+    candidates = [v for v in variants if not v["separate_audio"]]
+    if not candidates:
+        return None
+    return min(candidates, key=score)
+
+
+def parse_media_playlist(text, base_url):
+    """تحليل قائمة المقاطع (media playlist) مع أرقام التسلسل"""
+    playlist = {
+        "target_duration": 0.0,
+        "media_sequence": 0,
+        "segments": [],
+        "endlist": False,
+        "unsupported": None,
+    }
+    duration = None
+    seq = None
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            playlist["target_duration"] = float(line.split(":", 1)[1] or 0)
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            playlist["media_sequence"] = int(line.split(":", 1)[1] or 0)
+        elif line.startswith("#EXT-X-ENDLIST"):
+            playlist["endlist"] = True
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            playlist["unsupported"] = "master playlist"
+        elif line.startswith("#EXT-X-MAP:"):
+            playlist["unsupported"] = "fMP4 (EXT-X-MAP)"
+        elif line.startswith("#EXT-X-KEY:") and "METHOD=NONE" not in line:
+            playlist["unsupported"] = "encrypted (EXT-X-KEY)"
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",")[0] or 0)
+        elif not line.startswith("#"):
+            if seq is None:
+                seq = playlist["media_sequence"]
+            playlist["segments"].append({
+                "url": urljoin(base_url, line),
+                "duration": duration or playlist["target_duration"],
+                "seq": seq,
+            })
+            seq += 1
+            duration = None
+    return playlist
+
+
+def fetch_playlist(url, user_agent=None, timeout=10):
+    """تحميل قائمة M3U8 - يرجع None إذا لم يكن الرابط قائمة HLS"""
+    headers = {"User-Agent": user_agent} if user_agent else {}
+    try:
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read(MAX_PLAYLIST_BYTES)
+            final_url = response.geturl()
+    except Exception as e:
+        logger.warning(f"⚠️ تعذر تحميل القائمة: {e}")
+        return None, url
+
+    text = body.decode("utf-8", errors="replace")
+    if not text.lstrip("\ufeff").startswith("#EXTM3U"):
+        return None, final_url
+    return text, final_url
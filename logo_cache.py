@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import config
+
+logger = logging.getLogger(__name__)
+
+BBOX_RE = re.compile(r"x1:(\d+) x2:(\d+) y1:(\d+) y2:(\d+) w:(\d+) h:(\d+)")
+
+
+def cache_key(opacity):
+    """بصمة ملف اللوجو مع إعدادات الحجم والشفافية"""
+    digest = hashlib.sha256()
+    with open(config.LOGO_PATH, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    digest.update(f"{config.LOGO_SIZE}|{opacity}".encode())
+    return digest.hexdigest()[:16]
+
+
+async def _run_ffmpeg(args):
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-nostdin", *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    return process.returncode, stderr.decode(errors="replace")
+
+
+async def _render(key, path, opacity):
+    """رسم اللوجو مرة واحدة بحجمه وشفافيته النهائية، مقصوصاً إلى الجزء غير الشفاف"""
+    full_path = os.path.join(config.LOGO_CACHE_DIR, f"{key}_full.png")
+    code, err = await _run_ffmpeg([
+        "-y", "-i", config.LOGO_PATH,
+        "-vf", (
+            f"scale={config.LOGO_SIZE}:force_original_aspect_ratio=decrease,"
+            f"format=rgba,colorchannelmixer=aa={opacity}"
+        ),
+        "-frames:v", "1", full_path,
+    ])
+    if code != 0:
+        raise RuntimeError(err.strip()[-200:])
+
+    # bbox على قناة الشفافية يحدد المستطيل الذي يحتاج الدمج فعلاً
+    code, err = await _run_ffmpeg([
+        "-i", full_path,
+        "-vf", "alphaextract,bbox=min_val=1,showinfo",
+        "-f", "null", "-",
+    ])
+    size = re.search(r"s:(\d+)x(\d+)", err)
+    box = BBOX_RE.search(err)
+    full_w, full_h = (int(size.group(1)), int(size.group(2))) if size else (0, 0)
+
+    meta = {"path": full_path, "full_w": full_w, "full_h": full_h, "x1": 0, "y1": 0}
+    if box and size:
+        x1, _, y1, _, w, h = (int(v) for v in box.groups())
+        if (w, h) != (full_w, full_h):
+            code, err = await _run_ffmpeg([
+                "-y", "-i", full_path,
+                "-vf", f"crop={w}:{h}:{x1}:{y1}",
+                "-frames:v", "1", path,
+            ])
+            if code == 0:
+                meta.update({"path": path, "x1": x1, "y1": y1})
+    elif size is None:
+        meta = None
+    return meta
+
+
+async def prepare_logo(opacity=None, force=False):
+    """مسار اللوجو المجهز من الذاكرة على القرص (يُرسم فقط عند تغير الملف أو الإعدادات)"""
+    if not ((force or config.LOGO_ENABLED) and os.path.exists(config.LOGO_PATH)):
+        return None
+    if opacity is None:
+        opacity = config.LOGO_OPACITY
+    try:
+        os.makedirs(config.LOGO_CACHE_DIR, exist_ok=True)
+        key = cache_key(opacity)
+        meta_path = os.path.join(config.LOGO_CACHE_DIR, f"{key}.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if os.path.exists(meta["path"]):
+                return meta
+
+        meta = await _render(key, os.path.join(config.LOGO_CACHE_DIR, f"{key}.png"), opacity)
+        if meta is None:
+            return None
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        logger.info(f"🖼️ تم تجهيز اللوجو ({meta['full_w']}x{meta['full_h']}) في الذاكرة المؤقتة")
+        return meta
+    except Exception as e:
+        logger.warning(f"⚠️ تعذر تجهيز اللوجو: {e}")
+        return None
+
+
+def overlay_position(meta, offset_x=None, offset_y=None):
+    """موضع اللوجو المقصوص بحيث يبقى في نفس مكان اللوجو الكامل"""
+    ox = config.LOGO_OFFSET_X if offset_x is None else offset_x
+    oy = config.LOGO_OFFSET_Y if offset_y is None else offset_y
+    if ox < 0:
+        x = f"W-{meta['full_w'] + abs(ox) - meta['x1']}"
+    else:
+        x = str(ox + meta["x1"])
+    if oy < 0:
+        y = f"H-{meta['full_h'] + abs(oy) - meta['y1']}"
+    else:
+        y = str(oy + meta["y1"])
+    return x, y
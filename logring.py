@@ -0,0 +1,86 @@
+import logging
+import os
+import time
+from collections import deque
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class LogRing:
+    """حلقة ثابتة الحجم لمخرجات FFmpeg مع حفظ محدود المعدل على القرص"""
+
+    def __init__(self, path=None, max_lines=None):
+        self.path = path
+        self.events = deque(maxlen=max_lines or config.LOG_RING_LINES)
+        self.pending = []
+        self.partial = b""
+        self.total_lines = 0
+        self.last_flush = 0.0
+
+    def feed(self, chunk):
+        """إضافة جزء من stderr - الأسطر غير المكتملة تنتظر الجزء التالي، ويرجع أسطر الأحداث الجديدة"""
+        data = (self.partial + chunk).replace(b"\r", b"\n")
+        lines = data.split(b"\n")
+        self.partial = lines.pop()
+        if len(self.partial) > 4096:
+            # سطر بدون نهاية - لا نسمح له بالنمو بلا حد
+            lines.append(self.partial)
+            self.partial = b""
+        added = [text for text in map(self._add, lines) if text is not None]
+        if self.pending and time.time() - self.last_flush >= config.LOG_FLUSH_INTERVAL:
+            self.flush()
+        return added
+
+    def _add(self, raw):
+        line = raw.strip()
+        if not line:
+            return None
+        text = line.decode(errors="replace")
+        self.total_lines += 1
+        entry = (time.time(), text)
+        self.events.append(entry)
+        if self.path:
+            self.pending.append(entry)
+            if len(self.pending) > self.events.maxlen:
+                # القرص متأخر - الأقدم يسقط كما في الحلقة
+                del self.pending[0]
+        return text
+
+    def close(self):
+        """نهاية العملية - إضافة آخر سطر ناقص وحفظ الباقي"""
+        if self.partial:
+            self._add(self.partial)
+            self.partial = b""
+        self.flush()
+
+    def tail(self, count=5):
+        """آخر الأسطر (تحذيرات وأخطاء فقط) دون قراءة أي ملف"""
+        # نسخة أولاً - خيط الويب يقرأ بينما حلقة البوت تضيف
+        events = list(self.events)
+        return [text for _, text in events[-count:]] if count > 0 else []
+
+    def flush(self):
+        """إلحاق الأسطر الجديدة بالملف مع تدوير عند تجاوز الحجم"""
+        self.last_flush = time.time()
+        if not self.path or not self.pending:
+            return
+        entries, self.pending = self.pending, []
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= config.LOG_FILE_MAX_BYTES:
+                # نسخة احتياطية واحدة - القرص لا يتجاوز ضعف الحد
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                for stamp, text in entries:
+                    f.write(f"{time.strftime('%H:%M:%S', time.localtime(stamp))} {text}\n")
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر حفظ اللوج {self.path}: {e}")
+
+    def to_dict(self):
+        """للحالة العامة - بدون الأسطر نفسها: أخطاء FFmpeg تحمل روابط RTMP ومفاتيح البث
+
+        التقدم (fps و speed) في telemetry من -progress - stderr يعمل مع -nostats
+        """
+        return {
+            "lines": self.total_lines,
+        }
@@ -0,0 +1,229 @@
+import logging
+import time
+from collections import deque
+import config
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# من الأعلى إلى الأقل - أقل ذاكرة لكل بث (RSS متوقع لـ FFmpeg) وأحجام الطوابير
+TIERS = [
+    {"height": 1080, "width": 1920, "min_mb": 420, "muxing_queue": 1024, "thread_queue": 512, "threads": 4},
+    {"height": 720, "width": 1280, "min_mb": 220, "muxing_queue": 512, "thread_queue": 256, "threads": 2},
+    {"height": 540, "width": 960, "min_mb": 150, "muxing_queue": 256, "thread_queue": 128, "threads": 2},
+    {"height": 360, "width": 640, "min_mb": 0, "muxing_queue": 128, "thread_queue": 64, "threads": 1},
+]
+
+# ملفات cgroup v2 ثم v1
+CGROUP_LIMIT_FILES = ["/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"]
+CGROUP_USAGE_FILES = [
+    ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.stat", "inactive_file"),
+    ("/sys/fs/cgroup/memory/memory.usage_in_bytes", "/sys/fs/cgroup/memory/memory.stat", "total_inactive_file"),
+]
+
+
+def _read_int(path):
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if not value.isdigit():
+        # "max" في cgroup v2 يعني بدون حد
+        return None
+    return int(value)
+
+
+def _meminfo_total():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def container_limit():
+    """حد الذاكرة للحاوية بالبايت: الإعداد اليدوي ثم cgroup ثم ذاكرة الجهاز"""
+    if config.MEMORY_LIMIT_MB:
+        return config.MEMORY_LIMIT_MB * MB
+    host = _meminfo_total()
+    for path in CGROUP_LIMIT_FILES:
+        limit = _read_int(path)
+        # cgroup v1 بدون حد يعطي رقماً ضخماً
+        if limit is not None and (host is None or limit < host):
+            return limit
+    return host
+
+
+def _stat_value(path, key):
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(" ")
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def container_usage():
+    """ذاكرة الحاوية المستخدمة دون كاش الملفات القابل للتحرير (working set)"""
+    for usage_path, stat_path, inactive_key in CGROUP_USAGE_FILES:
+        usage = _read_int(usage_path)
+        if usage is not None:
+            return max(0, usage - _stat_value(stat_path, inactive_key))
+    return None
+
+
+def process_rss(pid):
+    """الذاكرة المقيمة الحالية لعملية من /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class MemoryBudget:
+    """تقسيم ذاكرة الحاوية على البثوث واختيار الدقة والطوابير حسب نصيب كل بث"""
+
+    def __init__(self, concurrent_streams=1):
+        self.limit = container_limit()
+        self.concurrent = max(1, concurrent_streams)
+        self.rss = None
+        self.peak_rss = 0
+        self.usage = None
+        self.over = 0
+        self.last_sample = 0.0
+        self.last_change = 0.0
+        self.degradations = deque(maxlen=20)
+        self.tier = self.initial_tier()
+
+    def budget_bytes(self):
+        """نصيب البث الواحد بعد حجز ذاكرة البوت"""
+        if self.limit is None:
+            return None
+        available = self.limit - config.MEMORY_RESERVE_MB * MB
+        return max(0, available // self.concurrent)
+
+    def initial_tier(self):
+        """أعلى مستوى يسمح به النصيب - المستويات الأعلى من الدقة المطلوبة تُقص إليها بدل تخطيها"""
+        budget = self.budget_bytes()
+        # أصغر مستوى يغطي الدقة المطلوبة - ما فوقه لا يضيف إلا طوابير أكبر بنفس الدقة
+        first = max(
+            (index for index, tier in enumerate(TIERS) if tier["height"] >= config.RESOLUTION_HEIGHT),
+            default=0,
+        )
+        for index in range(first, len(TIERS)):
+            if budget is None or budget >= TIERS[index]["min_mb"] * MB:
+                return index
+        return len(TIERS) - 1
+
+    def profile(self, index=None):
+        tier = dict(TIERS[self.tier if index is None else index])
+        if tier["height"] >= config.RESOLUTION_HEIGHT:
+            # المستوى يتسع للدقة المطلوبة - الحفاظ على الأبعاد المضبوطة في الإعدادات
+            tier["width"] = config.RESOLUTION_WIDTH
+            tier["height"] = config.RESOLUTION_HEIGHT
+        return tier
+
+    def relay_buffer_bytes(self):
+        """مخزن الوسيط يعيش في عملية البوت - لا يتجاوز ربع النصيب"""
+        budget = self.budget_bytes()
+        if budget is None:
+            return config.RELAY_BUFFER_BYTES
+        return max(4 * MB, min(config.RELAY_BUFFER_BYTES, budget // 4))
+
+    def _move(self, index, reason, queues_only=False):
+        old = self.profile()
+        self.tier = index
+        self.over = 0
+        self.last_change = time.time()
+        new = self.profile()
+        decision = {
+            "time": self.last_change, "from": old["height"], "to": new["height"], "reason": reason,
+            "queues_only": queues_only,
+        }
+        self.degradations.append(decision)
+        if queues_only:
+            logger.warning(
+                f"🧠 الذاكرة: طوابير {old['muxing_queue']} → {new['muxing_queue']} "
+                f"مع إعادة التشغيل التالية ({reason})"
+            )
+        else:
+            logger.warning(f"🧠 الذاكرة: {old['height']}p → {decision['to']}p ({reason})")
+        return decision
+
+    def degrade(self, reason, queues_only=False):
+        if self.tier + 1 >= len(TIERS):
+            return None
+        return self._move(self.tier + 1, reason, queues_only)
+
+    def rebalance(self, concurrent_streams, queues_only=False):
+        """بث جديد يقسم الذاكرة على عدد أكبر - قرار تخفيض إذا لم يعد المستوى الحالي يتسع في النصيب"""
+        previous = self.concurrent
+        self.concurrent = max(1, concurrent_streams)
+        tier = self.initial_tier()
+        if tier <= self.tier:
+            return None
+        budget = self.budget_bytes()
+        return self._move(tier, f"نصيب {budget / MB:.0f}MB بعد قبول بث جديد ({previous} → {self.concurrent} بث)", queues_only)
+
+    def observe(self, pid, queues_only=False):
+        """عينة RSS للعملية - يرجع قرار تخفيض عند الاقتراب من الحد
+
+        queues_only: النسخ المباشر لا يغير الدقة - التخفيض يصغر الطوابير للتشغيل التالي فقط
+        """
+        now = time.time()
+        if now - self.last_sample < config.MEMORY_SAMPLE_INTERVAL:
+            return None
+        self.last_sample = now
+        self.rss = process_rss(pid)
+        self.usage = container_usage()
+        if self.rss is None:
+            return None
+        self.peak_rss = max(self.peak_rss, self.rss)
+
+        budget = self.budget_bytes()
+        if budget is None:
+            return None
+        near_budget = self.rss > budget * config.MEMORY_DEGRADE_RATIO
+        near_limit = self.usage is not None and self.usage > self.limit * config.MEMORY_DEGRADE_RATIO
+        # عينات متتالية - تجنب ردة الفعل على قفزة مؤقتة
+        self.over = self.over + 1 if near_budget or near_limit else 0
+        if self.over < 3 or now - self.last_change < config.MEMORY_COOLDOWN:
+            return None
+        if near_budget:
+            return self.degrade(f"RSS {self.rss / MB:.0f}MB من نصيب {budget / MB:.0f}MB", queues_only)
+        return self.degrade(f"الحاوية {self.usage / MB:.0f}MB من {self.limit / MB:.0f}MB", queues_only)
+
+    def headroom_bytes(self):
+        if self.limit is None:
+            return None
+        if self.usage is not None:
+            return self.limit - self.usage
+        budget = self.budget_bytes()
+        return budget - (self.rss or 0)
+
+    def to_dict(self):
+        def mb(value):
+            return round(value / MB, 1) if value is not None else None
+
+        return {
+            "limit_mb": mb(self.limit),
+            "budget_mb": mb(self.budget_bytes()),
+            "rss_mb": mb(self.rss),
+            "peak_rss_mb": mb(self.peak_rss),
+            "container_usage_mb": mb(self.usage),
+            "headroom_mb": mb(self.headroom_bytes()),
+            "tier": self.profile(),
+            "degradations": list(self.degradations),
+        }
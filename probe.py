@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import os
+import config
+from hls import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# الترميزات التي يقبلها FLV/RTMP كما هي
+FLV_VIDEO_CODECS = {"h264"}
+FLV_AUDIO_CODECS = {"aac"}
+FLV_SAMPLE_RATES = {44100, 48000}
+
+
+def _parse_rate(rate):
+    """تحويل معدل الإطارات من صيغة 30000/1001 إلى رقم"""
+    try:
+        num, _, den = str(rate).partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+async def probe_stream(url, user_agent=None, timeout=None):
+    """فحص المصدر بـ ffprobe وإرجاع وصف مسارات الفيديو والصوت"""
+    cmd = ["ffprobe", "-v", "error"]
+    if user_agent:
+        cmd.extend(["-user_agent", user_agent])
+    cmd.extend([
+        "-rw_timeout", "10000000",
+        "-analyzeduration", "1000000",
+        "-probesize", "1000000",
+        "-show_streams",
+        "-of", "json",
+        url,
+    ])
+    process = None
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await asyncio.wait_for(
+            process.communicate(),
+            timeout=timeout or config.PROBE_TIMEOUT
+        )
+        if process.returncode != 0:
+            logger.warning(f"⚠️ فشل فحص المصدر: {stderr.decode(errors='replace').strip()[:200]}")
+            return None
+        streams = json.loads(stdout).get("streams", [])
+    except asyncio.TimeoutError:
+        logger.warning("⚠️ انتهت مهلة فحص المصدر")
+        process.kill()
+        await process.wait()
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ تعذر فحص المصدر: {e}")
+        return None
+
+    info = {"video": None, "audio": None}
+    for s in streams:
+        kind = s.get("codec_type")
+        if kind == "video" and info["video"] is None:
+            info["video"] = {
+                "index": s.get("index"),
+                "codec": s.get("codec_name"),
+                "width": s.get("width"),
+                "height": s.get("height"),
+                "fps": _parse_rate(s.get("avg_frame_rate") or s.get("r_frame_rate")),
+                "pix_fmt": s.get("pix_fmt"),
+            }
+        elif kind == "audio" and info["audio"] is None:
+            info["audio"] = {
+                "index": s.get("index"),
+                "codec": s.get("codec_name"),
+                "sample_rate": int(s.get("sample_rate") or 0),
+                "channels": s.get("channels"),
+            }
+    return info
+
+
+def check_compatibility(info):
+    """تحديد المسارات التي يمكن نسخها بدون إعادة ترميز (copy_video, copy_audio)"""
+    if not info:
+        return False, False
+
+    video = info.get("video")
+    copy_video = bool(
+        video
+        and video["codec"] in FLV_VIDEO_CODECS
+        and video["width"] == config.RESOLUTION_WIDTH
+        and video["height"] == config.RESOLUTION_HEIGHT
+        and abs(video["fps"] - config.OUTPUT_FPS) < 0.5
+        and video["pix_fmt"] in ("yuv420p", "yuvj420p")
+    )
+
+    audio = info.get("audio")
+    copy_audio = bool(
+        audio
+        and audio["codec"] in FLV_AUDIO_CODECS
+        and audio["sample_rate"] in FLV_SAMPLE_RATES
+        and (audio["channels"] or 0) <= 2
+    )
+    return copy_video, copy_audio
+
+
+class ProbeCache(TTLCache):
+    """ذاكرة LRU لنتائج الفحص لكل مصدر - تُحفظ في ملف لتبقى بعد إعادة تشغيل البوت"""
+
+    def __init__(self, path, ttl, max_entries=64):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for key, (stored_at, value) in json.load(f).items():
+                    self.items[key] = (stored_at, value)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ تعذر قراءة ذاكرة الفحص: {e}")
+
+    def _save(self):
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(dict(self.items), f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر حفظ ذاكرة الفحص: {e}")
+
+    def set(self, key, value):
+        super().set(key, value)
+        self._save()
+
+    def invalidate(self, key):
+        if key in self.items:
+            super().invalidate(key)
+            self._save()
@@ -0,0 +1,500 @@
+import asyncio
+import logging
+import time
+from collections import deque
+import httpx
+import config
+from hls import MAX_PLAYLIST_BYTES, parse_media_playlist
+
+logger = logging.getLogger(__name__)
+
+TS_PACKET = 188
+
+
+def ts_layout(data):
+    """رقم البرنامج و PID جدول PMT والمسارات (PID، النوع) من أول PAT/PMT في مقطع TS - None إذا لم يوجدا"""
+    program = pmt_pid = None
+    for offset in range(0, len(data) - TS_PACKET + 1, TS_PACKET):
+        packet = data[offset:offset + TS_PACKET]
+        if packet[0] != 0x47:
+            return None
+        # الجداول تبدأ في حزمة عليها payload_unit_start
+        if not packet[1] & 0x40:
+            continue
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        control = (packet[3] >> 4) & 0x3
+        if not control & 0x1:
+            continue
+        pos = 4 + (1 + packet[4] if control & 0x2 else 0)
+        if pos >= TS_PACKET:
+            continue
+        section = packet[pos + 1 + packet[pos]:]
+        if len(section) < 12:
+            continue
+        end = min(len(section), 3 + (((section[1] & 0x0F) << 8) | section[2]) - 4)
+        if pid == 0 and section[0] == 0x00 and pmt_pid is None:
+            for i in range(8, end - 3, 4):
+                number = (section[i] << 8) | section[i + 1]
+                # البرنامج 0 هو جدول الشبكة (NIT)
+                if number:
+                    program, pmt_pid = number, ((section[i + 2] & 0x1F) << 8) | section[i + 3]
+                    break
+        elif pid == pmt_pid and section[0] == 0x02:
+            streams = []
+            i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+            while i + 5 <= end:
+                streams.append([((section[i + 1] & 0x1F) << 8) | section[i + 2], section[i]])
+                i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
+            return {"program": program, "pmt_pid": pmt_pid, "streams": sorted(streams)}
+    return None
+
+
+def same_layout(a, b):
+    """نفس PID ونفس الأنواع - تخطيط غير معروف لا يُعتبر اختلافاً"""
+    return a is None or b is None or a == b
+
+
+class HlsRelay:
+    """وسيط HLS محلي: يجلب المقاطع مسبقاً إلى ذاكرة محدودة ويغذي FFmpeg عبر loopback"""
+
+    def __init__(self, playlist_url, user_agent=None, name="relay", max_bytes=None):
+        self.playlist_url = playlist_url
+        self.user_agent = user_agent
+        self.name = name
+        self.max_bytes = max_bytes or config.RELAY_BUFFER_BYTES
+        self.buffer = deque()
+        self.buffer_bytes = 0
+        self.data_ready = asyncio.Event()
+        self.space_ready = asyncio.Event()
+        # القائمة انتهت (#EXT-X-ENDLIST) - المصدر التالي يمكن أن يبدأ
+        self.finished = asyncio.Event()
+        self.last_seq = None
+        self.target_duration = 2.0
+        self.client = None
+        self.server = None
+        self.port = None
+        self.poll_task = None
+        self.consumer = None
+        self.running = False
+        # المصدر الذي يغذي الذاكرة الآن: primary أو backup أو slate
+        self.active = "primary"
+        self.last_new_at = time.time()
+        self.primary_newest = -1
+        self.recovering = 0
+        self.standby = None
+        self.standby_task = None
+        self.slate = None
+        self.slate_until = 0.0
+        self.low_since = None
+        self.monitor_task = None
+        self.failovers = deque(maxlen=20)
+        # تنبيه (نص) عند التبديل بين المصادر
+        self.on_switch = None
+        # تخطيط TS (PAT/PMT) الذي يقرأه FFmpeg الآن - FFmpeg لا يعيد ربط المسارات إذا تغيرت PID
+        self.layout = None
+        # يُستدعى عند وصول مقاطع بتخطيط مختلف - المرمّز يحتاج إعادة تشغيل
+        self.on_layout_change = None
+        self.stats = {
+            "segments_fetched": 0,
+            "bytes_fetched": 0,
+            "segments_sent": 0,
+            "fetch_errors": 0,
+            "underruns": 0,
+            "switches": 0,
+            "failovers": 0,
+            "layout_changes": 0,
+            "last_fetch_time": None,
+        }
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/{self.name}.ts"
+
+    def buffered_seconds(self):
+        return sum(seg["duration"] for seg in list(self.buffer))
+
+    async def start(self, port=0):
+        """تحميل القائمة أول مرة وفتح منفذ loopback - يرجع (نجاح، سبب)"""
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": self.user_agent} if self.user_agent else None,
+            timeout=httpx.Timeout(config.RELAY_FETCH_TIMEOUT),
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+            follow_redirects=True,
+        )
+        try:
+            playlist = await self._fetch_playlist()
+        except Exception as e:
+            await self.client.aclose()
+            return False, f"تعذر تحميل القائمة: {e}"
+        if playlist["unsupported"] or not playlist["segments"]:
+            await self.client.aclose()
+            return False, playlist["unsupported"] or "قائمة بدون مقاطع"
+
+        self._set_start(playlist)
+        try:
+            # أول مقطع يحدد تخطيط TS قبل تجهيز شاشة الانتظار
+            first = self._start_segments(playlist)[0]
+            self._push({"seq": first["seq"], "duration": first["duration"], "data": await self._fetch_segment(first)})
+            self.last_seq = first["seq"]
+        except Exception as e:
+            logger.warning(f"⚠️ الوسيط {self.name}: {e}")
+        # منفذ محدد عند تبني مرمّز من تشغيل سابق - يعيد الاتصال بنفس العنوان
+        try:
+            self.server = await asyncio.start_server(self._serve, "127.0.0.1", port)
+        except OSError:
+            await self.client.aclose()
+            raise
+        self.running = True
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.poll_task = asyncio.create_task(self._poll_loop(playlist))
+        self.monitor_task = asyncio.create_task(self._failover_loop())
+        logger.info(f"📦 الوسيط {self.name} يعمل على {self.url}")
+        return True, ""
+
+    @staticmethod
+    def _start_segments(playlist):
+        # البدء قرب الحافة الحية مثل live_start_index في FFmpeg
+        segments = playlist["segments"]
+        return segments[-config.RELAY_START_SEGMENTS:] if not playlist["endlist"] else segments
+
+    def _set_start(self, playlist):
+        self.last_seq = self._start_segments(playlist)[0]["seq"] - 1
+        self.primary_newest = playlist["segments"][-1]["seq"]
+
+    async def switch(self, playlist_url, flush=True):
+        """تبديل المصدر دون قطع اتصال FFmpeg - مقاطع المصدر الجديد تُكمل نفس تيار TS"""
+        old_url = self.playlist_url
+        self.playlist_url = playlist_url
+        try:
+            playlist = await self._fetch_playlist()
+        except Exception as e:
+            self.playlist_url = old_url
+            return False, f"تعذر تحميل القائمة: {e}"
+        if playlist["unsupported"] or not playlist["segments"]:
+            self.playlist_url = old_url
+            return False, playlist["unsupported"] or "قائمة بدون مقاطع"
+        if self.layout is not None:
+            # مصدر من خادم آخر بـ PID مختلفة يوقف المخرج - التبديل عندها بإعادة تشغيل المرمّز
+            try:
+                data = await self._fetch_segment(self._start_segments(playlist)[0])
+            except Exception as e:
+                self.playlist_url = old_url
+                return False, f"تعذر تحميل مقطع: {e}"
+            if not same_layout(ts_layout(data), self.layout):
+                self.playlist_url = old_url
+                return False, "تخطيط MPEG-TS مختلف (PID/PMT)"
+
+        if self.poll_task:
+            self.poll_task.cancel()
+            try:
+                await self.poll_task
+            except asyncio.CancelledError:
+                pass
+        # flush: تخطٍ فوري بحذف ما تبقى من المصدر القديم، وإلا يُشغل حتى نهايته
+        if flush:
+            self.buffer.clear()
+            self.buffer_bytes = 0
+            self.space_ready.set()
+        self._set_start(playlist)
+        self.finished.clear()
+        self.active = "primary"
+        self.last_new_at = time.time()
+        self.stats["switches"] += 1
+        self.poll_task = asyncio.create_task(self._poll_loop(playlist))
+        logger.info(f"🔀 الوسيط {self.name}: مصدر جديد")
+        return True, ""
+
+    async def set_backup(self, playlist_url):
+        """مصدر احتياطي دافئ: قائمته تُحدّث باستمرار وأحدث مقطع محمّل مسبقاً"""
+        playlist = await self._fetch_playlist(playlist_url)
+        if playlist["unsupported"] or not playlist["segments"]:
+            return False, playlist["unsupported"] or "قائمة بدون مقاطع"
+        await self.clear_backup()
+        self.standby = {
+            "url": playlist_url,
+            "target_duration": playlist["target_duration"] or 2.0,
+            "newest_seq": -1,
+            "last_seq": None,
+            "last_new_at": 0.0,
+            "warm": None,
+            "errors": 0,
+        }
+        self.standby_task = asyncio.create_task(self._standby_loop(self.standby, playlist))
+        return True, ""
+
+    async def clear_backup(self):
+        if self.standby_task:
+            self.standby_task.cancel()
+        self.standby_task = None
+        self.standby = None
+        if self.active == "backup":
+            self._activate("slate" if self.slate else "primary", "حذف الاحتياطي")
+
+    async def stop(self):
+        self.running = False
+        for task in (self.standby_task, self.monitor_task):
+            if task:
+                task.cancel()
+        if self.poll_task:
+            self.poll_task.cancel()
+        if self.consumer:
+            self.consumer.close()
+        if self.server:
+            self.server.close()
+        if self.client:
+            await self.client.aclose()
+        self.buffer.clear()
+        self.buffer_bytes = 0
+
+    async def _fetch_playlist(self, url=None):
+        # قراءة محدودة - رابط TS مباشر لا ينتهي
+        body = b""
+        async with self.client.stream("GET", url or self.playlist_url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > MAX_PLAYLIST_BYTES:
+                    raise ValueError("ليس قائمة HLS")
+            final_url = str(response.url)
+        text = body.decode("utf-8", errors="replace")
+        if not text.lstrip("\ufeff").startswith("#EXTM3U"):
+            raise ValueError("ليس قائمة HLS")
+        return parse_media_playlist(text, final_url)
+
+    def _has_space(self):
+        return (
+            len(self.buffer) < config.RELAY_BUFFER_SEGMENTS
+            and self.buffer_bytes < self.max_bytes
+        )
+
+    async def _fetch_segment(self, segment):
+        response = await self.client.get(segment["url"])
+        response.raise_for_status()
+        data = response.content
+        self.stats["segments_fetched"] += 1
+        self.stats["bytes_fetched"] += len(data)
+        self.stats["last_fetch_time"] = time.time()
+        return data
+
+    async def _poll_loop(self, playlist):
+        """جلب المقاطع الجديدة فور ظهورها مع الضغط العكسي عند امتلاء الذاكرة"""
+        while self.running:
+            try:
+                if playlist is None:
+                    playlist = await self._fetch_playlist()
+                if playlist["target_duration"]:
+                    self.target_duration = playlist["target_duration"]
+                segments = playlist["segments"]
+                advanced = bool(segments) and segments[-1]["seq"] > self.primary_newest
+                if advanced:
+                    self.primary_newest = segments[-1]["seq"]
+                    self.last_new_at = time.time()
+                if self.active != "primary":
+                    # الأساسي يُراقب فقط - العودة بعد تحديثين متتاليين بمقاطع جديدة
+                    self.recovering = self.recovering + 1 if advanced else 0
+                    if self.recovering < config.FAILBACK_POLLS:
+                        segments = []
+                    else:
+                        self.last_seq = self.primary_newest - 1
+                        self._activate("primary", "عاد المصدر الأساسي")
+                for segment in segments:
+                    if segment["seq"] <= self.last_seq:
+                        continue
+                    while not self._has_space():
+                        self.space_ready.clear()
+                        await self.space_ready.wait()
+                    data = await self._fetch_segment(segment)
+                    if self.active != "primary":
+                        break
+                    self._push({"seq": segment["seq"], "duration": segment["duration"], "data": data})
+                    self.last_seq = segment["seq"]
+                if playlist["endlist"] and playlist["segments"] and self.last_seq >= playlist["segments"][-1]["seq"]:
+                    logger.info(f"🏁 الوسيط {self.name}: نهاية القائمة")
+                    self.finished.set()
+                    break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["fetch_errors"] += 1
+                self.recovering = 0
+                logger.warning(f"⚠️ الوسيط {self.name}: {e}")
+            playlist = None
+            # القائمة الحية تتجدد كل مدة مقطع تقريباً
+            await asyncio.sleep(max(0.5, self.target_duration / 2))
+
+    def _push(self, segment):
+        layout = ts_layout(segment["data"])
+        if not same_layout(layout, self.layout):
+            # FFmpeg يضيف مسارات PMT الجديدة دون ربطها فيتوقف المخرج - ما تبقى من
+            # التخطيط القديم يُحذف والمرمّز يُعاد ليقرأ الجديد من البداية
+            logger.warning(f"🧩 الوسيط {self.name}: تخطيط TS تغير {self.layout} → {layout}")
+            self.buffer.clear()
+            self.buffer_bytes = 0
+            self.space_ready.set()
+            self.stats["layout_changes"] += 1
+            if self.on_layout_change is not None:
+                self.on_layout_change()
+        if layout is not None:
+            self.layout = layout
+        self.buffer.append(segment)
+        self.buffer_bytes += len(segment["data"])
+        self.data_ready.set()
+
+    def _standby_healthy(self, now):
+        sb = self.standby
+        return (
+            sb is not None
+            and sb["warm"] is not None
+            and now - sb["last_new_at"] <= sb["target_duration"] * 2 + config.FAILOVER_GRACE
+        )
+
+    def _activate(self, source, reason, detected_at=None):
+        """تبديل مصدر التغذية - زمن التحول من لحظة الحاجة للبديل حتى دخول بياناته الذاكرة"""
+        now = time.time()
+        previous = self.active
+        self.active = source
+        self.recovering = 0
+        self.slate_until = 0.0
+        event = {
+            "time": now,
+            "from": previous,
+            "to": source,
+            "reason": reason,
+            # ما تبقى في الذاكرة لحظة التحول - أكبر من صفر يعني بلا فجوة في المخرج
+            "buffered_s": round(self.buffered_seconds(), 1),
+            "switch_ms": round(max(0.0, now - detected_at) * 1000) if detected_at else None,
+        }
+        if source == "backup":
+            sb = self.standby
+            warm = sb["warm"]
+            # المقطع المحمّل مسبقاً يدخل الذاكرة فوراً - بدون انتظار الشبكة
+            self._push(warm)
+            sb["last_seq"] = warm["seq"]
+        self.failovers.append(event)
+        self.stats["failovers"] += 1
+        logger.warning(f"🛟 الوسيط {self.name}: {previous} → {source} ({reason})")
+        if self.on_switch is not None:
+            asyncio.create_task(self.on_switch(event))
+
+    async def _failover_loop(self):
+        """اكتشاف توقف المصدر الأساسي والتبديل للاحتياطي أو شاشة الانتظار"""
+        while self.running:
+            await asyncio.sleep(config.FAILOVER_CHECK_INTERVAL)
+            now = time.time()
+            # التبديل عندما يتوقف المصدر ولم يتبقَّ في الذاكرة إلا مقطع واحد - بلا فجوة
+            low = self.buffered_seconds() <= self.target_duration
+            if not low:
+                self.low_since = None
+            elif self.low_since is None:
+                self.low_since = now
+            primary_stall = self.last_new_at + self.target_duration + config.FAILOVER_GRACE
+            if self.active == "primary" and now > primary_stall and low:
+                needed_at = max(primary_stall, self.low_since)
+                if self._standby_healthy(now):
+                    self._activate("backup", "توقف المصدر الأساسي", needed_at)
+                elif self.slate:
+                    self._activate("slate", "توقف المصدر الأساسي بدون احتياطي", needed_at)
+            elif self.active == "backup" and not self._standby_healthy(now) and low and self.slate:
+                sb = self.standby
+                backup_stall = sb["last_new_at"] + sb["target_duration"] * 2 + config.FAILOVER_GRACE if sb else now
+                self._activate("slate", "توقف الاحتياطي", max(backup_stall, self.low_since))
+            elif self.active == "slate" and self._standby_healthy(now):
+                self._activate("backup", "عاد الاحتياطي")
+
+            # شاشة الانتظار بإيقاع الوقت الحقيقي - لا تملأ مخزن المقبس مسبقاً
+            if self.active == "slate" and now >= self.slate_until - 0.5:
+                self._push({"seq": -1, "duration": self.slate["duration"], "data": self.slate["data"]})
+                self.slate_until = max(now, self.slate_until) + self.slate["duration"]
+
+    async def _standby_loop(self, sb, playlist):
+        """تحديث قائمة الاحتياطي وإبقاء أحدث مقطع جاهزاً - وتغذية الذاكرة عند تفعيله"""
+        while self.running and self.standby is sb:
+            try:
+                if playlist is None:
+                    playlist = await self._fetch_playlist(sb["url"])
+                segments = playlist["segments"]
+                if playlist["target_duration"]:
+                    sb["target_duration"] = playlist["target_duration"]
+                if segments and segments[-1]["seq"] > sb["newest_seq"]:
+                    sb["newest_seq"] = segments[-1]["seq"]
+                    sb["last_new_at"] = time.time()
+                if self.active == "backup":
+                    for segment in segments:
+                        if segment["seq"] <= sb["last_seq"]:
+                            continue
+                        while not self._has_space():
+                            self.space_ready.clear()
+                            await self.space_ready.wait()
+                        data = await self._fetch_segment(segment)
+                        if self.active != "backup" or self.standby is not sb:
+                            break
+                        self._push({"seq": segment["seq"], "duration": segment["duration"], "data": data})
+                        sb["last_seq"] = segment["seq"]
+                        sb["warm"] = {"seq": segment["seq"], "duration": segment["duration"], "data": data}
+                elif segments:
+                    # تحديث المقطع الدافئ فقط عندما يخرج من نافذة القائمة
+                    window = {seg["seq"] for seg in segments}
+                    if sb["warm"] is None or sb["warm"]["seq"] not in window:
+                        newest = segments[-1]
+                        data = await self._fetch_segment(newest)
+                        sb["warm"] = {"seq": newest["seq"], "duration": newest["duration"], "data": data}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                sb["errors"] += 1
+                logger.warning(f"⚠️ الاحتياطي {self.name}: {e}")
+            playlist = None
+            await asyncio.sleep(max(0.5, sb["target_duration"] / 2))
+
+    async def _serve(self, reader, writer):
+        """تغذية FFmpeg بتيار MPEG-TS متصل من الذاكرة"""
+        if self.consumer is not None:
+            # اتصال جديد (إعادة تشغيل المرمّز) يحل محل القديم
+            self.consumer.close()
+        self.consumer = writer
+        try:
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: video/mp2t\r\n"
+                b"Connection: close\r\n\r\n"
+            )
+            while self.running and self.consumer is writer:
+                if not self.buffer:
+                    self.data_ready.clear()
+                    try:
+                        await asyncio.wait_for(self.data_ready.wait(), timeout=self.target_duration * 1.5)
+                    except asyncio.TimeoutError:
+                        # الذاكرة فارغة لأكثر من مقطع - المصدر متأخر فعلاً
+                        self.stats["underruns"] += 1
+                    continue
+                segment = self.buffer.popleft()
+                self.buffer_bytes -= len(segment["data"])
+                self.space_ready.set()
+                writer.write(segment["data"])
+                await writer.drain()
+                self.stats["segments_sent"] += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if self.consumer is writer:
+                self.consumer = None
+            writer.close()
+
+    def to_dict(self):
+        sb = self.standby
+        return {
+            "active": self.active,
+            "backup": {
+                "warm": sb["warm"] is not None,
+                "healthy": self._standby_healthy(time.time()),
+                "errors": sb["errors"],
+            } if sb else None,
+            "slate": self.slate is not None,
+            "failover_events": list(self.failovers),
+            "buffered_segments": len(self.buffer),
+            "buffered_seconds": round(self.buffered_seconds(), 1),
+            "buffered_bytes": self.buffer_bytes,
+            **self.stats,
+        }
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import signal
+import config
+
+logger = logging.getLogger(__name__)
+
+# متغير بيئة يحمله كل مرمّز يشغله البوت - يميز عملياتنا عن أي FFmpeg آخر
+STREAM_MARKER = "FBSTREAM_STREAM"
+
+
+def config_hash():
+    """بصمة الإعدادات التي تدخل في أمر FFmpeg - تغيرها يعني أن المرمّز القديم لا يطابق النشر الجديد"""
+    values = [
+        config.FACEBOOK_RTMP_URL,
+        config.RESOLUTION_WIDTH, config.RESOLUTION_HEIGHT, config.VIDEO_BITRATE_KBPS, config.OUTPUT_FPS,
+        config.LOGO_PATH, config.LOGO_SIZE,
+        config.HLS_RELAY_ENABLED, config.OVERLAY_LIVE_ENABLED,
+        config.DVR_ENABLED, config.DVR_SEGMENT_SECONDS,
+        config.SNAPSHOT_ENABLED, config.SNAPSHOT_FPS, config.SNAPSHOT_WIDTH, config.SNAPSHOT_QUALITY,
+        config.LADDER_ENABLED, config.LADDER_SPEC,
+    ]
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()[:16]
+
+
+def process_start_ticks(pid):
+    """وقت بدء العملية من /proc/<pid>/stat - رقم PID وحده قد يُعاد استخدامه"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # اسم الأمر بين قوسين قد يحتوي مسافات - الحقول بعد آخر قوس
+            fields = f.read().rpartition(")")[2].split()
+        if fields[0] == "Z":
+            return None
+        return int(fields[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_marker(pid):
+    """اسم البث من بيئة العملية إن كانت من مرمّزاتنا"""
+    prefix = f"{STREAM_MARKER}=".encode()
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            for item in f.read().split(b"\0"):
+                if item.startswith(prefix):
+                    return item[len(prefix):].decode(errors="replace")
+    except OSError:
+        pass
+    return None
+
+
+def marked_processes():
+    """كل المرمّزات الحية التي شغلها البوت (في هذا التشغيل أو سابقه): {pid: اسم البث}"""
+    result = {}
+    own = os.getpid()
+    for entry in os.listdir("/proc"):
+        if entry.isdigit() and int(entry) != own:
+            name = process_marker(entry)
+            if name is not None and process_start_ticks(entry) is not None:
+                result[int(entry)] = name
+    return result
+
+
+def terminate(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+class AdoptedProcess:
+    """مرمّز من تشغيل سابق للبوت - ليس عملية ابنة: الحالة من /proc بدل wait() والأنابيب"""
+
+    def __init__(self, pid, start_ticks):
+        self.pid = pid
+        self.start_ticks = start_ticks
+        self.stdin = None
+        self._returncode = None
+
+    @property
+    def returncode(self):
+        if self._returncode is None and process_start_ticks(self.pid) != self.start_ticks:
+            # رمز الخروج الحقيقي يذهب للأب الجديد (init)
+            self._returncode = -1
+        return self._returncode
+
+    async def wait(self):
+        while self.returncode is None:
+            await asyncio.sleep(config.WATCHDOG_INTERVAL)
+        return self._returncode
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+
+class SessionState:
+    """ملف حالة البثوث الجارية - يُكتب عند كل تغيير ويُقرأ عند تشغيل البوت"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data if isinstance(data, list) else []
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ تعذر قراءة ملف الحالة: {e}")
+            return []
+
+    def save(self, entries):
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر حفظ ملف الحالة: {e}")
@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import logging
+import os
+import config
+
+logger = logging.getLogger(__name__)
+
+
+# أنواع المسارات في PMT التي يكتبها مرمّز شاشة الانتظار
+STREAM_TYPE_H264 = 0x1B
+STREAM_TYPE_AAC = 0x0F
+
+
+def layout_options(layout):
+    """خيارات mpegts التي تعطي شاشة الانتظار نفس PID المصدر - None إذا لم يكن المصدر H.264 + AAC فقط"""
+    if layout is None:
+        return None
+    by_type = {stream_type: pid for pid, stream_type in layout["streams"]}
+    if len(layout["streams"]) != 2 or set(by_type) != {STREAM_TYPE_H264, STREAM_TYPE_AAC}:
+        return None
+    return [
+        "-mpegts_service_id", str(layout["program"]),
+        "-mpegts_pmt_start_pid", str(layout["pmt_pid"]),
+        # ترتيب المخرجات: الفيديو 0 ثم الصوت 1
+        "-streamid", f"0:{by_type[STREAM_TYPE_H264]}",
+        "-streamid", f"1:{by_type[STREAM_TYPE_AAC]}",
+    ]
+
+
+def cache_key(width, height, options):
+    digest = hashlib.sha256(
+        f"{width}x{height}|{config.OUTPUT_FPS}|{config.SLATE_COLOR}|{config.SLATE_SECONDS}|{options}".encode()
+    )
+    if os.path.exists(config.SLATE_IMAGE):
+        with open(config.SLATE_IMAGE, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+async def prepare_slate(width, height, layout=None):
+    """مقطع MPEG-TS قصير (صورة أو لون + صمت) يُرسم مرة واحدة ويُكرر عند سقوط كل المصادر
+
+    layout: تخطيط TS للمصدر الأساسي - الشاشة تُكتب بنفس PID ليكملها FFmpeg دون إعادة تشغيل
+    """
+    if not config.SLATE_ENABLED:
+        return None
+    try:
+        options = layout_options(layout)
+        if options is None and layout is not None:
+            logger.info("🎬 المصدر ليس H.264 + AAC فقط - التحول لشاشة الانتظار يعيد تشغيل المرمّز")
+        os.makedirs(config.LOGO_CACHE_DIR, exist_ok=True)
+        path = os.path.join(config.LOGO_CACHE_DIR, f"slate_{cache_key(width, height, options)}.ts")
+        if not os.path.exists(path):
+            fps = config.OUTPUT_FPS
+            if os.path.exists(config.SLATE_IMAGE):
+                video = ["-loop", "1", "-framerate", str(fps), "-i", config.SLATE_IMAGE]
+            else:
+                video = ["-f", "lavfi", "-i", f"color=c={config.SLATE_COLOR}:s={width}x{height}:r={fps}"]
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-hide_banner", "-nostdin", "-y",
+                *video,
+                "-f", "lavfi", "-i", "anullsrc=r=48000:cl=stereo",
+                "-t", str(config.SLATE_SECONDS),
+                "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                       f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,format=yuv420p",
+                "-c:v", "libx264", "-preset", "veryfast", "-g", str(fps), "-r", str(fps),
+                "-c:a", "aac", "-b:a", "64k",
+                *(options or []),
+                "-f", "mpegts", f"{path}.tmp",
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(stderr.decode(errors="replace").strip()[-200:])
+            os.replace(f"{path}.tmp", path)
+            logger.info(f"🎬 تم تجهيز شاشة الانتظار {width}x{height}")
+        with open(path, "rb") as f:
+            return {"data": f.read(), "duration": float(config.SLATE_SECONDS)}
+    except Exception as e:
+        logger.error(f"❌ تعذر تجهيز شاشة الانتظار: {e}")
+        return None
@@ -1,61 +1,350 @@
-import subprocess
+import asyncio
 import time
 import logging
 import os
+import re
 import config
 from anti_detection import AntiDetection
+from probe import ProbeCache, probe_stream, check_compatibility
+from telemetry import StreamTelemetry
+from governor import EncoderGovernor
+from memory_budget import MemoryBudget
+from logring import LogRing
+from logo_cache import prepare_logo, overlay_position
+from relay import HlsRelay
+from slate import prepare_slate
+from dvr import DvrRing
+from uplink import UplinkLadder, output_acked_total
+from edge import edge_cache, mirror_urls, select_edge
+from session import STREAM_MARKER, AdoptedProcess, SessionState, config_hash, marked_processes, process_start_ticks, terminate
+from hls import TTLCache, fetch_playlist, is_master_playlist, parse_master_playlist, select_variant
 import threading
+from collections import deque
+from urllib.parse import urlparse
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+playlist_cache = TTLCache(config.PLAYLIST_CACHE_TTL)
+probe_cache = ProbeCache(config.PROBE_CACHE_PATH, config.PROBE_CACHE_TTL)
+
+# tee عند سقوط أحد مخرجاته: "Slave muxer #1 failed: ..., continuing with 2/3 slaves."
+SLAVE_FAILED_RE = re.compile(r"Slave muxer #(\d+) failed")
+
+
 class StreamManager:
-    def __init__(self):
+    def __init__(self, owner_id=0, stream_id="1", registry=None):
+        self.owner_id = owner_id
+        self.registry = registry
+        self.stream_id = str(stream_id)
         self.is_running = False
         self.process = None
-        self.session_name = "fbstream"
-        self.monitor_thread = None
-        self.log_file = "/tmp/fbstream_latest.log"
+        self.name = f"fbstream_{owner_id}_{self.stream_id}"
+        self.monitor_task = None
+        self.log_task = None
+        self.progress_task = None
+        self.telemetry = StreamTelemetry()
+        self.first_packet = None
+        self.stable = None
+        self.log_file = f"/tmp/{self.name}.log"
+        self.logs = LogRing(self.log_file if config.LOG_PERSIST else None)
+        self.source_url = None
+        self.started_at = None
+        self.mode = None
+        self.encode_cost = 1.0
+        self.variant = None
+        # نتيجة قياس المصدر المختار عند البدء
+        self.edge = None
+        self.destinations = []
+        # أرقام الوجهات التي أسقطها tee في العملية الحالية
+        self.failed_destinations = set()
+        self.copy_video = False
+        self.copy_audio = False
+        self.source_key = None
+        self.probe_info = None
+        self.fast_probe = False
+        self.governor = None
+        self.memory = None
+        self.ladder = None
+        # قائمة المصادر التالية: {"url", "at"} - at وقت تبديل مجدول أو None
+        self.queue = []
+        self.backup_url = None
+        self.dvr = DvrRing(self.name) if config.DVR_ENABLED else None
+        self.playlist_task = None
+        self.switch_lock = asyncio.Lock()
+        self.logo = None
+        # حالة اللوجو الحالية - تبقى بعد إعادة التشغيل وتُعدّل من /logo وصفحة المعاينة
+        self.overlay = {
+            "enabled": config.LOGO_ENABLED,
+            "x": config.LOGO_OFFSET_X,
+            "y": config.LOGO_OFFSET_Y,
+            "opacity": float(config.LOGO_OPACITY),
+        }
+        # الرسم الحالي يقبل أوامر c عبر stdin
+        self.live_overlay = False
+        # آخر لقطة JPEG يكتبها المرمّز - ملف وليس أنبوباً ليبقى FFmpeg حياً بعد إعادة تشغيل البوت
+        self.snapshot_path = f"/tmp/{self.name}_snapshot.jpg" if config.SNAPSHOT_ENABLED else None
+        self.relay = None
+        self.restart_lock = asyncio.Lock()
+        # مهام الخلفية (إعادة تشغيل من المنظم والذاكرة والرفع) - مرجع ثابت حتى تنتهي
+        self.background = set()
+        self.last_output_at = 0
+        self.outage_started = None
+        self.consecutive_failures = 0
+        self.restarts = 0
+        self.restart_times = deque()
+        self.recovery_times = deque(maxlen=50)
+        self.downtime = 0.0
 
     def parse_m3u8_for_best_quality(self, url):
-        """استخدام الرابط مباشرة - FFmpeg سيتعامل معه"""
-        logger.info("📌 استخدام الرابط مباشرة")
-        return url.strip()
+        """اختيار الجودة الأقرب للمخرج من القائمة الرئيسية - FFmpeg يفتح قائمة واحدة فقط"""
+        url = url.strip()
+        variants = playlist_cache.get(url)
+        if variants is None:
+            text, final_url = fetch_playlist(url, AntiDetection.get_random_user_agent())
+            variants = parse_master_playlist(text, final_url) if text and is_master_playlist(text) else []
+            if text is not None:
+                playlist_cache.set(url, variants)
+
+        if not variants:
+            logger.info("📌 استخدام الرابط مباشرة")
+            return url
+
+        best = select_variant(
+            variants,
+            config.RESOLUTION_WIDTH,
+            config.RESOLUTION_HEIGHT,
+            config.OUTPUT_FPS,
+            config.VIDEO_BITRATE_KBPS,
+        )
+        if best is None:
+            logger.info("📌 الصوت منفصل عن الفيديو - استخدام القائمة الرئيسية")
+            return url
+
+        self.variant = best
+        logger.info(
+            f"🎯 الجودة المختارة: {best['width']}x{best['height']} "
+            f"@{best['fps'] or '?'}fps {best['bandwidth'] // 1000}kbps (من {len(variants)})"
+        )
+        return best["url"]
 
-    def get_tmux_session_exists(self):
-        """التحقق من وجود جلسة tmux"""
+    def web_key(self):
+        """معرّف البث في مسارات الويب - رقم البث وحده يتكرر بين المحادثات"""
+        return f"{self.owner_id}_{self.stream_id}"
+
+    def is_process_alive(self):
+        """التحقق من أن عملية FFmpeg ما زالت تعمل"""
+        return self.process is not None and self.process.returncode is None
+
+    async def kill_process(self, process=None, timeout=5):
+        """إيقاف عملية FFmpeg - SIGTERM ثم SIGKILL إذا لم تستجب"""
+        process = process or self.process
+        if process is None or process.returncode is not None:
+            return
         try:
-            result = subprocess.run(
-                ["tmux", "has-session", "-t", self.session_name],
-                capture_output=True,
-                timeout=5
-            )
-            return result.returncode == 0
-        except:
-            return False
+            process.terminate()
+            await asyncio.wait_for(process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ FFmpeg #{self.stream_id} لم يستجب - إنهاء قسري")
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+        logger.info(f"🔄 تم إيقاف عملية FFmpeg #{self.stream_id}")
+
+    def logo_available(self):
+        return self.overlay["enabled"] and os.path.exists(config.LOGO_PATH)
 
-    def kill_existing_session(self):
-        """إيقاف الجلسة الموجودة"""
+    async def prepare_overlay(self):
+        """تجهيز اللوجو من الذاكرة المؤقتة على القرص إذا كان الفيديو سيُرمّز"""
+        if self.copy_video or not self.overlay["enabled"]:
+            # اللوجو المخفي لا يدخل الرسم - لا فك صورة ولا overlay لكل إطار،
+            # وإظهاره لاحقاً يعيد التشغيل مرة واحدة
+            self.logo = None
+        else:
+            # الشفافية مرسومة في الصورة - تغييرها يعيد الرسم والتشغيل بدل فلتر لكل إطار
+            self.logo = await prepare_logo(opacity=self.overlay["opacity"], force=True)
+
+    async def resolve_source(self, url):
+        """الجودة المختارة من ذاكرة الفحص إن وجدت، وإلا تحليل القائمة الرئيسية"""
+        self.source_key = url.strip()
+        cached = probe_cache.get(self.source_key)
+        if cached and cached.get("url"):
+            self.variant = cached.get("variant")
+            logger.info("⚡ مصدر معروف - استخدام الجودة المحفوظة")
+            return cached["url"]
+        # تحميل القائمة عملية شبكة متزامنة - تُنفذ خارج حلقة الأحداث
+        return await asyncio.to_thread(self.parse_m3u8_for_best_quality, url)
+
+    async def select_edge(self, url):
+        """قياس نسخ الجودة المكررة والمضيفات البديلة معاً واختيار الأسرع"""
+        self.edge = None
+        if not config.EDGE_SELECTION_ENABLED:
+            return url
+        candidates = [url]
+        if self.variant:
+            # نفس الدقة والمعدل من خادم آخر (روابط احتياطية في القائمة الرئيسية)
+            fields = ("width", "height", "fps", "codecs")
+            wanted = [self.variant[k] for k in fields]
+            candidates += [
+                v["url"] for v in playlist_cache.get(self.source_key) or []
+                if [v[k] for k in fields] == wanted
+            ]
+        candidates += mirror_urls(url)
         try:
-            if self.get_tmux_session_exists():
-                subprocess.run(
-                    ["tmux", "kill-session", "-t", self.session_name],
-                    capture_output=True,
-                    timeout=5
-                )
-                time.sleep(1)
-                logger.info("🔄 تم إيقاف الجلسة القديمة")
+            chosen, result, results = await select_edge(candidates, AntiDetection.get_random_user_agent())
         except Exception as e:
-            logger.error(f"خطأ في إيقاف الجلسة: {e}")
+            logger.error(f"❌ تعذر قياس المصادر: {e}")
+            return url
+        if result is not None:
+            self.edge = {
+                "host": result["host"],
+                "throughput_kbps": result["throughput_kbps"],
+                "speed": result["speed"],
+                "playlist_ms": result["playlist_ms"],
+                "ttfb_ms": result["ttfb_ms"],
+                "cached": result.get("cached", False),
+                "candidates": len(results),
+                "switched": chosen != url,
+            }
+        return chosen
+
+    def describe_edge(self):
+        if not self.edge:
+            return ""
+        speed = f" ({self.edge['speed']}x)" if self.edge["speed"] else ""
+        picked = f" - الأسرع من {self.edge['candidates']}" if self.edge["candidates"] > 1 else ""
+        cached = " (قياس محفوظ)" if self.edge["cached"] else ""
+        return f"\n🌐 {self.edge['host']}: {self.edge['throughput_kbps'] / 1000:.1f} Mbps{speed}{picked}{cached}"
+
+    def invalidate_probe(self):
+        """فشل البدء بإعدادات الفحص السريع - العودة للفحص الكامل"""
+        if self.fast_probe:
+            logger.info(f"🧹 حذف نتيجة الفحص المحفوظة للبث #{self.stream_id}")
+            probe_cache.invalidate(self.source_key)
+            self.fast_probe = False
+
+    async def select_mode(self, m3u8_url):
+        """فحص المصدر واختيار النسخ المباشر للمسارات المتوافقة مع FLV"""
+        cached = probe_cache.get(self.source_key or m3u8_url)
+        if cached and cached.get("info"):
+            self.probe_info = cached["info"]
+        else:
+            self.probe_info = await probe_stream(m3u8_url, AntiDetection.get_random_user_agent())
+            if self.probe_info:
+                probe_cache.set(self.source_key or m3u8_url, {
+                    "info": self.probe_info,
+                    "variant": self.variant,
+                    "url": m3u8_url,
+                })
+        # التخطيط معروف - إعادة التشغيل لا تحتاج تحليلاً طويلاً
+        self.fast_probe = self.probe_info is not None
+        
+        if not config.PASSTHROUGH_ENABLED:
+            return False, False
+        copy_video, copy_audio = check_compatibility(self.probe_info)
+        if copy_video and self.logo_available():
+            # اللوجو يحتاج فك ترميز الفيديو
+            copy_video = False
+        return copy_video, copy_audio
+
+    @staticmethod
+    def estimate_cost(copy_video, copy_audio):
+        """تكلفة البث من قدرة المعالج (1.0 = ترميز 720p كامل)"""
+        cost = 0.05 if copy_video else 0.9
+        cost += 0.02 if copy_audio else 0.1
+        return cost
+
+    @staticmethod
+    def describe_mode(copy_video, copy_audio):
+        if copy_video and copy_audio:
+            return "⚡ نسخ مباشر (بدون إعادة ترميز)"
+        if copy_video:
+            return "⚡ نسخ الفيديو + ترميز الصوت"
+        if copy_audio:
+            return "🎞️ ترميز الفيديو + نسخ الصوت"
+        return "🎞️ إعادة ترميز كاملة"
 
-    def build_ffmpeg_command(self, m3u8_url, stream_key):
+    @staticmethod
+    def destination_url(destination):
+        """Stream Key من فيسبوك أو رابط RTMP كامل"""
+        destination = destination.strip()
+        if destination.startswith(("rtmp://", "rtmps://")):
+            return destination
+        return f"{config.FACEBOOK_RTMP_URL}{destination}"
+
+    @staticmethod
+    def build_output(urls, extra_slaves=()):
+        """وجهة واحدة = FLV مباشر، عدة وجهات (أو تسجيل DVR) = ترميز واحد عبر tee"""
+        if len(urls) == 1 and not extra_slaves:
+            return ["-f", "flv", "-flvflags", "no_duration_filesize", urls[0]]
+        
+        def escape(url):
+            for ch in ("\\", "|", "[", "]"):
+                url = url.replace(ch, "\\" + ch)
+            return url
+        
+        # عدة وجهات: سقوط واحدة لا يوقف الباقي (يُكشف من stderr). وجهة واحدة مع DVR:
+        # سقوطها يوقف FFmpeg ليعيده المراقب - التسجيل على القرص لا يجعل البث حياً
+        onfail = "ignore" if len(urls) > 1 else "abort"
+        slaves = "|".join([
+            f"[f=flv:flvflags=no_duration_filesize:onfail={onfail}]{escape(url)}"
+            for url in urls
+        ] + list(extra_slaves))
+        return ["-f", "tee", slaves]
+
+    def encoder_profile(self):
+        """إعدادات المرمّز الحالية من المنظم (أو الإعداد الأرخص بدونه)"""
+        if self.governor is not None:
+            profile = dict(self.governor.profile)
+        else:
+            profile = {"preset": "ultrafast", "threads": 1, "filter_threads": 1}
+        if self.memory is not None:
+            # كل thread في x264 يحتفظ بإطارات إضافية في الذاكرة
+            profile["threads"] = min(profile["threads"], self.memory.profile()["threads"])
+            profile["filter_threads"] = min(profile["filter_threads"], profile["threads"])
+        return profile
+
+    def memory_profile(self):
+        """الدقة وأحجام الطوابير حسب نصيب البث من الذاكرة"""
+        if self.memory is not None:
+            return self.memory.profile()
+        return {
+            "width": config.RESOLUTION_WIDTH,
+            "height": config.RESOLUTION_HEIGHT,
+            "muxing_queue": 512,
+            "thread_queue": None,
+        }
+
+    @staticmethod
+    def snapshot_filter(label):
+        """فرع اللقطات: إطار واحد في الثانية بدقة صغيرة - يتفرع بعد اللوجو ليطابق ما يراه المشاهد"""
+        # select يمرر الإطار فور وصوله (fps ينتظر الإطار التالي، أي فاصل الإطارات المفتاحية
+        # في النسخ المباشر) - توقيت اللقطات لا يسبق البث فلا يتقدم out_time في التقدم
+        return (
+            f"{label}select='isnan(prev_selected_t)+gte(t-prev_selected_t,{1 / config.SNAPSHOT_FPS:g})',"
+            f"scale={config.SNAPSHOT_WIDTH}:-2,format=yuvj420p[snap]"
+        )
+
+    def build_ffmpeg_command(self, m3u8_url, destinations, copy_video=False, copy_audio=False, snapshot_path=None):
         """بناء أمر FFmpeg المحسّن لضمان 30fps و 3.5Mbps"""
-        rtmp_url = f"{config.FACEBOOK_RTMP_URL}{stream_key}"
+        if isinstance(destinations, str):
+            destinations = [destinations]
+        urls = [self.destination_url(d) for d in destinations]
         user_agent = AntiDetection.get_random_user_agent()
         
+        profile = self.encoder_profile()
+        memory = self.memory_profile()
+        
         cmd = ["ffmpeg", "-y"]
         
-        cmd.extend(["-loglevel", "warning", "-stats"])
+        cmd.extend(["-filter_threads", str(profile["filter_threads"])])
+        
+        # التقدم يصل عبر -progress - stderr للتحذيرات والأخطاء فقط
+        cmd.extend(["-loglevel", "warning", "-nostats"])
+        
+        # تقدم المخرج الفعلي (الحجم والوقت) يُقرأ من stdout
+        cmd.extend(["-progress", "pipe:1"])
         
         cmd.extend(["-fflags", "+genpts+discardcorrupt"])
         
@@ -64,194 +353,775 @@ class StreamManager:
         cmd.extend([
             "-reconnect", "1",
             "-reconnect_streamed", "1", 
-            "-reconnect_delay_max", "5",
+            # الوسيط المحلي يغيب أثناء إعادة تشغيل البوت - نافذة أطول للعودة إليه
+            "-reconnect_delay_max", str(config.RELAY_RECONNECT_DELAY_MAX) if self.relay is not None and config.REATTACH_ENABLED else "5",
             "-reconnect_at_eof", "1",
         ])
         
         cmd.extend([
             "-timeout", "10000000",
             "-rw_timeout", "10000000",
-            "-analyzeduration", "1000000",
-            "-probesize", "1000000",
         ])
         
+        if self.fast_probe:
+            cmd.extend([
+                "-analyzeduration", str(config.FAST_PROBE_ANALYZEDURATION),
+                "-probesize", str(config.FAST_PROBE_SIZE),
+            ])
+        else:
+            cmd.extend([
+                "-analyzeduration", "1000000",
+                "-probesize", "1000000",
+            ])
+        
         cmd.extend(["-user_agent", user_agent])
         
+        if self.relay is not None:
+            # الوسيط المحلي يرسل MPEG-TS متصلاً - لا حاجة لتخمين الصيغة
+            # قفزة توقيت أكبر من ثانية (تبديل مصدر) تُعوض بدل تكرار/إسقاط الإطارات
+            cmd.extend(["-dts_delta_threshold", "1", "-f", "mpegts"])
+        
+        if memory["thread_queue"]:
+            cmd.extend(["-thread_queue_size", str(memory["thread_queue"])])
+        
+        if snapshot_path is not None and copy_video:
+            # النسخ المباشر لا يفك الترميز - اللقطة تحتاج الإطارات المفتاحية فقط
+            cmd.extend(["-skip_frame:v", "nokey"])
+        
         cmd.extend(["-i", m3u8_url])
         
-        # تحقق من إمكانية استخدام اللوجو
-        use_logo = config.LOGO_ENABLED and os.path.exists(config.LOGO_PATH)
+        # اللوجو المجهز مسبقاً - يُجهز في start_stream قبل بناء الأمر
+        # لوجو أُخفي بأمر مباشر يخرج من الرسم عند أي إعادة تشغيل
+        use_logo = not copy_video and self.logo is not None and self.overlay["enabled"]
+        self.live_overlay = use_logo and config.OVERLAY_LIVE_ENABLED
         
-        res_w = config.RESOLUTION_WIDTH
-        res_h = config.RESOLUTION_HEIGHT
+        res_w = memory["width"]
+        res_h = memory["height"]
+        rung = self.ladder.rung() if self.ladder is not None else None
+        if rung is not None and rung["height"] < res_h:
+            # الأقل بين ما تسمح به الذاكرة وما يتحمله الرفع
+            res_w, res_h = rung["width"], rung["height"]
+        fps = config.OUTPUT_FPS
+        # مع اللقطات يمر الفيديو عبر split قبل [vout]
+        video_label = "[vmain]" if snapshot_path is not None else "[vout]"
+        filter_complex = None
         
         if use_logo:
-            try:
-                cmd.extend(["-i", config.LOGO_PATH])
-                
-                ox = config.LOGO_OFFSET_X
-                oy = config.LOGO_OFFSET_Y
-                ox_str = f"W-w{abs(ox)}" if ox < 0 else str(ox)
-                oy_str = f"H-h{abs(oy)}" if oy < 0 else str(oy)
-                
-                filter_complex = (
-                    f"[0:v]scale={res_w}:{res_h},fps=30,format=yuv420p[base];"
-                    f"[1:v]scale={config.LOGO_SIZE}:force_original_aspect_ratio=decrease,"
-                    f"format=rgba,colorchannelmixer=aa={config.LOGO_OPACITY}[logo];"
-                    f"[base][logo]overlay={ox_str}:{oy_str}:shortest=1:format=auto"
-                )
-                cmd.extend(["-filter_complex", filter_complex])
-                logger.info(f"✅ اللوجو مفعّل - {res_h}p")
-            except Exception as e:
-                logger.warning(f"⚠️ تعذر إضافة اللوجو: {e}")
-                use_logo = False
-        
-        if not use_logo:
-            cmd.extend(["-vf", f"scale={res_w}:{res_h},fps=30,format=yuv420p"])
-            logger.info(f"📺 البث بدون لوجو - {res_h}p")
+            # صورة واحدة بحجمها وشفافيتها النهائية - overlay يكرر آخر إطار
+            # (eof_action=repeat) فلا scale ولا colorchannelmixer لكل إطار،
+            # والاسم @logo يستقبل أوامر الموضع والإظهار من stdin دون إعادة تشغيل
+            cmd.extend(["-i", self.logo["path"]])
+            x, y = overlay_position(self.logo, self.overlay["x"], self.overlay["y"])
+            name = "overlay@logo" if self.live_overlay else "overlay"
+            
+            filter_complex = (
+                f"[0:v]scale={res_w}:{res_h},fps={fps},format=yuv420p[base];"
+                f"[1:v]format=yuva420p[logo];"
+                f"[base][logo]{name}={x}:{y}:eof_action=repeat:format=yuv420{video_label}"
+            )
+            logger.info(f"✅ اللوجو مفعّل{' وقابل للتعديل أثناء البث' if self.live_overlay else ''} - {res_h}p")
+        elif not copy_video and snapshot_path is not None:
+            # نفس سلسلة -vf لكن داخل الرسم ليتفرع منها فرع اللقطات
+            filter_complex = f"[0:v]scale={res_w}:{res_h},fps={fps},format=yuv420p{video_label}"
         
-        cmd.extend([
-            "-c:v", "libx264",
-            "-preset", "ultrafast",
-            "-tune", "zerolatency",
-            "-threads", "1",
-        ])
+        if snapshot_path is not None:
+            if copy_video:
+                filter_complex = self.snapshot_filter("[0:v:0]")
+            else:
+                filter_complex += f";{video_label}split=2[vout][snapin];{self.snapshot_filter('[snapin]')}"
+        if filter_complex is not None:
+            cmd.extend(["-filter_complex", filter_complex])
         
-        cmd.extend([
-            "-r", "30",
-            "-g", "60",
-            "-keyint_min", "60",
-            "-sc_threshold", "0",
-            "-force_key_frames", "expr:gte(t,n_forced*2)",
-        ])
+        if copy_video:
+            cmd.extend(["-map", "0:v:0", "-c:v", "copy"])
+            logger.info(f"⚡ نسخ الفيديو مباشرة - {res_h}p")
+        else:
+            if use_logo or snapshot_path is not None:
+                cmd.extend(["-map", "[vout]"])
+            if not use_logo:
+                if snapshot_path is None:
+                    cmd.extend(["-map", "0:v:0", "-vf", f"scale={res_w}:{res_h},fps={fps},format=yuv420p"])
+                logger.info(f"📺 البث بدون لوجو - {res_h}p")
+            
+            cmd.extend([
+                "-c:v", "libx264",
+                "-preset", profile["preset"],
+                "-tune", "zerolatency",
+                "-threads", str(profile["threads"]),
+            ])
+            
+            cmd.extend([
+                "-r", str(fps),
+                "-g", str(fps * 2),
+                "-keyint_min", str(fps * 2),
+                "-sc_threshold", "0",
+                "-force_key_frames", "expr:gte(t,n_forced*2)",
+            ])
+            
+            bitrate = rung["bitrate_kbps"] if rung is not None else config.VIDEO_BITRATE_KBPS
+            cmd.extend([
+                "-b:v", f"{bitrate}k",
+                "-minrate", f"{bitrate * 6 // 7}k",
+                "-maxrate", f"{bitrate * 8 // 7}k",
+                "-bufsize", f"{bitrate * 8 // 7}k",
+            ])
+            
+            cmd.extend([
+                "-pix_fmt", "yuv420p",
+                "-profile:v", "main",
+                "-level", "3.0",
+            ])
         
-        cmd.extend([
-            "-b:v", "3500k",
-            "-minrate", "3000k",
-            "-maxrate", "4000k",
-            "-bufsize", "4000k",
-        ])
+        if not self.fast_probe:
+            cmd.extend(["-map", "0:a:0?"])
+        elif self.probe_info.get("audio"):
+            cmd.extend(["-map", "0:a:0"])
         
-        cmd.extend([
-            "-pix_fmt", "yuv420p",
-            "-profile:v", "main",
-            "-level", "3.0",
-        ])
+        if copy_audio:
+            # HLS يحمل AAC بصيغة ADTS و FLV يحتاج ASC
+            cmd.extend(["-c:a", "copy", "-bsf:a", "aac_adtstoasc"])
+        else:
+            cmd.extend([
+                # سد الفجوات وقص التداخل عند تبديل المصدر - الصوت يبقى متصلاً
+                "-af", "aresample=async=1",
+                "-c:a", "aac",
+                "-b:a", "99k",
+                "-ar", "48000",
+                "-ac", "2",
+            ])
         
-        cmd.extend([
-            "-c:a", "aac",
-            "-b:a", "99k",
-            "-ar", "48000",
-            "-ac", "2",
-        ])
+        cmd.extend(["-max_muxing_queue_size", str(memory["muxing_queue"])])
         
-        cmd.extend([
-            "-f", "flv",
-            "-flvflags", "no_duration_filesize",
-            "-max_muxing_queue_size", "512",
-        ])
+        # DVR: نفس الحزم المرمّزة تُكتب مقاطع على القرص - بدون ترميز ثانٍ
+        extra = [self.dvr.output_slave()] if self.dvr is not None else []
+        if (len(urls) > 1 or extra) and not (copy_video and copy_audio):
+            # tee لا يطلب ترويسة عامة من المرمّز - مخرجات FLV تحتاجها لـ AVC/AAC sequence header
+            cmd.extend(["-flags", "+global_header"])
+        cmd.extend(self.build_output(urls, extra))
         
-        cmd.append(rtmp_url)
+        if snapshot_path is not None:
+            # مخرج ثانٍ: ملف JPEG واحد يُستبدل بإعادة تسمية - القارئ لا يرى صورة ناقصة
+            cmd.extend([
+                # الإطارات كما يمررها select - بدون تكرار لملء الفجوات بينها
+                "-map", "[snap]", "-fps_mode", "passthrough",
+                "-c:v", "mjpeg", "-q:v", str(config.SNAPSHOT_QUALITY),
+                "-f", "image2", "-update", "1", "-atomic_writing", "1", snapshot_path,
+            ])
         
         return cmd
 
-    def start_stream(self, m3u8_url, stream_key):
-        """بدء البث مع إعدادات محسّنة"""
+    async def start_stream(self, m3u8_url, destinations, on_progress=None):
+        """بدء البث - الجاهزية تُحدد من تقدم المخرج الفعلي وليس من انتظار ثابت"""
+        async def report(text):
+            if on_progress:
+                await on_progress(text)
+
         try:
             if self.is_running:
                 return False, "⚠️ البث يعمل بالفعل!"
             
-            self.kill_existing_session()
-            
-            if os.path.exists(self.log_file):
-                os.remove(self.log_file)
+            await self.kill_process()
             
-            cmd = self.build_ffmpeg_command(m3u8_url, stream_key)
+            self.destinations = [destinations] if isinstance(destinations, str) else list(destinations)
             
-            def escape_arg(arg):
-                arg_str = str(arg)
-                special_chars = [' ', '(', ')', '[', ']', ';', ':', '=', ',']
-                if any(c in arg_str for c in special_chars):
-                    escaped = arg_str.replace("'", "'\"'\"'")
-                    return f"'{escaped}'"
-                return arg_str
+            await report("🔍 جاري فحص المصدر...")
+            m3u8_url = await self.select_edge(m3u8_url)
+            self.source_url = m3u8_url
+            self.copy_video, self.copy_audio = await self.select_mode(m3u8_url)
+            self.mode = self.describe_mode(self.copy_video, self.copy_audio)
+            self.encode_cost = self.estimate_cost(self.copy_video, self.copy_audio)
+            logger.info(f"🎛️ وضع البث #{self.stream_id}: {self.mode}")
             
-            ffmpeg_cmd_str = " ".join([escape_arg(arg) for arg in cmd])
+            concurrent = self.registry.active_count() if self.registry else 1
+            if config.MEMORY_BUDGET_ENABLED:
+                self.memory = MemoryBudget(concurrent)
             
-            shell_cmd = f"{ffmpeg_cmd_str} 2>&1 | tee {self.log_file}"
+            await self.prepare_overlay()
+            await self.start_relay()
             
-            tmux_cmd = [
-                "tmux", "new-session", "-d", "-s", self.session_name,
-                "bash", "-c", shell_cmd
-            ]
-            
-            logger.info("🚀 بدء البث...")
-            logger.info(f"📝 الأمر: {' '.join(cmd[:15])}...")
-            
-            result = subprocess.run(
-                tmux_cmd,
-                capture_output=True,
-                text=True,
-                timeout=15
-            )
-            
-            if result.returncode != 0:
-                logger.error(f"❌ فشل tmux: {result.stderr}")
-                return False, f"❌ فشل بدء الجلسة!"
+            if config.GOVERNOR_ENABLED and not self.copy_video:
+                self.governor = EncoderGovernor(concurrent)
+            if config.LADDER_ENABLED and not self.copy_video:
+                self.ladder = UplinkLadder()
             
-            time.sleep(4)
+            await report(f"🚀 جاري تشغيل FFmpeg...\n{self.mode}")
+            await self._spawn()
             
-            if not self.get_tmux_session_exists():
-                error_msg = self._read_error_log()
-                return False, f"❌ فشل البث!\n\n{error_msg}"
-            
-            time.sleep(6)
+            if await self._wait_for(self.first_packet, config.FIRST_PACKET_TIMEOUT):
+                await report(f"📡 أُرسلت أول حزمة - جاري التحقق من الاستقرار...\n{self.mode}")
+                ready = await self._wait_for(self.stable, config.STABLE_TIMEOUT)
+            else:
+                ready = False
             
-            if not self.get_tmux_session_exists():
+            if not ready:
+                exited = not self.is_process_alive()
+                self.invalidate_probe()
+                if self.edge:
+                    edge_cache.invalidate(self.edge["host"])
+                await self.kill_process()
+                await self.stop_relay()
+                await self.log_task
                 error_msg = self._read_error_log()
                 logger.error(f"❌ البث فشل: {error_msg}")
-                return False, f"❌ انقطع البث!\n\n{error_msg}\n\n💡 جرب:\n- تعطيل اللوجو في config.py\n- استخدام رابط M3U8 مختلف"
+                self.process = None
+                title = "❌ فشل البث!" if exited else "❌ لم يصل أي بث إلى الوجهة!"
+                return False, f"{title}\n\n{error_msg}\n\n💡 جرب:\n- تعطيل اللوجو في config.py\n- استخدام رابط M3U8 مختلف"
             
             self.is_running = True
-            self.process = True
+            self.started_at = time.time()
+            self.save_state()
             
-            self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
-            self.monitor_thread.start()
+            self.monitor_task = asyncio.create_task(self._watchdog())
+            self.playlist_task = asyncio.create_task(self._playlist_loop())
             
             logger.info("✅ البث مستقر!")
-            return True, "✅ البث يعمل!\n\n📺 افتح فيسبوك الآن\n⏱️ ستراه خلال ثوانٍ\n\n/stop لإيقاف البث"
+            targets = f"\n🎯 {len(self.destinations)} وجهات بترميز واحد" if len(self.destinations) > 1 else ""
+            if self.failed_destinations:
+                targets += f"\n⚠️ تعذر الاتصال بالوجهة {', '.join(str(i + 1) for i in sorted(self.failed_destinations))}"
+            return True, f"✅ البث #{self.stream_id} يعمل!\n{self.mode}{targets}{self.describe_edge()}\n\n📺 افتح فيسبوك الآن\n⏱️ ستراه خلال ثوانٍ\n\n/stop {self.stream_id} لإيقاف البث"
             
         except Exception as e:
             logger.error(f"❌ خطأ: {e}")
+            await self.kill_process()
+            await self.stop_relay()
             self.process = None
             return False, f"❌ خطأ: {str(e)}"
 
+    async def start_relay(self, port=0):
+        """تشغيل وسيط HLS أمام FFmpeg - عند عدم الدعم يقرأ FFmpeg المصدر مباشرة"""
+        if not config.HLS_RELAY_ENABLED:
+            return
+        max_bytes = self.memory.relay_buffer_bytes() if self.memory else None
+        relay = HlsRelay(self.source_url, AntiDetection.get_random_user_agent(), self.name, max_bytes)
+        ok, reason = await relay.start(port)
+        if ok:
+            self.relay = relay
+            relay.on_switch = self._on_failover
+            relay.on_layout_change = self._on_layout_change
+            # الاحتياطي وشاشة الانتظار يحتاجان إعادة ترميز - النسخ المباشر ينقل المقطع كما هو
+            if not (self.copy_video or self.copy_audio):
+                size = self.memory_profile()
+                relay.slate = await prepare_slate(size["width"], size["height"], relay.layout)
+                if self.backup_url:
+                    ok, reason = await relay.set_backup(self.backup_url)
+                    if not ok:
+                        logger.warning(f"⚠️ تعذر تفعيل الاحتياطي للبث #{self.stream_id}: {reason}")
+        else:
+            logger.info(f"📌 البث #{self.stream_id} بدون وسيط: {reason}")
+
+    async def stop_relay(self):
+        if self.relay is not None:
+            await self.relay.stop()
+            self.relay = None
+
+    async def _spawn(self):
+        """تشغيل FFmpeg بالإعدادات الحالية للبث وبدء قراءة مخرجاته"""
+        input_url = self.relay.url if self.relay is not None else self.source_url
+        if self.governor is not None and self.governor.apply_pending():
+            logger.info(f"🎚️ البث #{self.stream_id}: تطبيق رفع الجودة المؤجل {self.governor.profile['preset']}")
+        cmd = self.build_ffmpeg_command(input_url, self.destinations, self.copy_video, self.copy_audio, self.snapshot_path)
+        
+        logger.info("🚀 بدء البث...")
+        logger.info(f"📝 الأمر: {' '.join(cmd[:15])}...")
+        
+        self.telemetry = StreamTelemetry()
+        self.first_packet = asyncio.Event()
+        self.stable = asyncio.Event()
+        self.failed_destinations = set()
+        # مهلة أول حزمة قبل أن يعتبر المراقب المخرج متوقفاً
+        self.last_output_at = time.time() + config.FIRST_PACKET_TIMEOUT - config.STALL_SECONDS
+        self.process = await asyncio.create_subprocess_exec(
+            *cmd,
+            # stdin مفتوح فقط عندما يستقبل الرسم أوامر الفلاتر
+            stdin=asyncio.subprocess.PIPE if self.live_overlay else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # جلسة مستقلة: Ctrl+C أو إيقاف البوت لا يصل للمرمّز - يُستعاد عند التشغيل التالي
+            start_new_session=config.REATTACH_ENABLED,
+            env={**os.environ, STREAM_MARKER: self.name},
+        )
+        self.log_task = asyncio.create_task(self._capture_stderr(self.process))
+        self.progress_task = asyncio.create_task(self._read_progress(self.process))
+        self.save_state()
+        return self.process
+
+    async def restart(self, reason, before_spawn=None):
+        """إعادة تشغيل مضبوطة للمرمّز بنفس المصدر والوجهات"""
+        async with self.restart_lock:
+            logger.info(f"🔁 إعادة تشغيل FFmpeg #{self.stream_id}: {reason}")
+            old = self.process
+            # المراقب القديم يتجاهل خروج عملية لم تعد الحالية
+            self.process = None
+            # إلغاء المهمة (إيقاف البث) لا يترك العملية القديمة نصف مقتولة
+            await asyncio.shield(self.kill_process(old))
+            await self._stop_readers()
+            if not self.is_running:
+                return False
+            if before_spawn is not None:
+                await before_spawn()
+            # /stop وصل أثناء الانتظار - لا مرمّز جديد بلا مراقب
+            if not self.is_running:
+                return False
+            await self._spawn()
+            ok = await self._wait_for(self.first_packet, config.FIRST_PACKET_TIMEOUT)
+            if not ok:
+                self.invalidate_probe()
+            return ok
+
+    async def _stop_readers(self):
+        """إنهاء قارئي مخرجات العملية السابقة قبل تشغيل الجديدة - آخر كتلة تقدم منها لا تصل لأحداث الجديدة"""
+        if self.progress_task is not None:
+            self.progress_task.cancel()
+        tasks = [t for t in (self.progress_task, self.log_task) if t is not None and not t.done()]
+        if tasks:
+            # stderr يُغلق بخروج العملية - آخر أسطر الخطأ تبقى في الحلقة
+            _, pending = await asyncio.wait(tasks, timeout=2)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def spawn_task(self, coro, label):
+        """تشغيل مهمة في الخلفية دون انتظارها - أخطاؤها تُسجل بدل أن تضيع"""
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(lambda t: self._task_done(t, label))
+        return task
+
+    def _task_done(self, task, label):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ البث #{self.stream_id}: فشل {label}: {task.exception()}")
+
+    async def add_destination(self, destination):
+        if destination in self.destinations:
+            return False, "⚠️ الوجهة مضافة بالفعل."
+        self.destinations.append(destination)
+        ok = await self.restart("إضافة وجهة")
+        return ok, f"➕ تمت إضافة الوجهة ({len(self.destinations)} وجهات)" if ok else "❌ فشل إعادة التشغيل بعد إضافة الوجهة"
+
+    async def remove_destination(self, index):
+        if not 0 <= index < len(self.destinations):
+            return False, "⚠️ رقم وجهة غير صحيح."
+        if len(self.destinations) == 1:
+            return False, "⚠️ لا يمكن حذف الوجهة الوحيدة - استخدم /stop"
+        self.destinations.pop(index)
+        ok = await self.restart("حذف وجهة")
+        return ok, f"➖ تم حذف الوجهة ({len(self.destinations)} وجهات)" if ok else "❌ فشل إعادة التشغيل بعد حذف الوجهة"
+
+    def describe_destinations(self):
+        lines = []
+        for i, d in enumerate(self.destinations, 1):
+            url = self.destination_url(d)
+            # إخفاء المفتاح - أول وآخر 4 أحرف فقط
+            head, _, key = url.rpartition("/")
+            masked = f"{key[:4]}…{key[-4:]}" if len(key) > 10 else "…"
+            lines.append(f"{i}. {head}/{masked}")
+        return "\n".join(lines)
+
+    def enqueue(self, url, at=None):
+        """إضافة مصدر لقائمة التشغيل - at وقت تبديل مجدول (epoch) أو None بعد انتهاء الحالي"""
+        if len(self.queue) >= config.SOURCE_QUEUE_MAX:
+            return False, f"⚠️ القائمة ممتلئة ({config.SOURCE_QUEUE_MAX} مصادر)"
+        self.queue.append({"url": url.strip(), "at": at})
+        self.save_state()
+        when = time.strftime("%H:%M", time.localtime(at)) if at else "بعد المصدر الحالي"
+        return True, f"📼 أُضيف المصدر #{len(self.queue)} للبث #{self.stream_id} ({when})"
+
+    async def skip(self):
+        """الانتقال فوراً لأول مصدر في القائمة"""
+        if not self.queue:
+            return False, "⚠️ لا توجد مصادر في القائمة."
+        entry = self.queue.pop(0)
+        return await self.switch_source(entry["url"], flush=True)
+
+    def describe_sources(self):
+        def host(url):
+            return urlparse(url).hostname or url[:40]
+
+        lines = [f"▶️ {host(self.source_key or self.source_url or '')}"]
+        for i, entry in enumerate(self.queue, 1):
+            when = time.strftime("%H:%M", time.localtime(entry["at"])) if entry["at"] else "بالدور"
+            lines.append(f"{i}. {host(entry['url'])} ({when})")
+        return "\n".join(lines)
+
+    async def switch_source(self, url, flush=True):
+        """تبديل المصدر مع بقاء المرمّز واتصال RTMP - عبر الوسيط إن أمكن وإلا بإعادة تشغيل"""
+        async with self.switch_lock:
+            try:
+                best = await self.resolve_source(url)
+            except Exception as e:
+                logger.error(f"❌ تعذر تحليل المصدر الجديد: {e}")
+                return False, f"❌ تعذر فتح المصدر الجديد: {e}"
+
+            if self.relay is not None and not (self.copy_video or self.copy_audio):
+                ok, reason = await self.relay.switch(best, flush)
+                if ok:
+                    self.source_url = best
+                    self.save_state()
+                    logger.info(f"🔀 البث #{self.stream_id}: تبديل المصدر دون إعادة تشغيل")
+                    return True, f"🔀 تم تبديل مصدر البث #{self.stream_id} دون انقطاع"
+                logger.info(f"📌 البث #{self.stream_id}: الوسيط لا يدعم المصدر الجديد ({reason})")
+
+            async def use_new_source():
+                # النسخ المباشر ينقل قفزات الوقت كما هي - المصدر الجديد يُرمّز دائماً
+                self.source_url = best
+                self.copy_video = self.copy_audio = False
+                self.mode = self.describe_mode(False, False)
+                self.encode_cost = self.estimate_cost(False, False)
+                # تخطيط المصدر الجديد غير معروف - فحص كامل وخرائط اختيارية
+                self.probe_info = None
+                self.fast_probe = False
+                if config.GOVERNOR_ENABLED and self.governor is None:
+                    concurrent = self.registry.active_count() if self.registry else 1
+                    self.governor = EncoderGovernor(concurrent)
+                if config.LADDER_ENABLED and self.ladder is None:
+                    self.ladder = UplinkLadder()
+                await self.stop_relay()
+                await self.start_relay()
+
+            ok = await self.restart("تبديل المصدر", use_new_source)
+            return ok, f"🔀 تم تبديل مصدر البث #{self.stream_id} (إعادة اتصال قصيرة)" if ok else "❌ فشل تشغيل المصدر الجديد"
+
+    async def set_backup(self, url):
+        """مصدر احتياطي دافئ يتحول إليه الوسيط عند توقف المصدر الأساسي"""
+        if self.relay is None:
+            return False, "⚠️ المصدر الحالي يُقرأ بدون وسيط - الاحتياطي غير متاح"
+        variant = self.variant
+        try:
+            best = await asyncio.to_thread(self.parse_m3u8_for_best_quality, url)
+        finally:
+            # الجودة المعروضة تخص المصدر الأساسي
+            self.variant = variant
+
+        if self.copy_video or self.copy_audio:
+            async def use_encoding():
+                self.copy_video = self.copy_audio = False
+                self.mode = self.describe_mode(False, False)
+                self.encode_cost = self.estimate_cost(False, False)
+                if config.GOVERNOR_ENABLED and self.governor is None:
+                    concurrent = self.registry.active_count() if self.registry else 1
+                    self.governor = EncoderGovernor(concurrent)
+                if config.LADDER_ENABLED and self.ladder is None:
+                    self.ladder = UplinkLadder()
+                await self.stop_relay()
+                await self.start_relay()
+
+            self.backup_url = best
+            ok = await self.restart("تفعيل الاحتياطي", use_encoding)
+            if not ok:
+                return False, "❌ فشل إعادة التشغيل بعد تفعيل الاحتياطي"
+            ready = self.relay is not None and self.relay.standby is not None
+            return ready, "🛟 تم تفعيل المصدر الاحتياطي (مع التحول لإعادة الترميز)" if ready else "⚠️ تعذر تحميل المصدر الاحتياطي"
+
+        try:
+            ok, reason = await self.relay.set_backup(best)
+        except Exception as e:
+            ok, reason = False, str(e)
+        if not ok:
+            return False, f"❌ تعذر تحميل المصدر الاحتياطي: {reason}"
+        self.backup_url = best
+        self.save_state()
+        return True, f"🛟 تم تفعيل المصدر الاحتياطي للبث #{self.stream_id}"
+
+    async def clear_backup(self):
+        self.backup_url = None
+        self.save_state()
+        if self.relay is not None:
+            await self.relay.clear_backup()
+        return True, f"🗑️ تم حذف المصدر الاحتياطي للبث #{self.stream_id}"
+
+    async def export_clip(self, seconds):
+        """آخر عدد من الثواني من تسجيل DVR - يرجع (نجاح، رسالة، مسار الملف)"""
+        if self.dvr is None:
+            return False, "⚠️ التسجيل المحلي (DVR) غير مفعّل.", None
+        if not self.is_running:
+            return False, f"⚠️ البث #{self.stream_id} متوقف.", None
+        seconds = max(1, min(seconds, config.DVR_CLIP_MAX))
+        try:
+            return await self.dvr.export(seconds)
+        except Exception as e:
+            logger.error(f"❌ خطأ في تجهيز المقطع: {e}")
+            return False, f"❌ خطأ: {e}", None
+
+    async def send_filter_commands(self, commands):
+        """أوامر فورية لفلاتر FFmpeg عبر stdin (مفتاح c) - تُطبق على الإطار التالي"""
+        process = self.process
+        if process is None or process.returncode is not None or process.stdin is None:
+            return False
+        try:
+            for target, command, arg in commands:
+                process.stdin.write(f"c{target} -1 {command} {arg}\n".encode())
+            await process.stdin.drain()
+            return True
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logger.warning(f"⚠️ تعذر إرسال أوامر الفلاتر للبث #{self.stream_id}: {e}")
+            return False
+
+    def overlay_commands(self, before):
+        """أوامر الفلاتر للقيم التي تغيرت فقط - None إذا تغيرت الشفافية (مرسومة في الصورة)"""
+        state = self.overlay
+        if state["opacity"] != before["opacity"]:
+            return None
+        commands = []
+        if (state["x"], state["y"]) != (before["x"], before["y"]):
+            x, y = overlay_position(self.logo, state["x"], state["y"])
+            commands += [("overlay@logo", "x", x), ("overlay@logo", "y", y)]
+        if state["enabled"] != before["enabled"]:
+            commands.append(("overlay@logo", "enable", "1" if state["enabled"] else "0"))
+        return commands
+
+    async def set_overlay(self, enabled=None, x=None, y=None, opacity=None):
+        """تعديل اللوجو على البث الجاري - أوامر للفلاتر، وإعادة تشغيل فقط إذا لم يكن اللوجو في الرسم"""
+        if not os.path.exists(config.LOGO_PATH):
+            return False, "⚠️ ملف اللوجو غير موجود."
+        if opacity is not None and not 0 <= opacity <= 1:
+            return False, "⚠️ الشفافية بين 0 و 1."
+        before = dict(self.overlay)
+        changes = {"enabled": enabled, "x": x, "y": y, "opacity": opacity}
+        self.overlay.update({key: value for key, value in changes.items() if value is not None})
+        if self.overlay == before or not self.is_running:
+            return True, f"🖼️ تم حفظ إعدادات اللوجو للبث #{self.stream_id}"
+
+        commands = self.overlay_commands(before) if self.live_overlay else None
+        if commands is not None:
+            if await self.send_filter_commands(commands):
+                logger.info(f"🖼️ البث #{self.stream_id}: تعديل اللوجو مباشرة {self.overlay}")
+                self.save_state()
+                return True, f"🖼️ تم تعديل اللوجو على البث #{self.stream_id} مباشرة"
+            # العملية تُعاد الآن - الأمر الجديد يُبنى من الحالة المحفوظة
+            return True, f"🖼️ تم حفظ إعدادات اللوجو - تُطبق عند عودة البث #{self.stream_id}"
+        if not self.overlay["enabled"] and self.logo is None:
+            return True, f"🖼️ اللوجو مخفي على البث #{self.stream_id}"
+
+        async def apply_overlay():
+            if self.overlay["enabled"] and self.copy_video:
+                # اللوجو يحتاج فك ترميز الفيديو
+                self.copy_video = False
+                self.mode = self.describe_mode(False, self.copy_audio)
+                self.encode_cost = self.estimate_cost(False, self.copy_audio)
+                if config.GOVERNOR_ENABLED and self.governor is None:
+                    concurrent = self.registry.active_count() if self.registry else 1
+                    self.governor = EncoderGovernor(concurrent)
+                if config.LADDER_ENABLED and self.ladder is None:
+                    self.ladder = UplinkLadder()
+                await self.stop_relay()
+                await self.start_relay()
+            await self.prepare_overlay()
+
+        ok = await self.restart("تعديل اللوجو", apply_overlay)
+        return ok, f"🖼️ تم تطبيق إعدادات اللوجو على البث #{self.stream_id} (إعادة اتصال قصيرة)" if ok else "❌ فشل إعادة التشغيل بعد تعديل اللوجو"
+
+    async def _on_failover(self, event):
+        if event["to"] == "backup":
+            text = f"🛟 البث #{self.stream_id}: تحول للمصدر الاحتياطي خلال {event['switch_ms']}ms"
+        elif event["to"] == "slate":
+            text = f"🎬 البث #{self.stream_id}: كل المصادر متوقفة - شاشة الانتظار تبقي البث متصلاً"
+        else:
+            text = f"✅ البث #{self.stream_id}: عاد المصدر الأساسي"
+        await self.notify(text)
+
+    def _on_layout_change(self):
+        """الوسيط يغذي مقاطع بـ PID مختلفة (احتياطي من خادم آخر، شاشة انتظار، عودة الأساسي)"""
+        if self.is_running:
+            self.spawn_task(self.restart("تخطيط MPEG-TS تغير في الوسيط"), "إعادة التشغيل لتخطيط TS")
+
+    async def _playlist_loop(self):
+        """تنفيذ التبديلات المجدولة والانتقال للمصدر التالي عند انتهاء الحالي"""
+        while self.is_running:
+            await asyncio.sleep(1)
+            if not self.queue:
+                continue
+            now = time.time()
+            due = next((e for e in self.queue if e["at"] and e["at"] <= now), None)
+            if due is not None:
+                self.queue.remove(due)
+                _, msg = await self.switch_source(due["url"], flush=True)
+                await self.notify(msg)
+                continue
+            ended = self.relay is not None and self.relay.finished.is_set()
+            waiting = next((e for e in self.queue if not e["at"]), None)
+            if ended and waiting is not None:
+                self.queue.remove(waiting)
+                # ما تبقى من المصدر المنتهي يُشغل أولاً
+                _, msg = await self.switch_source(waiting["url"], flush=False)
+                await self.notify(msg)
+
+    async def _wait_for(self, event, timeout):
+        """انتظار حدث من تقدم FFmpeg - يرجع False إذا خرجت العملية أو انتهت المهلة"""
+        event_waiter = asyncio.create_task(event.wait())
+        exit_waiter = asyncio.create_task(self.process.wait())
+        await asyncio.wait(
+            {event_waiter, exit_waiter},
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        event_waiter.cancel()
+        exit_waiter.cancel()
+        return event.is_set() and self.is_process_alive()
+
+    async def _read_progress(self, process):
+        """قراءة كتل -progress من stdout (مفتاح=قيمة تنتهي بـ progress=...)"""
+        block = {}
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            block[key] = value
+            if key != "progress":
+                continue
+            if process is not self.process:
+                # عملية أُوقفت لإعادة التشغيل - حالتها لا تخص العملية الحالية
+                break
+            previous = self.telemetry.latest()
+            sample = self.telemetry.add(block)
+            block = {}
+            if self.outputs_lost():
+                # DVR وحده ما زال يكتب - لا شيء يصل للوجهات، والمراقب يعيد التشغيل
+                continue
+            if previous is None or (
+                sample["out_time_s"] > previous["out_time_s"]
+                or sample["total_size"] > previous["total_size"]
+            ):
+                self.last_output_at = sample["time"]
+            # tee لا يعطي total_size - تقدم out_time يعني أن الحزم وصلت للمُخرج
+            if sample["total_size"] > 0 or sample["out_time_s"] > 0:
+                self.first_packet.set()
+                if sample["out_time_s"] >= config.STABLE_OUT_TIME:
+                    self.stable.set()
+            self._govern(sample)
+            self._check_memory(process)
+            self._check_uplink(sample, process)
+            if self.dvr is not None:
+                self.dvr.prune()
+
+    def _govern(self, sample):
+        """تمرير العينة للمنظم وإعادة التشغيل إذا قرر تغيير الإعداد"""
+        if self.governor is None or not self.is_running or self.restart_lock.locked():
+            return
+        if self.ladder is not None and self.ladder.congested_since is not None:
+            # speed منخفض بسبب الرفع وليس المعالج - السلم يعالجه
+            return
+        decision = self.governor.observe(sample)
+        if decision:
+            to = decision["to"]
+            self.spawn_task(self.restart(f"المنظم: {to['preset']}/{to['threads']}t - {decision['reason']}"), "إعادة تشغيل المنظم")
+
+    def _check_memory(self, process):
+        """عينة RSS من /proc - تخفيض الدقة والطوابير قبل الوصول لحد الحاوية"""
+        if self.memory is None or not self.is_running or self.restart_lock.locked():
+            return
+        decision = self.memory.observe(process.pid, queues_only=self.copy_video)
+        # النسخ المباشر: الأمر لا يتغير إلا في أحجام الطوابير - لا تستحق إعادة اتصال
+        if decision and not decision["queues_only"]:
+            self.spawn_task(self.restart(f"الذاكرة: {decision['to']}p - {decision['reason']}"), "إعادة تشغيل الذاكرة")
+
+    def rebalance_memory(self, concurrent):
+        """بث جديد قُبل - تخفيض هذا البث إذا لم يعد نصيبه يكفي مستواه الحالي"""
+        if self.memory is None or not self.is_running:
+            return
+        decision = self.memory.rebalance(concurrent, queues_only=self.copy_video)
+        if decision and not decision["queues_only"]:
+            self.spawn_task(self.restart(f"الذاكرة: {decision['to']}p - {decision['reason']}"), "إعادة تشغيل الذاكرة")
+
+    def _check_uplink(self, sample, process):
+        """طوابير إرسال RTMP - النزول في سلم المعدل عند ازدحام مستمر والصعود عند عودة الفائض"""
+        if self.ladder is None or not self.is_running or self.restart_lock.locked():
+            return
+        decision = self.ladder.observe(sample, process.pid)
+        if decision:
+            self.save_state()
+            self.spawn_task(self.restart(f"الرفع: {decision['to']['height']}p/{decision['to']['bitrate_kbps']}k - {decision['reason']}"), "إعادة تشغيل السلم")
+
+    async def _capture_stderr(self, process):
+        """قراءة مخرجات FFmpeg داخل العملية إلى حلقة اللوج"""
+        try:
+            while True:
+                chunk = await process.stderr.read(4096)
+                if not chunk:
+                    break
+                for text in self.logs.feed(chunk):
+                    if process is self.process:
+                        self._check_slave_failure(text)
+        finally:
+            self.logs.close()
+
+    def _check_slave_failure(self, text):
+        """سطر سقوط مخرج من tee - ترتيب المخرجات: الوجهات أولاً ثم DVR"""
+        match = SLAVE_FAILED_RE.search(text)
+        if match is None:
+            return
+        index = int(match.group(1))
+        if index >= len(self.destinations) or index in self.failed_destinations:
+            return
+        self.failed_destinations.add(index)
+        remaining = len(self.destinations) - len(self.failed_destinations)
+        logger.warning(f"⚠️ البث #{self.stream_id}: سقطت الوجهة {index + 1} ({remaining} متبقية)")
+        if remaining and self.is_running:
+            self.spawn_task(self.notify(
+                f"⚠️ البث #{self.stream_id}: سقطت الوجهة {index + 1} - البث مستمر على {remaining}\n"
+                f"🔁 تعود مع إعادة التشغيل التالية"
+            ), "تنبيه سقوط وجهة")
+
+    def outputs_lost(self):
+        """كل وجهات RTMP سقطت والعملية ما زالت تعمل (مخرج DVR مع onfail=ignore)"""
+        return bool(self.destinations) and len(self.failed_destinations) >= len(self.destinations)
+
+    def latest_snapshot(self):
+        """آخر لقطة إن كانت حديثة - يرجع (عمر اللقطة بالثواني، JPEG) أو None"""
+        if self.snapshot_path is None or not self.is_process_alive():
+            return None
+        try:
+            age = time.time() - os.path.getmtime(self.snapshot_path)
+            if age > config.SNAPSHOT_MAX_AGE:
+                return None
+            with open(self.snapshot_path, "rb") as f:
+                return age, f.read()
+        except OSError:
+            return None
+
     def _read_error_log(self):
-        """قراءة لوج الأخطاء"""
+        """آخر أسطر الأخطاء من الحلقة"""
         try:
-            if os.path.exists(self.log_file):
-                with open(self.log_file, 'r') as f:
-                    content = f.read()
-                    if content:
-                        lines = content.strip().split('\n')
-                        last_lines = lines[-5:] if len(lines) > 5 else lines
-                        return "📋 " + "\n".join(last_lines)[:300]
+            last_lines = self.logs.tail(5)
+            if last_lines:
+                return "📋 " + "\n".join(last_lines)[:300]
             return "تحقق من الرابط و Stream Key"
         except:
             return "تحقق من الرابط و Stream Key"
 
-    def stop_stream(self):
+    async def stop_stream(self):
         """إيقاف البث"""
         try:
             if not self.is_running:
                 return False, "⚠️ لا يوجد بث نشط."
             
-            self.kill_existing_session()
             self.is_running = False
+            if self.ladder is not None and self.ladder.step_downs:
+                logger.info(f"📶 البث #{self.stream_id}: {self.ladder.step_downs} نزول - {self.ladder.summary()}")
+            if self.monitor_task is not None:
+                self.monitor_task.cancel()
+            if self.playlist_task is not None:
+                self.playlist_task.cancel()
+            # إعادة تشغيل في الخلفية (المنظم، الذاكرة، السلم...) قد تكون بين قتل القديمة وتشغيل الجديدة
+            current = asyncio.current_task()
+            for task in list(self.background):
+                if task is not current:
+                    task.cancel()
+            # العملية الحالية أولاً - إعادة تشغيل تنتظر أول حزمة منها تنتهي فوراً
+            await self.kill_process()
+            async with self.restart_lock:
+                await self.kill_process()
+            await self.stop_relay()
             self.process = None
+            self.save_state()
+            if self.dvr is not None:
+                self.dvr.clear()
+            if self.snapshot_path is not None and os.path.exists(self.snapshot_path):
+                os.remove(self.snapshot_path)
             
-            logger.info("⏹️ تم إيقاف البث")
-            return True, "⏹️ تم إيقاف البث بنجاح!"
+            logger.info(f"⏹️ تم إيقاف البث #{self.stream_id}")
+            return True, f"⏹️ تم إيقاف البث #{self.stream_id} بنجاح!"
             
         except Exception as e:
             logger.error(f"خطأ في الإيقاف: {e}")
@@ -260,29 +1130,421 @@ class StreamManager:
     def get_detailed_status(self):
         """الحصول على حالة مفصلة"""
         if not self.is_running:
-            return "⏸️ البث متوقف"
+            return f"⏸️ البث #{self.stream_id} متوقف"
         
-        if self.get_tmux_session_exists():
-            return "✅ البث نشط ويعمل"
+        if self.outage_started is not None:
+            return f"🔁 البث #{self.stream_id} يُعاد تشغيله (منذ {time.time() - self.outage_started:.0f} ثانية، {self.restarts} إعادة)"
+        
+        if self.is_process_alive():
+            uptime = int(time.time() - self.started_at) if self.started_at else 0
+            status = f"✅ البث #{self.stream_id} نشط ويعمل ({uptime // 60} دقيقة)"
+            stats = self.telemetry.summary()
+            if stats:
+                status += (
+                    f"\n🎞️ {stats['fps']:.1f} fps | ⚡ {stats['speed']:.2f}x"
+                    f" | 📶 {stats['bitrate_kbps']:.0f} kbps"
+                    f" | 🗑️ {stats['drop_frames']} مُسقط"
+                )
+            if self.governor:
+                profile = self.governor.profile
+                status += f"\n⚙️ {profile['preset']} / {profile['threads']} threads ({self.governor.changes} تعديل)"
+            if self.memory and self.memory.rss is not None:
+                mem = self.memory.to_dict()
+                status += f"\n🧠 {mem['rss_mb']:.0f}MB من {mem['budget_mb']:.0f}MB"
+                if mem["headroom_mb"] is not None:
+                    status += f" | متبقٍ {mem['headroom_mb']:.0f}MB"
+                if self.memory.degradations:
+                    status += f" | {mem['tier']['height']}p"
+            if self.ladder:
+                rung = self.ladder.rung()
+                status += f"\n📶 {rung['height']}p / {rung['bitrate_kbps']}k"
+                achieved = self.ladder.achieved_kbps()
+                if achieved is not None:
+                    status += f" | وصل {achieved}k"
+                if self.ladder.backlog_seconds is not None:
+                    status += f" | طابور الإرسال {self.ladder.backlog_seconds:.1f} ثانية"
+                if self.ladder.step_downs:
+                    status += f" | {self.ladder.step_downs} نزول"
+            if self.queue:
+                status += f"\n📼 {len(self.queue)} مصادر في القائمة"
+            if self.relay and self.relay.active != "primary":
+                status += "\n🛟 يعمل على المصدر الاحتياطي" if self.relay.active == "backup" else "\n🎬 شاشة الانتظار"
+            elif self.relay and self.relay.standby:
+                status += "\n🛟 احتياطي جاهز"
+            if self.dvr is not None:
+                dvr = self.dvr.stats()
+                status += f"\n⏺️ DVR: {dvr['seconds'] / 60:.1f} دقيقة ({dvr['bytes'] / 1048576:.0f}MB)"
+            if self.restarts:
+                status += f"\n🔁 {self.restarts} إعادة تشغيل | توفر {self.availability():.2%}"
+            return status
         else:
             self.is_running = False
-            return "❌ البث توقف بشكل غير متوقع"
+            return f"❌ البث #{self.stream_id} توقف بشكل غير متوقع"
 
-    def _monitor(self):
-        """مراقبة البث"""
-        check_interval = 10
-        failures = 0
-        
+    def metric_labels(self):
+        return f'owner="{self.owner_id}",stream="{self.stream_id}"'
+
+    def status_dict(self):
+        """حالة البث بصيغة JSON لـ /api/status"""
+        return {
+            "owner": self.owner_id,
+            "stream": self.stream_id,
+            "running": self.is_running,
+            "alive": self.is_process_alive(),
+            "mode": self.mode,
+            # رابط الجودة قد يحمل رموز وصول المصدر
+            "variant": {k: v for k, v in self.variant.items() if k != "url"} if self.variant else None,
+            "edge": self.edge,
+            "destinations": len(self.destinations),
+            "encoder": self.governor.to_dict() if self.governor else None,
+            "relay": self.relay.to_dict() if self.relay else None,
+            "memory": self.memory.to_dict() if self.memory else None,
+            "ladder": self.ladder.to_dict() if self.ladder else None,
+            "log": self.logs.to_dict(),
+            "dvr": self.dvr.to_dict() if self.dvr else None,
+            "overlay": {**self.overlay, "live": self.live_overlay},
+            "queue": [
+                {"host": urlparse(e["url"]).hostname, "at": e["at"]} for e in list(self.queue)
+            ],
+            "watchdog": {
+                "restarts": self.restarts,
+                "recovery_times": list(self.recovery_times),
+                "downtime_s": round(self.downtime, 1),
+                "availability": self.availability(),
+                "in_outage": self.outage_started is not None,
+            },
+            "started_at": self.started_at,
+            "telemetry": self.telemetry.summary(),
+        }
+
+    def is_stalled(self):
+        """FFmpeg حي لكن المخرج لا يتقدم (لا وقت ولا بايتات)"""
+        return time.time() - self.last_output_at > config.STALL_SECONDS
+
+    async def notify(self, text):
+        if self.registry is not None:
+            await self.registry.notify(self.owner_id, text)
+
+    async def _watchdog(self):
+        """مراقبة البث - خروج العملية فوري عبر wait() وتوقف المخرج خلال ثوانٍ"""
         while self.is_running:
-            time.sleep(check_interval)
-            
-            if not self.get_tmux_session_exists():
-                failures += 1
-                logger.warning(f"⚠️ البث انقطع (محاولة {failures})")
-                
-                if failures >= 2:
-                    logger.error("❌ البث فشل")
-                    self.is_running = False
-                    break
-            else:
-                failures = 0
+            process = self.process
+            if self.restart_lock.locked():
+                await asyncio.sleep(config.WATCHDOG_INTERVAL)
+                continue
+            if process is None:
+                # إعادة تشغيل سابقة فشلت قبل أن تبدأ العملية الجديدة
+                await self._recover("تعذر تشغيل FFmpeg")
+                continue
+            exit_waiter = asyncio.create_task(process.wait())
+            await asyncio.wait({exit_waiter}, timeout=config.WATCHDOG_INTERVAL)
+            exit_waiter.cancel()
+            if not self.is_running or process is not self.process:
+                continue
+            if process.returncode is not None:
+                await self._recover(f"خرج FFmpeg (رمز {process.returncode})")
+            elif self.outputs_lost():
+                await self._recover("سقطت كل الوجهات")
+            elif self.is_stalled():
+                await self._recover(f"المخرج متوقف منذ {time.time() - self.last_output_at:.0f} ثانية")
+
+    async def _recover(self, reason):
+        """إعادة تشغيل بتأخير متزايد ضمن ميزانية محاولات"""
+        now = time.time()
+        if self.outage_started is None:
+            self.outage_started = now
+            logger.warning(f"⚠️ البث #{self.stream_id}: {reason}\n{self._read_error_log()}")
+            await self.notify(f"⚠️ البث #{self.stream_id} انقطع: {reason}\n🔁 جاري إعادة التشغيل...")
+
+        while self.restart_times and now - self.restart_times[0] > config.WATCHDOG_BUDGET_WINDOW:
+            self.restart_times.popleft()
+        if len(self.restart_times) >= config.WATCHDOG_MAX_RESTARTS:
+            logger.error(f"❌ البث #{self.stream_id} فشل - استُنفدت محاولات إعادة التشغيل")
+            self.is_running = False
+            await self.kill_process()
+            await self.stop_relay()
+            self.save_state()
+            await self.notify(
+                f"❌ البث #{self.stream_id} توقف بعد {len(self.restart_times)} محاولات خلال "
+                f"{config.WATCHDOG_BUDGET_WINDOW // 60} دقيقة\n{self._read_error_log()}"
+            )
+            return
+
+        delay = min(config.WATCHDOG_BACKOFF_MAX, config.WATCHDOG_BACKOFF_BASE * 2 ** self.consecutive_failures)
+        await asyncio.sleep(delay)
+        if not self.is_running:
+            return
+        self.restart_times.append(time.time())
+        self.restarts += 1
+
+        try:
+            ok = await self.restart(f"المراقب: {reason}")
+        except Exception as e:
+            # محاولة فاشلة مثل غيرها - المراقب يبقى حياً ويواصل التأخير المتزايد
+            logger.error(f"❌ فشل إعادة تشغيل البث #{self.stream_id}: {e}")
+            ok = False
+        if ok:
+            recovered_in = time.time() - self.outage_started
+            self.recovery_times.append(recovered_in)
+            self.downtime += recovered_in
+            self.outage_started = None
+            self.consecutive_failures = 0
+            logger.info(f"✅ البث #{self.stream_id} عاد خلال {recovered_in:.1f} ثانية")
+            await self.notify(f"✅ البث #{self.stream_id} عاد خلال {recovered_in:.1f} ثانية")
+        else:
+            self.consecutive_failures += 1
+
+    def availability(self):
+        """نسبة الوقت الذي كان فيه المخرج يعمل منذ بدء البث"""
+        if not self.started_at:
+            return None
+        total = time.time() - self.started_at
+        down = self.downtime + (time.time() - self.outage_started if self.outage_started else 0)
+        return max(0.0, 1 - down / total) if total > 0 else 1.0
+
+    def save_state(self):
+        if self.registry is not None:
+            self.registry.save_state()
+
+    def state_entry(self):
+        """ما يلزم لتبني المرمّز الحالي بعد إعادة تشغيل البوت"""
+        return {
+            "owner": self.owner_id,
+            "stream": self.stream_id,
+            "pid": self.process.pid,
+            "start_ticks": process_start_ticks(self.process.pid),
+            "config_hash": config_hash(),
+            "started_at": self.started_at,
+            "source_url": self.source_url,
+            "source_key": self.source_key,
+            "backup_url": self.backup_url,
+            "queue": self.queue,
+            "destinations": self.destinations,
+            "variant": self.variant,
+            "copy_video": self.copy_video,
+            "copy_audio": self.copy_audio,
+            "overlay": self.overlay,
+            "relay_port": self.relay.port if self.relay is not None else None,
+            "ladder_rung": self.ladder.index if self.ladder is not None else 0,
+            "restarts": self.restarts,
+            "downtime": self.downtime,
+        }
+
+    async def adopt(self, entry):
+        """متابعة مرمّز من تشغيل سابق للبوت كما هو - بدون إعادة تشغيل ولا نافذة تحقق"""
+        self.started_at = entry["started_at"]
+        self.source_url = entry["source_url"]
+        self.source_key = entry["source_key"]
+        self.backup_url = entry["backup_url"]
+        self.queue = entry["queue"]
+        self.destinations = entry["destinations"]
+        self.variant = entry["variant"]
+        self.copy_video = entry["copy_video"]
+        self.copy_audio = entry["copy_audio"]
+        self.overlay.update(entry["overlay"])
+        self.restarts = entry["restarts"]
+        self.downtime = entry["downtime"]
+        self.mode = self.describe_mode(self.copy_video, self.copy_audio)
+        self.encode_cost = self.estimate_cost(self.copy_video, self.copy_audio)
+
+        concurrent = self.registry.active_count() + 1 if self.registry else 1
+        if config.MEMORY_BUDGET_ENABLED:
+            self.memory = MemoryBudget(concurrent)
+        if config.GOVERNOR_ENABLED and not self.copy_video:
+            self.governor = EncoderGovernor(concurrent)
+        if config.LADDER_ENABLED and not self.copy_video:
+            self.ladder = UplinkLadder(entry.get("ladder_rung", 0))
+        # اللوجو لإعادة التشغيل اللاحقة - أوامر stdin لم تعد ممكنة للعملية القديمة
+        await self.prepare_overlay()
+        if entry["relay_port"]:
+            # المرمّز يعيد الاتصال بنفس المنفذ خلال RELAY_RECONNECT_DELAY_MAX
+            try:
+                await self.start_relay(entry["relay_port"])
+            except OSError as e:
+                logger.warning(f"⚠️ تعذر فتح منفذ الوسيط {entry['relay_port']} للبث #{self.stream_id}: {e}")
+
+        self.process = AdoptedProcess(entry["pid"], entry["start_ticks"])
+        self.live_overlay = False
+        self.telemetry = StreamTelemetry()
+        self.first_packet = asyncio.Event()
+        self.stable = asyncio.Event()
+        self.first_packet.set()
+        self.stable.set()
+        self.last_output_at = time.time()
+        self.is_running = True
+        self.progress_task = asyncio.create_task(self._watch_adopted(self.process))
+        self.monitor_task = asyncio.create_task(self._watchdog())
+        self.playlist_task = asyncio.create_task(self._playlist_loop())
+        logger.info(f"♻️ تبني البث #{self.stream_id} للمحادثة {self.owner_id} (PID {self.process.pid})")
+
+    async def _watch_adopted(self, process):
+        """تقدم المرمّز المُتبنى من البايتات المؤكدة على مقابس RTMP - stdout القديم لم يعد متصلاً
+
+        ملفات DVR واللقطة وطلبات المصدر لا تُحسب: توقف الوجهات وحده يعني توقف المخرج
+        """
+        last = output_acked_total(process.pid)
+        if last is None:
+            logger.warning(f"⚠️ البث #{self.stream_id}: عدادات TCP غير متاحة - المراقب يكشف خروج المرمّز المُتبنى فقط")
+        while process.returncode is None:
+            await asyncio.sleep(config.WATCHDOG_INTERVAL)
+            if process is not self.process:
+                break
+            current = output_acked_total(process.pid)
+            if current is None or (last is not None and current > last):
+                self.last_output_at = time.time()
+            last = current
+            self._check_memory(process)
+            if self.dvr is not None:
+                self.dvr.prune()
+
+
+class StreamRegistry:
+    """سجل البثوث المتزامنة - لكل محادثة عدة بثوث مستقلة"""
+
+    def __init__(self):
+        self.streams = {}
+        self.pending = set()
+        self.lock = threading.Lock()
+        # يضبطه البوت: async (chat_id, text) لإرسال التنبيهات للمحادثة المالكة
+        self.notifier = None
+        # يضبطه البوت: حلقة asyncio التي تعمل فيها البثوث (لطلبات خادم الويب من خيطه)
+        self.loop = None
+        self.session = SessionState(config.STATE_PATH)
+
+    async def notify(self, owner_id, text):
+        if self.notifier is None:
+            return
+        try:
+            await self.notifier(owner_id, text)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر إرسال التنبيه: {e}")
+
+    def _prune(self):
+        """حذف البثوث التي توقفت من تلقاء نفسها"""
+        stale = [k for k, m in self.streams.items() if not m.is_running and k not in self.pending]
+        for key in stale:
+            del self.streams[key]
+
+    def _next_stream_id(self, owner_id):
+        used = {sid for (oid, sid) in self.streams if oid == owner_id}
+        n = 1
+        while str(n) in used:
+            n += 1
+        return str(n)
+
+    def get(self, owner_id, stream_id):
+        return self.streams.get((owner_id, str(stream_id)))
+
+    def list_streams(self, owner_id=None):
+        """البثوث النشطة (لمحادثة معينة أو للجميع)"""
+        return [
+            m for (oid, _), m in sorted(self.streams.items())
+            if m.is_running and (owner_id is None or oid == owner_id)
+        ]
+
+    def active_count(self):
+        return sum(1 for k, m in self.streams.items() if m.is_running or k in self.pending)
+
+    def active_load(self):
+        """مجموع تكلفة البثوث الجارية - البث قيد البدء يُحسب ترميزاً كاملاً"""
+        return sum(
+            1.0 if k in self.pending else m.encode_cost
+            for k, m in self.streams.items()
+            if m.is_running or k in self.pending
+        )
+
+    def capacity(self):
+        """عدد البثوث التي يتحملها المعالج"""
+        cpus = os.cpu_count() or 1
+        return max(1, int(cpus * config.STREAMS_PER_CPU))
+
+    def check_admission(self):
+        """التحقق من وجود قدرة ترميز كافية لبث جديد"""
+        active = self.active_count()
+        capacity = self.capacity()
+        if self.active_load() + 1.0 > capacity + 1e-6:
+            return False, f"⛔ الخادم ممتلئ ({active}/{capacity} بث)\nأوقف بثاً آخر أو حاول لاحقاً"
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except OSError:
+            load = 0.0
+        if active > 0 and load >= config.MAX_CPU_LOAD:
+            return False, f"⛔ المعالج مشغول ({load:.0%})\nالبث الجديد سيُسقط إطارات البثوث الحالية"
+        return True, ""
+
+    async def start_stream(self, owner_id, m3u8_url, destinations, on_progress=None):
+        """بدء بث جديد للمحادثة مع التحكم في القبول"""
+        with self.lock:
+            self._prune()
+            ok, msg = self.check_admission()
+            if not ok:
+                logger.warning(f"⛔ رفض بث جديد للمحادثة {owner_id}")
+                return False, msg, None
+            stream_id = self._next_stream_id(owner_id)
+            manager = StreamManager(owner_id, stream_id, self)
+            self.streams[(owner_id, stream_id)] = manager
+            self.pending.add((owner_id, stream_id))
+            # نصيب كل بث من الذاكرة يصغر - البثوث الجارية تنزل مستوى قبل أن يبدأ الجديد
+            concurrent = self.active_count()
+            for other in self.list_streams():
+                other.rebalance_memory(concurrent)
+
+        try:
+            best_m3u8 = await manager.resolve_source(m3u8_url)
+            success, msg = await manager.start_stream(best_m3u8, destinations, on_progress)
+        finally:
+            with self.lock:
+                self.pending.discard((owner_id, stream_id))
+        if not success:
+            with self.lock:
+                self.streams.pop((owner_id, stream_id), None)
+        return success, msg, stream_id
+
+    async def stop_stream(self, owner_id, stream_id):
+        manager = self.get(owner_id, stream_id)
+        if manager is None:
+            return False, f"⚠️ لا يوجد بث #{stream_id}."
+        result = await manager.stop_stream()
+        with self.lock:
+            self.streams.pop((owner_id, str(stream_id)), None)
+        return result
+
+    def save_state(self):
+        if config.REATTACH_ENABLED:
+            self.session.save([m.state_entry() for m in self.list_streams() if m.process is not None])
+
+    async def restore(self):
+        """عند تشغيل البوت: تبني المرمّزات الحية من التشغيل السابق وإيقاف ما لا صاحب له"""
+        running = marked_processes()
+        adopted = set()
+        current = config_hash()
+        for entry in self.session.load() if config.REATTACH_ENABLED else []:
+            owner_id, stream_id = entry["owner"], str(entry["stream"])
+            manager = StreamManager(owner_id, stream_id, self)
+            pid = entry["pid"]
+            if running.get(pid) != manager.name or process_start_ticks(pid) != entry["start_ticks"]:
+                logger.info(f"🪦 البث #{stream_id} للمحادثة {owner_id} انتهى أثناء غياب البوت")
+                await self.notify(owner_id, f"⚠️ البث #{stream_id} توقف أثناء إعادة تشغيل البوت\n/stream لبدء بث جديد")
+                continue
+            try:
+                await manager.adopt(entry)
+            except Exception as e:
+                logger.error(f"❌ تعذر تبني البث #{stream_id}: {e}")
+                continue
+            self.streams[(owner_id, stream_id)] = manager
+            adopted.add(pid)
+            if entry["config_hash"] != current:
+                # نفس المصدر والوجهات بإعدادات النشر الجديد - إعادة اتصال قصيرة بدل بث جديد
+                manager.spawn_task(manager.restart("الإعدادات تغيرت"), "إعادة التشغيل بالإعدادات الجديدة")
+            await self.notify(owner_id, f"♻️ البث #{stream_id} مستمر بعد إعادة تشغيل البوت")
+
+        for pid, name in running.items():
+            if pid not in adopted:
+                logger.warning(f"🧹 إيقاف مرمّز يتيم {name} (PID {pid})")
+                terminate(pid)
+        self.save_state()
+        return len(adopted)
+
+    async def stop_all(self, owner_id):
+        for manager in self.list_streams(owner_id):
+            await self.stop_stream(owner_id, manager.stream_id)
@@ -0,0 +1,234 @@
+import time
+from collections import deque
+import config
+from governor import PRESETS
+
+
+def _to_number(value, suffix=""):
+    """تحويل قيم -progress مثل 3500.0kbits/s و 1.01x و N/A إلى أرقام"""
+    if value is None:
+        return 0.0
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def parse_progress_block(block):
+    """تحويل كتلة -progress (مفتاح=قيمة) إلى عينة رقمية"""
+    return {
+        "time": time.time(),
+        "frame": int(_to_number(block.get("frame"))),
+        "fps": _to_number(block.get("fps")),
+        "bitrate_kbps": _to_number(block.get("bitrate"), "kbits/s"),
+        "speed": _to_number(block.get("speed"), "x"),
+        "dup_frames": int(_to_number(block.get("dup_frames"))),
+        "drop_frames": int(_to_number(block.get("drop_frames"))),
+        "out_time_s": _to_number(block.get("out_time_us")) / 1_000_000,
+        "total_size": int(_to_number(block.get("total_size"))),
+    }
+
+
+class StreamTelemetry:
+    """سلسلة زمنية بحجم ثابت لعينات تقدم FFmpeg"""
+
+    def __init__(self, max_samples=None):
+        self.samples = deque(maxlen=max_samples or config.TELEMETRY_SAMPLES)
+
+    def add(self, block):
+        sample = parse_progress_block(block)
+        self.samples.append(sample)
+        return sample
+
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    def window(self, seconds):
+        """العينات خلال آخر عدد من الثواني"""
+        cutoff = time.time() - seconds
+        return [s for s in list(self.samples) if s["time"] >= cutoff]
+
+    def summary(self):
+        latest = self.latest()
+        if latest is None:
+            return None
+        return {
+            "fps": latest["fps"],
+            "speed": latest["speed"],
+            "bitrate_kbps": latest["bitrate_kbps"],
+            "dup_frames": latest["dup_frames"],
+            "drop_frames": latest["drop_frames"],
+            "out_time_s": latest["out_time_s"],
+            "total_size": latest["total_size"],
+            "age_s": round(time.time() - latest["time"], 1),
+        }
+
+    def to_dict(self):
+        return {"latest": self.summary(), "samples": list(self.samples)}
+
+
+METRICS = [
+    ("fbstream_fps", "gauge", "Encoder output frames per second", "fps"),
+    ("fbstream_speed", "gauge", "Encode speed relative to realtime", "speed"),
+    ("fbstream_bitrate_kbps", "gauge", "Output bitrate in kbit/s", "bitrate_kbps"),
+    ("fbstream_out_time_seconds", "gauge", "Output timestamp in seconds", "out_time_s"),
+    ("fbstream_output_bytes_total", "counter", "Bytes written to the output", "total_size"),
+    ("fbstream_frames_total", "counter", "Frames written to the output", "frame"),
+    ("fbstream_dup_frames_total", "counter", "Frames duplicated to keep the frame rate", "dup_frames"),
+    ("fbstream_drop_frames_total", "counter", "Frames dropped to keep the frame rate", "drop_frames"),
+]
+
+
+def render_prometheus(registry):
+    """عرض حالة كل البثوث بصيغة Prometheus النصية"""
+    managers = registry.list_streams()
+    lines = [
+        "# HELP fbstream_streams_active Streams currently running",
+        "# TYPE fbstream_streams_active gauge",
+        f"fbstream_streams_active {len(managers)}",
+        "# HELP fbstream_capacity Streams the host can encode",
+        "# TYPE fbstream_capacity gauge",
+        f"fbstream_capacity {registry.capacity()}",
+        "# HELP fbstream_up Whether the stream's ffmpeg process is alive",
+        "# TYPE fbstream_up gauge",
+    ]
+    for m in managers:
+        lines.append(f'fbstream_up{{{m.metric_labels()}}} {1 if m.is_process_alive() else 0}')
+
+    lines.extend([
+        "# HELP fbstream_uptime_seconds Seconds since the stream started",
+        "# TYPE fbstream_uptime_seconds gauge",
+    ])
+    for m in managers:
+        uptime = time.time() - m.started_at if m.started_at else 0
+        lines.append(f'fbstream_uptime_seconds{{{m.metric_labels()}}} {uptime:.0f}')
+
+    for name, kind, help_text, field in METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for m in managers:
+            latest = m.telemetry.latest()
+            if latest is not None:
+                lines.append(f'{name}{{{m.metric_labels()}}} {latest[field]}')
+
+    lines.extend([
+        "# HELP fbstream_restarts_total Watchdog restarts of the encoder",
+        "# TYPE fbstream_restarts_total counter",
+    ])
+    for m in managers:
+        lines.append(f'fbstream_restarts_total{{{m.metric_labels()}}} {m.restarts}')
+    lines.extend([
+        "# HELP fbstream_downtime_seconds_total Seconds spent recovering from outages",
+        "# TYPE fbstream_downtime_seconds_total counter",
+    ])
+    for m in managers:
+        lines.append(f'fbstream_downtime_seconds_total{{{m.metric_labels()}}} {m.downtime:.1f}')
+    lines.extend([
+        "# HELP fbstream_last_recovery_seconds Time to recover from the last outage",
+        "# TYPE fbstream_last_recovery_seconds gauge",
+    ])
+    for m in managers:
+        if m.recovery_times:
+            lines.append(f'fbstream_last_recovery_seconds{{{m.metric_labels()}}} {m.recovery_times[-1]:.2f}')
+
+    governed = [m for m in managers if m.governor is not None]
+    lines.extend([
+        "# HELP fbstream_encoder_threads x264 threads chosen by the governor",
+        "# TYPE fbstream_encoder_threads gauge",
+    ])
+    for m in governed:
+        lines.append(f'fbstream_encoder_threads{{{m.metric_labels()}}} {m.governor.profile["threads"]}')
+    lines.extend([
+        "# HELP fbstream_encoder_preset_level x264 preset index (0 = ultrafast)",
+        "# TYPE fbstream_encoder_preset_level gauge",
+    ])
+    for m in governed:
+        level = PRESETS.index(m.governor.profile["preset"])
+        lines.append(f'fbstream_encoder_preset_level{{{m.metric_labels()}}} {level}')
+    lines.extend([
+        "# HELP fbstream_governor_changes_total Encoder profile changes made by the governor",
+        "# TYPE fbstream_governor_changes_total counter",
+    ])
+    for m in governed:
+        lines.append(f'fbstream_governor_changes_total{{{m.metric_labels()}}} {m.governor.changes}')
+
+    relayed = [m for m in managers if m.relay is not None]
+    lines.extend([
+        "# HELP fbstream_failovers_total Source switches made by the relay (backup, slate, back to primary)",
+        "# TYPE fbstream_failovers_total counter",
+    ])
+    for m in relayed:
+        lines.append(f'fbstream_failovers_total{{{m.metric_labels()}}} {m.relay.stats["failovers"]}')
+    lines.extend([
+        "# HELP fbstream_last_failover_ms Time from detecting a stalled source to feeding the replacement",
+        "# TYPE fbstream_last_failover_ms gauge",
+    ])
+    for m in relayed:
+        # القراءة من خيط الويب والإضافة من حلقة البوت - نسخة في عبارة واحدة قبل المرور عليها
+        timed = [e for e in list(m.relay.failovers) if e["switch_ms"] is not None]
+        if timed:
+            lines.append(f'fbstream_last_failover_ms{{{m.metric_labels()}}} {timed[-1]["switch_ms"]}')
+
+    budgeted = [m for m in managers if m.memory is not None and m.memory.rss is not None]
+    lines.extend([
+        "# HELP fbstream_ffmpeg_rss_bytes Resident memory of the stream's ffmpeg process",
+        "# TYPE fbstream_ffmpeg_rss_bytes gauge",
+    ])
+    for m in budgeted:
+        lines.append(f'fbstream_ffmpeg_rss_bytes{{{m.metric_labels()}}} {m.memory.rss}')
+    lines.extend([
+        "# HELP fbstream_memory_headroom_bytes Memory left before the container limit",
+        "# TYPE fbstream_memory_headroom_bytes gauge",
+    ])
+    for m in budgeted:
+        headroom = m.memory.headroom_bytes()
+        if headroom is not None:
+            lines.append(f'fbstream_memory_headroom_bytes{{{m.metric_labels()}}} {headroom}')
+
+    laddered = [m for m in managers if m.ladder is not None]
+    lines.extend([
+        "# HELP fbstream_output_bitrate_kbps Video bitrate of the current ladder rung",
+        "# TYPE fbstream_output_bitrate_kbps gauge",
+    ])
+    for m in laddered:
+        lines.append(f'fbstream_output_bitrate_kbps{{{m.metric_labels()}}} {m.ladder.rung()["bitrate_kbps"]}')
+    lines.extend([
+        "# HELP fbstream_upload_backlog_bytes Bytes waiting in the encoder's TCP send queues",
+        "# TYPE fbstream_upload_backlog_bytes gauge",
+    ])
+    for m in laddered:
+        if m.ladder.backlog is not None:
+            lines.append(f'fbstream_upload_backlog_bytes{{{m.metric_labels()}}} {m.ladder.backlog}')
+    lines.extend([
+        "# HELP fbstream_upload_acked_kbps Bitrate acknowledged by the RTMP destinations (tcpi_bytes_acked)",
+        "# TYPE fbstream_upload_acked_kbps gauge",
+    ])
+    for m in laddered:
+        achieved = m.ladder.achieved_kbps()
+        if achieved is not None:
+            lines.append(f'fbstream_upload_acked_kbps{{{m.metric_labels()}}} {achieved}')
+    lines.extend([
+        "# HELP fbstream_ladder_step_downs_total Bitrate ladder steps down caused by uplink congestion",
+        "# TYPE fbstream_ladder_step_downs_total counter",
+    ])
+    for m in laddered:
+        lines.append(f'fbstream_ladder_step_downs_total{{{m.metric_labels()}}} {m.ladder.step_downs}')
+    lines.extend([
+        "# HELP fbstream_ladder_rung_seconds_total Seconds spent at each bitrate ladder rung",
+        "# TYPE fbstream_ladder_rung_seconds_total counter",
+    ])
+    for m in laddered:
+        for rung, seconds in m.ladder.to_dict()["rung_seconds"].items():
+            lines.append(f'fbstream_ladder_rung_seconds_total{{{m.metric_labels()},rung="{rung}"}} {seconds}')
+
+    lines.extend([
+        "# HELP fbstream_source_throughput_kbps Measured download throughput of the source chosen at start",
+        "# TYPE fbstream_source_throughput_kbps gauge",
+    ])
+    for m in managers:
+        if m.edge:
+            lines.append(f'fbstream_source_throughput_kbps{{{m.metric_labels()},host="{m.edge["host"]}"}} {m.edge["throughput_kbps"]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,109 @@
+"""تحليل قوائم HLS واختيار الجودة"""
+import pytest
+
+from hls import TTLCache, is_master_playlist, parse_master_playlist, parse_media_playlist, select_variant
+
+BASE = "https://cdn.example.com/live/master.m3u8?token=abc"
+
+MASTER = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="en",URI="audio/en.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=6000000,AVERAGE-BANDWIDTH=5500000,RESOLUTION=1920x1080,FRAME-RATE=60.000,CODECS="avc1.64002a,mp4a.40.2"
+1080p60/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=3800000,RESOLUTION=1280x720,FRAME-RATE=30.000,CODECS="avc1.4d401f,mp4a.40.2"
+720p30/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=3600000,RESOLUTION=1280x720,FRAME-RATE=30.000,CODECS="avc1.4d401f",AUDIO="aud"
+720p30-video/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1500000,RESOLUTION=854x480,FRAME-RATE=30.000
+https://other.example.com/480p.m3u8
+"""
+
+
+def test_parse_master_playlist():
+    variants = parse_master_playlist(MASTER, BASE)
+    assert [v["height"] for v in variants] == [1080, 720, 720, 480]
+    first = variants[0]
+    assert first["url"] == "https://cdn.example.com/live/1080p60/index.m3u8"
+    # AVERAGE-BANDWIDTH أدق من BANDWIDTH
+    assert first["bandwidth"] == 5500000
+    assert (first["width"], first["fps"]) == (1920, 60.0)
+    assert first["codecs"] == "avc1.64002a,mp4a.40.2"
+    assert variants[3]["url"] == "https://other.example.com/480p.m3u8"
+    # الصوت في مجموعة منفصلة لا يصل مع قائمة الفيديو وحدها
+    assert [v["separate_audio"] for v in variants] == [False, False, True, False]
+
+
+def test_master_without_resolution():
+    variants = parse_master_playlist("#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow.m3u8\n", BASE)
+    assert variants[0]["width"] == variants[0]["height"] == 0
+    assert variants[0]["fps"] == 0.0
+
+
+def test_is_master_playlist():
+    assert is_master_playlist(MASTER)
+    assert not is_master_playlist("#EXTM3U\n#EXTINF:2.0,\n0.ts\n")
+
+
+def test_select_variant_prefers_matching_output():
+    variants = parse_master_playlist(MASTER, BASE)
+    chosen = select_variant(variants, 1280, 720, 30, 3500)
+    # 720p30 مع صوت مدمج - وليس نسخة الفيديو وحدها
+    assert chosen["url"].endswith("/720p30/index.m3u8")
+
+
+def test_select_variant_avoids_upscaling():
+    text = "#EXTM3U\n" + "".join(
+        f"#EXT-X-STREAM-INF:BANDWIDTH=0,RESOLUTION={w}x{h}\n{h}.m3u8\n" for w, h in ((1920, 1080), (1280, 720)))
+    # 900p: التصغير من 1080 أفضل من تكبير 720 بنفس الفارق
+    assert select_variant(parse_master_playlist(text, BASE), 1600, 900, 30, 3500)["height"] == 1080
+
+
+def test_select_variant_without_candidates():
+    variants = [v for v in parse_master_playlist(MASTER, BASE) if v["separate_audio"]]
+    assert select_variant(variants, 1280, 720, 30, 3500) is None
+
+
+def test_parse_media_playlist():
+    text = """#EXTM3U
+#EXT-X-TARGETDURATION:4
+#EXT-X-MEDIA-SEQUENCE:120
+#EXTINF:4.000,
+seg120.ts
+#EXTINF:3.5,
+seg121.ts
+seg122.ts
+#EXT-X-ENDLIST
+"""
+    playlist = parse_media_playlist(text, "https://cdn.example.com/live/720p/index.m3u8")
+    assert playlist["target_duration"] == 4.0
+    assert playlist["endlist"]
+    assert playlist["unsupported"] is None
+    assert [s["seq"] for s in playlist["segments"]] == [120, 121, 122]
+    # بدون EXTINF تُستخدم المدة المستهدفة
+    assert [s["duration"] for s in playlist["segments"]] == [4.0, 3.5, 4.0]
+    assert playlist["segments"][0]["url"] == "https://cdn.example.com/live/720p/seg120.ts"
+
+
+@pytest.mark.parametrize("line, reason", [
+    ("#EXT-X-MAP:URI=\"init.mp4\"", "fMP4 (EXT-X-MAP)"),
+    ("#EXT-X-KEY:METHOD=AES-128,URI=\"key\"", "encrypted (EXT-X-KEY)"),
+    ("#EXT-X-STREAM-INF:BANDWIDTH=1", "master playlist"),
+])
+def test_parse_media_playlist_unsupported(line, reason):
+    playlist = parse_media_playlist(f"#EXTM3U\n{line}\n#EXTINF:2,\n0.ts\n", BASE)
+    assert playlist["unsupported"] == reason
+
+
+def test_unencrypted_key_is_supported():
+    playlist = parse_media_playlist("#EXTM3U\n#EXT-X-KEY:METHOD=NONE\n#EXTINF:2,\n0.ts\n", BASE)
+    assert playlist["unsupported"] is None
+
+
+def test_ttl_cache_expires(monkeypatch):
+    import hls
+    now = [1000.0]
+    monkeypatch.setattr(hls.time, "time", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now[0] += 11
+    assert cache.get("a") is None
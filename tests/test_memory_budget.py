@@ -0,0 +1,126 @@
+"""نصيب الذاكرة لكل بث ومستويات التخفيض بحد حاوية مضبوط يدوياً"""
+import pytest
+
+import config
+import memory_budget
+from memory_budget import MB, TIERS, MemoryBudget
+
+
+class FakeProcess:
+    """RSS العملية واستخدام الحاوية كما يقرؤهما النصيب من /proc و cgroup"""
+
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        self.rss = 100 * MB
+        self.usage = None
+        monkeypatch.setattr(memory_budget.time, "time", lambda: self.now)
+        monkeypatch.setattr(memory_budget, "process_rss", lambda pid: self.rss)
+        monkeypatch.setattr(memory_budget, "container_usage", lambda: self.usage)
+
+    def observe(self, budget, samples, queues_only=False):
+        decisions = []
+        for _ in range(samples):
+            self.now += config.MEMORY_SAMPLE_INTERVAL
+            decision = budget.observe(1, queues_only=queues_only)
+            if decision:
+                decisions.append(decision)
+        return decisions
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    # نصيب بث واحد: 1000 - 150 = 850MB
+    monkeypatch.setattr(config, "MEMORY_LIMIT_MB", 1000)
+    monkeypatch.setattr(config, "MEMORY_RESERVE_MB", 150)
+    monkeypatch.setattr(config, "RESOLUTION_WIDTH", 1280)
+    monkeypatch.setattr(config, "RESOLUTION_HEIGHT", 720)
+    return FakeProcess(monkeypatch)
+
+
+def test_initial_tier_caps_at_requested_resolution(fake):
+    budget = MemoryBudget()
+    # نصيب يتسع لـ 1080 - لكن المطلوب 720 فلا فائدة من طوابير أكبر
+    assert budget.budget_bytes() == 850 * MB
+    assert TIERS[budget.tier]["height"] == 720
+
+
+@pytest.mark.parametrize("streams, height", [(1, 720), (3, 720), (4, 540), (8, 360)])
+def test_initial_tier_by_share(fake, streams, height):
+    assert MemoryBudget(streams).profile()["height"] == height
+
+
+def test_profile_keeps_configured_dimensions(monkeypatch, fake):
+    monkeypatch.setattr(config, "RESOLUTION_WIDTH", 1000)
+    monkeypatch.setattr(config, "RESOLUTION_HEIGHT", 700)
+    profile = MemoryBudget().profile()
+    assert (profile["width"], profile["height"]) == (1000, 700)
+    assert profile["muxing_queue"] == 512
+
+
+def test_relay_buffer_is_quarter_of_share(monkeypatch, fake):
+    monkeypatch.setattr(config, "RELAY_BUFFER_BYTES", 512 * MB)
+    assert MemoryBudget().relay_buffer_bytes() == 850 * MB // 4
+    # أرضية 4MB مهما صغر النصيب
+    assert MemoryBudget(1000).relay_buffer_bytes() == 4 * MB
+
+
+def test_rebalance_degrades_when_share_shrinks(fake):
+    budget = MemoryBudget()
+    assert budget.rebalance(2) is None
+    decision = budget.rebalance(4)
+    assert (decision["from"], decision["to"], decision["queues_only"]) == (720, 540, False)
+    # المستوى لا يرتفع عند انتهاء البثوث الأخرى أثناء التشغيل
+    assert budget.rebalance(1) is None
+    assert budget.profile()["height"] == 540
+
+
+def test_observe_degrades_after_consecutive_samples(fake):
+    budget = MemoryBudget()
+    fake.rss = 800 * MB
+    decisions = fake.observe(budget, 3)
+    assert len(decisions) == 1
+    assert decisions[0]["to"] == 540
+    assert budget.peak_rss == 800 * MB
+    # فترة تهدئة قبل التخفيض التالي
+    assert fake.observe(budget, 3) == []
+
+
+def test_observe_ignores_short_spike(fake):
+    budget = MemoryBudget()
+    fake.rss = 800 * MB
+    assert fake.observe(budget, 2) == []
+    fake.rss = 100 * MB
+    assert fake.observe(budget, 5) == []
+    assert budget.profile()["height"] == 720
+
+
+def test_observe_container_pressure(fake):
+    budget = MemoryBudget()
+    fake.usage = 900 * MB
+    decisions = fake.observe(budget, 3)
+    assert len(decisions) == 1
+    assert "الحاوية" in decisions[0]["reason"]
+
+
+def test_queues_only_keeps_resolution_in_decision(fake):
+    budget = MemoryBudget()
+    fake.rss = 800 * MB
+    decision = fake.observe(budget, 3, queues_only=True)[0]
+    assert decision["queues_only"]
+    # الطوابير تصغر للتشغيل التالي
+    assert budget.profile()["muxing_queue"] == 256
+
+
+def test_lowest_tier_does_not_degrade(fake):
+    budget = MemoryBudget(8)
+    assert budget.tier == len(TIERS) - 1
+    assert budget.degrade("test") is None
+
+
+def test_without_limit(monkeypatch, fake):
+    monkeypatch.setattr(memory_budget, "container_limit", lambda: None)
+    budget = MemoryBudget()
+    assert budget.budget_bytes() is None
+    assert budget.profile()["height"] == 720
+    fake.rss = 10_000 * MB
+    assert fake.observe(budget, 5) == []
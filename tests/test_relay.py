@@ -0,0 +1,236 @@
+"""الوسيط مقابل خادم HLS محلي (ThreadingHTTPServer) بمقاطع TS مصنوعة يدوياً"""
+import asyncio
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import config
+from relay import TS_PACKET, HlsRelay, same_layout, ts_layout
+
+H264, AAC = 0x1B, 0x0F
+LAYOUT = {"program": 1, "pmt_pid": 4096, "streams": [[256, H264], [257, AAC]]}
+OTHER_LAYOUT = {"program": 7, "pmt_pid": 480, "streams": [[481, H264], [482, AAC]]}
+MARKER_PID = 0x1FF
+
+
+def ts_packet(pid, payload, start=True):
+    header = bytes([0x47, (0x40 if start else 0) | (pid >> 8), pid & 0xFF, 0x10])
+    return (header + payload).ljust(TS_PACKET, b"\xff")
+
+
+def psi(table_id, body):
+    # pointer_field ثم الجدول - CRC لا يُفحص
+    length = len(body) + 5 + 4
+    return b"\x00" + bytes([table_id, 0xB0 | (length >> 8), length & 0xFF]) + b"\x00\x01\xc1\x00\x00" + body + b"\x00" * 4
+
+
+def ts_segment(layout, marker):
+    """مقطع TS صغير: PAT و PMT بتخطيط معين ثم حزمة تحمل علامة للتعرف عليه عند الاستقبال"""
+    pmt_pid = layout["pmt_pid"]
+    pat = psi(0x00, bytes([layout["program"] >> 8, layout["program"] & 0xFF, 0xE0 | (pmt_pid >> 8), pmt_pid & 0xFF]))
+    streams = b"".join(bytes([kind, 0xE0 | (pid >> 8), pid & 0xFF, 0xF0, 0x00]) for pid, kind in layout["streams"])
+    pcr_pid = layout["streams"][0][0]
+    pmt = psi(0x02, bytes([0xE0 | (pcr_pid >> 8), pcr_pid & 0xFF, 0xF0, 0x00]) + streams)
+    return ts_packet(0, pat) + ts_packet(pmt_pid, pmt) + ts_packet(MARKER_PID, marker.encode(), start=False)
+
+
+def markers(data):
+    found = []
+    for offset in range(0, len(data) - TS_PACKET + 1, TS_PACKET):
+        packet = data[offset:offset + TS_PACKET]
+        if ((packet[1] & 0x1F) << 8 | packet[2]) == MARKER_PID:
+            found.append(packet[4:].rstrip(b"\xff").decode())
+    return found
+
+
+class LiveSources:
+    """مصادر HLS حية: كل مصدر نافذة من آخر 4 مقاطع تتقدم عند advance()"""
+
+    def __init__(self):
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, layout=LAYOUT, count=5):
+        self.sources[name] = {"layout": layout, "count": count, "alive": True}
+
+    def advance(self):
+        with self.lock:
+            for source in self.sources.values():
+                if source["alive"]:
+                    source["count"] += 1
+
+    def response(self, path):
+        match = re.fullmatch(r"/(\w+)/(?:index\.m3u8|(\d+)\.ts)", path)
+        source = self.sources.get(match.group(1)) if match else None
+        if source is None or not source["alive"]:
+            return None
+        if match.group(2) is not None:
+            return ts_segment(source["layout"], f"{match.group(1)}:{match.group(2)}")
+        with self.lock:
+            count = source["count"]
+        first = max(0, count - 4)
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:1", f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+        for seq in range(first, count):
+            lines += ["#EXTINF:1.0,", f"{seq}.ts"]
+        return "\n".join(lines).encode()
+
+
+@pytest.fixture
+def hls_server():
+    sources = LiveSources()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            body = sources.response(self.path)
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sources.base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield sources
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_failover(monkeypatch):
+    monkeypatch.setattr(config, "FAILOVER_GRACE", 0.3)
+    monkeypatch.setattr(config, "FAILOVER_CHECK_INTERVAL", 0.05)
+    monkeypatch.setattr(config, "RELAY_START_SEGMENTS", 3)
+
+
+async def read_stream(relay, seconds, until=None):
+    """قارئ مثل FFmpeg: طلب HTTP ثم قراءة تيار TS حتى انتهاء المدة أو ظهور علامة"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", relay.port)
+    writer.write(b"GET / HTTP/1.1\r\nHost: relay\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+    data = b""
+    deadline = time.monotonic() + seconds
+    try:
+        while time.monotonic() < deadline:
+            try:
+                data += await asyncio.wait_for(reader.read(65536), timeout=0.1)
+            except asyncio.TimeoutError:
+                pass
+            if until is not None and until in markers(data):
+                break
+    finally:
+        writer.close()
+    return markers(data)
+
+
+async def ticking(sources, interval=0.3):
+    while True:
+        await asyncio.sleep(interval)
+        sources.advance()
+
+
+def test_ts_layout_reads_pat_and_pmt():
+    assert ts_layout(ts_segment(LAYOUT, "a:0")) == LAYOUT
+    assert ts_layout(ts_segment(OTHER_LAYOUT, "b:0")) == OTHER_LAYOUT
+    assert ts_layout(b"\x00" * TS_PACKET) is None
+    assert ts_layout(b"") is None
+
+
+def test_same_layout_ignores_unknown():
+    assert same_layout(LAYOUT, dict(LAYOUT))
+    assert same_layout(None, LAYOUT)
+    assert not same_layout(LAYOUT, OTHER_LAYOUT)
+
+
+def test_relay_serves_from_live_edge_in_order(hls_server):
+    hls_server.add("main", count=10)
+
+    async def run():
+        relay = HlsRelay(f"{hls_server.base}/main/index.m3u8", name="t")
+        ok, reason = await relay.start()
+        assert ok, reason
+        assert relay.layout == LAYOUT
+        ticker = asyncio.create_task(ticking(hls_server))
+        try:
+            return await read_stream(relay, 5, until="main:11")
+        finally:
+            ticker.cancel()
+            await relay.stop()
+
+    received = asyncio.run(run())
+    # آخر RELAY_START_SEGMENTS من النافذة ثم المقاطع الجديدة بلا تكرار ولا فجوة
+    assert received[:3] == ["main:7", "main:8", "main:9"]
+    seqs = [int(m.split(":")[1]) for m in received]
+    assert seqs == list(range(7, 7 + len(seqs)))
+    assert "main:11" in received
+
+
+def test_relay_rejects_missing_playlist(hls_server):
+    async def run():
+        relay = HlsRelay(f"{hls_server.base}/nothing/index.m3u8", name="t")
+        return await relay.start()
+
+    ok, reason = asyncio.run(run())
+    assert not ok
+    assert reason
+
+
+def test_switch_checks_layout(hls_server):
+    hls_server.add("main")
+    hls_server.add("same")
+    hls_server.add("other", layout=OTHER_LAYOUT)
+
+    async def run():
+        relay = HlsRelay(f"{hls_server.base}/main/index.m3u8", name="t")
+        assert (await relay.start())[0]
+        try:
+            refused = await relay.switch(f"{hls_server.base}/other/index.m3u8")
+            assert relay.playlist_url.endswith("/main/index.m3u8")
+            accepted = await relay.switch(f"{hls_server.base}/same/index.m3u8")
+            received = await read_stream(relay, 3, until="same:4")
+            return refused, accepted, received, relay.stats["switches"]
+        finally:
+            await relay.stop()
+
+    refused, accepted, received, switches = asyncio.run(run())
+    assert refused[0] is False
+    assert accepted == (True, "")
+    assert switches == 1
+    # flush: لا شيء من المصدر القديم بعد التبديل
+    assert received and all(m.startswith("same:") for m in received)
+
+
+def test_failover_to_backup_and_layout_change(hls_server):
+    hls_server.add("main")
+    hls_server.add("backup", layout=OTHER_LAYOUT)
+
+    async def run():
+        relay = HlsRelay(f"{hls_server.base}/main/index.m3u8", name="t")
+        assert (await relay.start())[0]
+        changes = []
+        relay.on_layout_change = lambda: changes.append(relay.active)
+        assert (await relay.set_backup(f"{hls_server.base}/backup/index.m3u8"))[0]
+        ticker = asyncio.create_task(ticking(hls_server))
+        try:
+            reading = asyncio.create_task(read_stream(relay, 8, until="backup:8"))
+            await asyncio.sleep(1.5)
+            hls_server.sources["main"]["alive"] = False
+            received = await reading
+            return received, list(relay.failovers), changes, relay.layout
+        finally:
+            ticker.cancel()
+            await relay.stop()
+
+    received, failovers, changes, layout = asyncio.run(run())
+    assert [e["to"] for e in failovers] == ["backup"]
+    assert failovers[0]["switch_ms"] is not None
+    # مقاطع الاحتياطي بـ PID مختلفة - المرمّز يُطلب إعادة تشغيله
+    assert changes == ["backup"]
+    assert layout == OTHER_LAYOUT
+    assert any(m.startswith("backup:") for m in received)
@@ -0,0 +1,107 @@
+"""سلم معدل الرفع بعينات مصطنعة بدل مقابس حقيقية"""
+import pytest
+
+import config
+import uplink
+from uplink import UplinkLadder, build_ladder, rung_label
+
+
+class FakeUplink:
+    """طوابير الإرسال وعدادات tcpi_bytes_acked التي يقرأها السلم من /proc و sock_diag"""
+
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        self.backlog = 0
+        self.acked = {}
+        monkeypatch.setattr(uplink.time, "time", lambda: self.now)
+        monkeypatch.setattr(uplink, "tcp_backlog", lambda pid: self.backlog)
+        monkeypatch.setattr(uplink, "output_acked_bytes", lambda pid: dict(self.acked))
+
+    def run(self, ladder, seconds, speed=1.0, rate_kbps=None):
+        """عينة كل LADDER_SAMPLE_INTERVAL - يرجع القرارات"""
+        decisions = []
+        for _ in range(int(seconds // config.LADDER_SAMPLE_INTERVAL)):
+            self.now += config.LADDER_SAMPLE_INTERVAL
+            for inode, kbps in (rate_kbps or {}).items():
+                self.acked[inode] = self.acked.get(inode, 0) + kbps * 1000 // 8 * config.LADDER_SAMPLE_INTERVAL
+            decision = ladder.observe({"time": self.now, "speed": speed}, pid=1)
+            if decision:
+                decisions.append(decision)
+        return decisions
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setattr(config, "LADDER_SPEC", "")
+    monkeypatch.setattr(config, "RESOLUTION_WIDTH", 1280)
+    monkeypatch.setattr(config, "RESOLUTION_HEIGHT", 720)
+    monkeypatch.setattr(config, "VIDEO_BITRATE_KBPS", 3500)
+    return FakeUplink(monkeypatch)
+
+
+def test_build_ladder_default(fake):
+    assert [rung_label(r) for r in build_ladder()] == ["720p/3500k", "720p/2500k", "540p/1500k"]
+    # العرض 16:9 زوجي للدرجات التي لا تطابق الدقة المضبوطة
+    assert build_ladder()[2]["width"] == 960
+
+
+def test_build_ladder_spec(monkeypatch, fake):
+    monkeypatch.setattr(config, "LADDER_SPEC", "1080:6000, 480:1000,")
+    rungs = build_ladder()
+    assert [(r["width"], r["height"], r["bitrate_kbps"]) for r in rungs] == [(1920, 1080, 6000), (852, 480, 1000)]
+
+
+def test_steps_down_on_sustained_backlog(fake):
+    ladder = UplinkLadder()
+    # تجاهل العينات الأولى بعد بدء البث
+    fake.run(ladder, config.LADDER_SETTLE)
+    # ثانيتان من 3500kbps في الطابور
+    fake.backlog = 2 * 3500 * 1000 // 8
+    decisions = fake.run(ladder, config.LADDER_DOWN_SECONDS + config.LADDER_SAMPLE_INTERVAL)
+    assert len(decisions) == 1
+    assert decisions[0]["to"]["bitrate_kbps"] == 2500
+    assert (ladder.index, ladder.step_downs) == (1, 1)
+
+
+def test_short_burst_does_not_step_down(fake):
+    ladder = UplinkLadder()
+    fake.run(ladder, config.LADDER_SETTLE)
+    fake.backlog = 2 * 3500 * 1000 // 8
+    assert fake.run(ladder, config.LADDER_DOWN_SECONDS - config.LADDER_SAMPLE_INTERVAL) == []
+    fake.backlog = 0
+    assert fake.run(ladder, config.LADDER_DOWN_SECONDS * 2) == []
+    assert ladder.index == 0
+
+
+def test_steps_up_after_clear_period(fake):
+    ladder = UplinkLadder(index=2)
+    fake.run(ladder, config.LADDER_SETTLE)
+    decisions = fake.run(ladder, config.LADDER_UP_SECONDS + config.LADDER_SAMPLE_INTERVAL)
+    assert [d["to"]["bitrate_kbps"] for d in decisions] == [2500]
+    assert ladder.step_ups == 1
+
+
+def test_bottom_rung_stays(fake):
+    ladder = UplinkLadder(index=5)
+    assert ladder.index == len(ladder.rungs) - 1
+    fake.run(ladder, config.LADDER_SETTLE)
+    fake.backlog = 10 * 1500 * 1000 // 8
+    assert fake.run(ladder, config.LADDER_DOWN_SECONDS * 3) == []
+
+
+def test_achieved_kbps_is_slowest_destination(fake):
+    ladder = UplinkLadder()
+    fake.run(ladder, config.LADDER_DOWN_SECONDS, rate_kbps={"11": 3500, "12": 1200})
+    assert ladder.achieved_kbps() == 1200
+
+
+def test_achieved_kbps_ignores_new_connections(fake):
+    ladder = UplinkLadder()
+    fake.run(ladder, 4, rate_kbps={"11": 2000})
+    # اتصال جديد بعدّاد من الصفر لا يظهر في العينة الأولى
+    fake.run(ladder, 4, rate_kbps={"11": 2000, "12": 100})
+    assert ladder.achieved_kbps() == 2000
+
+
+def test_achieved_kbps_without_samples(fake):
+    assert UplinkLadder().achieved_kbps() is None
@@ -0,0 +1,97 @@
+"""مسار webhook بتحديث مسجل من تيليجرام - مباشرة وعبر خادم الويب الحقيقي"""
+import asyncio
+import http.client
+import json
+import os
+import threading
+
+import pytest
+from telegram.ext import Application
+
+import bot
+import config
+import web
+
+UPDATE_PATH = os.path.join(os.path.dirname(__file__), "data", "update_status.json")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+@pytest.fixture
+def recorded_update():
+    with open(UPDATE_PATH, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    """المسار مع تطبيق حقيقي (بدون اتصال بتيليجرام) وحلقة تستقبل التحديثات"""
+    monkeypatch.setattr(config, "WEBHOOK_SECRET", "test-secret")
+    app = Application.builder().token("123456:TEST").build()
+    loop = asyncio.new_event_loop()
+    route = bot.webhook_route(app, loop)
+
+    def received():
+        async def drain():
+            await asyncio.sleep(0)
+            updates = []
+            while not app.update_queue.empty():
+                updates.append(app.update_queue.get_nowait())
+            return updates
+
+        return loop.run_until_complete(drain())
+
+    yield route, received
+    loop.close()
+
+
+def test_recorded_update_is_queued(webhook, recorded_update):
+    route, received = webhook
+    status, _, body = route(recorded_update, {SECRET_HEADER: "test-secret"})
+    assert (status, body) == (200, b"OK")
+    [update] = received()
+    assert update.update_id == 815204733
+    assert update.effective_chat.id == 123456789
+    assert update.message.text == "/status"
+
+
+@pytest.mark.parametrize("headers", [{}, {SECRET_HEADER: ""}, {SECRET_HEADER: "wrong"}])
+def test_update_without_secret_is_refused(webhook, recorded_update, headers):
+    route, received = webhook
+    assert route(recorded_update, headers)[0] == 403
+    assert received() == []
+
+
+def test_empty_secret_refuses_everything(webhook, recorded_update, monkeypatch):
+    route, received = webhook
+    monkeypatch.setattr(config, "WEBHOOK_SECRET", "")
+    assert route(recorded_update, {SECRET_HEADER: ""})[0] == 403
+    assert received() == []
+
+
+def test_post_through_web_server(webhook, recorded_update):
+    """نفس الطلب الذي يرسله تيليجرام (أو curl بتحديث مسجل) عبر WebHandler"""
+    route, received = webhook
+    handler = type("Handler", (web.WebHandler,), {
+        "routes": {},
+        "post_routes": {config.WEBHOOK_PATH: route},
+        "assets": web.AssetCache(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    })
+    server = web.WebServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        def post(body, headers):
+            conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+            conn.request("POST", config.WEBHOOK_PATH, body, {"Content-Type": "application/json", **headers})
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            return response.status
+
+        assert post(recorded_update, {}) == 403
+        assert post(b"not json", {SECRET_HEADER: "test-secret"}) == 400
+        assert post(recorded_update, {SECRET_HEADER: "test-secret"}) == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+    [update] = received()
+    assert json.loads(recorded_update)["message"]["chat"]["id"] == update.effective_chat.id
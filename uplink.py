@@ -0,0 +1,271 @@
+import logging
+import os
+import socket
+import struct
+import time
+from collections import deque
+import config
+
+logger = logging.getLogger(__name__)
+
+# حالة ESTABLISHED في /proc/net/tcp
+TCP_ESTABLISHED = "01"
+
+# sock_diag عبر netlink: عدادات tcp_info لكل مقبس (linux/inet_diag.h)
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST_DUMP = 0x301
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+INET_DIAG_MSG_SIZE = 72
+# موضع tcpi_bytes_acked و tcpi_bytes_received داخل struct tcp_info
+TCPI_BYTES_ACKED = 120
+TCPI_BYTES_RECEIVED = 128
+
+
+def socket_inodes(pid):
+    """أرقام inode لمقابس العملية من /proc/<pid>/fd"""
+    inodes = set()
+    try:
+        for fd in os.listdir(f"/proc/{pid}/fd"):
+            try:
+                target = os.readlink(f"/proc/{pid}/fd/{fd}")
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inodes.add(target[8:-1])
+    except OSError:
+        return None
+    return inodes
+
+
+def tcp_backlog(pid):
+    """البايتات المنتظرة في طوابير الإرسال (tx_queue) لاتصالات العملية - مقابس RTMP التي لم يقبلها الرفع بعد"""
+    inodes = socket_inodes(pid)
+    if inodes is None:
+        return None
+    total = 0
+    for table in ("tcp", "tcp6"):
+        try:
+            with open(f"/proc/{pid}/net/{table}") as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 9 and fields[3] == TCP_ESTABLISHED and fields[9] in inodes:
+                        total += int(fields[4].partition(":")[0], 16)
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def _tcp_info_dump():
+    """{inode: (bytes_acked, bytes_received)} لكل اتصالات TCP القائمة على الجهاز"""
+    counters = {}
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as sock:
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6), 1):
+            request = struct.pack(
+                "=BBBBI", family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), 0, 1 << int(TCP_ESTABLISHED, 16)
+            ) + bytes(48)
+            sock.send(struct.pack("=IHHII", 16 + len(request), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST_DUMP, seq, 0) + request)
+            done = False
+            while not done:
+                data = sock.recv(1 << 16)
+                offset = 0
+                while offset + 16 <= len(data):
+                    length, kind = struct.unpack_from("=IH", data, offset)
+                    if kind in (NLMSG_DONE, NLMSG_ERROR) or length < 16:
+                        done = True
+                        break
+                    message = data[offset + 16:offset + length]
+                    offset += (length + 3) & ~3
+                    if len(message) < INET_DIAG_MSG_SIZE:
+                        continue
+                    inode = struct.unpack_from("=I", message, 68)[0]
+                    attr = INET_DIAG_MSG_SIZE
+                    while attr + 4 <= len(message):
+                        attr_len, attr_type = struct.unpack_from("=HH", message, attr)
+                        if attr_len < 4:
+                            break
+                        if attr_type == INET_DIAG_INFO and attr_len - 4 >= TCPI_BYTES_RECEIVED + 8:
+                            counters[str(inode)] = struct.unpack_from("=QQ", message, attr + 4 + TCPI_BYTES_ACKED)
+                        attr += (attr_len + 3) & ~3
+    return counters
+
+
+def output_acked_bytes(pid):
+    """{inode: البايتات التي أكد الطرف الآخر استلامها} لمقابس الإرسال للعملية (tcpi_bytes_acked)
+
+    مقابس الإرسال: ما ترسله أكثر مما تستقبله (RTMP) - اتصالات المصدر والوسيط تستقبل أكثر
+    None إذا لم يتوفر sock_diag (نواة أو حاوية بدون netlink)
+    """
+    inodes = socket_inodes(pid)
+    if inodes is None:
+        return None
+    try:
+        counters = _tcp_info_dump()
+    except OSError:
+        return None
+    return {
+        inode: acked for inode, (acked, received) in counters.items()
+        if inode in inodes and acked > received
+    }
+
+
+def output_acked_total(pid):
+    """مجموع البايتات المؤكدة على كل مقابس الإرسال - None بدون sock_diag"""
+    counters = output_acked_bytes(pid)
+    return sum(counters.values()) if counters is not None else None
+
+
+def build_ladder():
+    """درجات السلم من الإعدادات الحالية: "ارتفاع:kbps" من الأعلى للأقل، الدرجة الأولى هي الأساس"""
+    spec = config.LADDER_SPEC or f"{config.RESOLUTION_HEIGHT}:{config.VIDEO_BITRATE_KBPS},720:2500,540:1500"
+    rungs = []
+    for item in spec.split(","):
+        height, _, kbps = item.strip().partition(":")
+        if not height:
+            continue
+        height = int(height)
+        rungs.append({
+            "height": height,
+            # 16:9 بعرض زوجي - الدقة المطلوبة تحتفظ بعرضها المضبوط
+            "width": config.RESOLUTION_WIDTH if height == config.RESOLUTION_HEIGHT else height * 16 // 9 // 2 * 2,
+            "bitrate_kbps": int(kbps),
+        })
+    return rungs
+
+
+def rung_label(rung):
+    return f"{rung['height']}p/{rung['bitrate_kbps']}k"
+
+
+class UplinkLadder:
+    """سلم معدل المخرج: النزول عند ازدحام الرفع المستمر والصعود عند عودة الفائض"""
+
+    def __init__(self, index=0):
+        self.rungs = build_ladder()
+        self.index = min(index, len(self.rungs) - 1)
+        self.step_downs = 0
+        self.step_ups = 0
+        self.decisions = deque(maxlen=50)
+        # الثواني على كل درجة منذ بدء البث
+        self.rung_seconds = [0.0] * len(self.rungs)
+        self.last_account = time.time()
+        self.last_change = time.time()
+        self.last_sample = 0.0
+        # (الوقت، البايتات المؤكدة) على مقابس RTMP خلال نافذة النزول
+        self.acked = deque()
+        self.backlog = None
+        self.backlog_seconds = None
+        self.congested_since = None
+        self.clear_since = None
+
+    def rung(self):
+        return self.rungs[self.index]
+
+    def _account(self, now):
+        self.rung_seconds[self.index] += max(0.0, now - self.last_account)
+        self.last_account = now
+
+    def achieved_kbps(self):
+        """المعدل الذي أكدت أبطأ وجهة استلامه فعلاً (tcpi_bytes_acked) خلال نافذة النزول"""
+        # /metrics يقرأ من خيط الويب - نسخة في عبارة واحدة
+        acked = list(self.acked)
+        if len(acked) < 2:
+            return None
+        (start, first), (end, last) = acked[0], acked[-1]
+        # المقابس الموجودة في العينتين - اتصال جديد بدأ عداده من الصفر
+        deltas = [last[inode] - first[inode] for inode in first.keys() & last.keys()]
+        if end <= start or not deltas:
+            return None
+        return round(min(deltas) * 8 / 1000 / (end - start))
+
+    def _step(self, delta, reason):
+        now = time.time()
+        self._account(now)
+        old = self.rung()
+        spent = now - self.last_change
+        self.index += delta
+        if delta > 0:
+            self.step_downs += 1
+        else:
+            self.step_ups += 1
+        self.last_change = now
+        self.congested_since = None
+        self.clear_since = None
+        self.acked.clear()
+        decision = {"time": now, "from": dict(old), "to": dict(self.rung()), "reason": reason}
+        self.decisions.append(decision)
+        logger.warning(
+            f"📶 الرفع: {rung_label(old)} → {rung_label(self.rung())} ({reason}) - "
+            f"{spent:.0f} ثانية على الدرجة السابقة، {self.step_downs} نزول"
+        )
+        return decision
+
+    def observe(self, sample, pid):
+        """عينة تقدم + طوابير الإرسال - يرجع قراراً إذا تغيرت الدرجة"""
+        now = sample["time"]
+        if now - self.last_sample < config.LADDER_SAMPLE_INTERVAL:
+            return None
+        self.last_sample = now
+        self._account(now)
+        acked = output_acked_bytes(pid)
+        if acked is not None:
+            self.acked.append((now, acked))
+            while now - self.acked[0][0] > config.LADDER_DOWN_SECONDS:
+                self.acked.popleft()
+        backlog = tcp_backlog(pid)
+        if backlog is None:
+            return None
+        self.backlog = backlog
+        self.backlog_seconds = backlog * 8 / (self.rung()["bitrate_kbps"] * 1000)
+        # إعادة الاتصال بعد تغيير الدرجة تملأ الطوابير مؤقتاً
+        if now - self.last_change < config.LADDER_SETTLE:
+            return None
+
+        speed = sample["speed"]
+        congested = self.backlog_seconds >= config.LADDER_CONGESTED_BACKLOG or (
+            speed < config.GOVERNOR_MIN_SPEED and self.backlog_seconds >= config.LADDER_CLEAR_BACKLOG
+        )
+        clear = self.backlog_seconds <= config.LADDER_CLEAR_BACKLOG and speed >= 0.99
+        self.congested_since = (self.congested_since or now) if congested else None
+        self.clear_since = (self.clear_since or now) if clear else None
+
+        if (
+            self.congested_since is not None
+            and now - self.congested_since >= config.LADDER_DOWN_SECONDS
+            and self.index + 1 < len(self.rungs)
+        ):
+            return self._step(1, f"تراكم {self.backlog_seconds:.1f} ثانية في طابور الإرسال، speed {speed:.2f}x")
+        if (
+            self.clear_since is not None
+            and now - self.clear_since >= config.LADDER_UP_SECONDS
+            and self.index > 0
+        ):
+            return self._step(-1, f"الرفع بدون تراكم منذ {now - self.clear_since:.0f} ثانية")
+        return None
+
+    def summary(self):
+        """الوقت على كل درجة - للوج عند إيقاف البث"""
+        self._account(time.time())
+        return ", ".join(
+            f"{rung_label(rung)} {seconds / 60:.1f}د"
+            for rung, seconds in zip(self.rungs, self.rung_seconds)
+            if seconds >= 1
+        )
+
+    def to_dict(self):
+        self._account(time.time())
+        return {
+            "rung": dict(self.rung()),
+            "index": self.index,
+            "backlog_bytes": self.backlog,
+            "backlog_s": round(self.backlog_seconds, 2) if self.backlog_seconds is not None else None,
+            "achieved_kbps": self.achieved_kbps(),
+            "congested": self.congested_since is not None,
+            "step_downs": self.step_downs,
+            "step_ups": self.step_ups,
+            "rung_seconds": {rung_label(r): round(s, 1) for r, s in zip(self.rungs, self.rung_seconds)},
+            "decisions": list(self.decisions),
+        }
@@ -0,0 +1,253 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# الملفات النصية تُضغط مرة واحدة عند التحميل
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+# الملفات الأكبر من هذا تُرسل من القرص عبر sendfile بدل الذاكرة
+MAX_MEMORY_ASSET = 256 * 1024
+FALLBACK_PAGE = b"<h1>Bot Running</h1>"
+MAX_POST_BODY = 1024 * 1024
+
+
+class Asset:
+    """ملف ثابت محمّل مع بيانات التحقق من التغيير"""
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.content_type.startswith("text/"):
+            self.content_type += "; charset=utf-8"
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.body = None
+        self.gzip_body = None
+
+        if self.size <= MAX_MEMORY_ASSET:
+            with open(path, "rb") as f:
+                self.body = f.read()
+            digest = hashlib.md5(self.body).hexdigest()[:16]
+            if self.content_type.startswith(COMPRESSIBLE_TYPES):
+                compressed = gzip.compress(self.body, compresslevel=9)
+                if len(compressed) < self.size:
+                    self.gzip_body = compressed
+        else:
+            # الملفات الكبيرة: الوسم من الحجم ووقت التعديل دون قراءة المحتوى
+            digest = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        self.etag = f'"{digest}"'
+
+        # نسخة مضغوطة مسبقاً بجانب الملف (مثل app.js.gz) إن وجدت
+        if self.gzip_body is None and self.body is not None:
+            try:
+                with open(f"{path}.gz", "rb") as f:
+                    self.gzip_body = f.read()
+            except OSError:
+                pass
+
+
+class AssetCache:
+    """ذاكرة للقوالب والملفات الثابتة تُعاد قراءتها عند تغير الملف على القرص"""
+
+    def __init__(self, root, allowed=("static", "templates")):
+        self.root = os.path.realpath(root)
+        self.allowed = [os.path.join(self.root, name) + os.sep for name in allowed]
+        self.assets = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, rel_path):
+        """مسار آمن داخل المجلدات المسموحة فقط - يمنع ../ للوصول لملفات المشروع"""
+        path = os.path.realpath(os.path.join(self.root, rel_path.lstrip("/")))
+        if not any(path.startswith(prefix) for prefix in self.allowed):
+            return None
+        return path
+
+    def get(self, rel_path):
+        path = self.resolve(rel_path)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        asset = self.assets.get(path)
+        if asset is not None and asset.version == (stat.st_mtime_ns, stat.st_size):
+            return asset
+        with self.lock:
+            asset = self.assets.get(path)
+            if asset is None or asset.version != (stat.st_mtime_ns, stat.st_size):
+                try:
+                    asset = Asset(path, stat)
+                except OSError as e:
+                    logger.error(f"❌ تعذر تحميل الملف {rel_path}: {e}")
+                    return None
+                self.assets[path] = asset
+        return asset
+
+
+class WebHandler(BaseHTTPRequestHandler):
+    """خادم واحد للصحة والمقاييس والمعاينة والملفات الثابتة"""
+
+    protocol_version = "HTTP/1.1"
+    # عميل بطيء لا يحتجز خيطاً إلى الأبد
+    timeout = 30
+    routes = {}
+    post_routes = {}
+    assets = None
+
+    def do_GET(self):
+        self.handle_request(head=False)
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        try:
+            route = self.post_routes.get(path)
+            length = int(self.headers.get("Content-Length") or 0)
+            if route is None:
+                self.send_body(404, "text/plain", b"Not Found")
+                self.close_connection = True
+                return
+            if length > MAX_POST_BODY:
+                self.send_body(413, "text/plain", b"Payload Too Large")
+                self.close_connection = True
+                return
+            body = self.rfile.read(length) if length else b""
+            status, content_type, response = route(body, self.headers)
+            self.send_body(status, content_type, response)
+        except ValueError:
+            self.send_body(400, "text/plain", b"Bad Request")
+            self.close_connection = True
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            self.close_connection = True
+        except Exception as e:
+            logger.error(f"❌ خطأ في الطلب {path}: {e}")
+            self.close_connection = True
+
+    def do_HEAD(self):
+        self.handle_request(head=True)
+
+    def handle_request(self, head):
+        path = self.path.split("?", 1)[0]
+        try:
+            route, args = self.find_route(path)
+            if route is not None:
+                status, content_type, body = route(*args)
+                self.send_body(status, content_type, body, head)
+            elif path in ("/", "/preview"):
+                self.send_asset("templates/preview.html", head, fallback=FALLBACK_PAGE)
+            elif path.startswith("/static/"):
+                self.send_asset(path, head)
+            else:
+                self.send_body(404, "text/plain", b"Not Found", head)
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            self.close_connection = True
+        except Exception as e:
+            logger.error(f"❌ خطأ في الطلب {path}: {e}")
+            self.close_connection = True
+
+    def find_route(self, path):
+        """مسار ثابت، أو مسار ينتهي بـ / يستقبل باقي الرابط وترويسات الطلب (مثل /snapshot/<id>)"""
+        route = self.routes.get(path)
+        if route is not None and not path.endswith("/"):
+            return route, ()
+        for prefix, route in self.routes.items():
+            if prefix.endswith("/") and path.startswith(prefix) and len(path) > len(prefix):
+                return route, (path[len(prefix):], self.headers)
+        return None, ()
+
+    def send_body(self, status, content_type, body, head=False, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def not_modified(self, asset):
+        etags = self.headers.get("If-None-Match")
+        if etags is not None:
+            return asset.etag in [tag.strip() for tag in etags.split(",")] or etags.strip() == "*"
+        since = self.headers.get("If-Modified-Since")
+        if since:
+            try:
+                return int(asset.mtime) <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_asset(self, rel_path, head, fallback=None):
+        asset = self.assets.get(rel_path) if self.assets else None
+        if asset is None:
+            if fallback is not None:
+                self.send_body(200, "text/html; charset=utf-8", fallback, head)
+            else:
+                self.send_body(404, "text/plain", b"Not Found", head)
+            return
+
+        headers = {
+            "ETag": asset.etag,
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if self.not_modified(asset):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        if asset.body is not None:
+            body = asset.body
+            if asset.gzip_body is not None and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = asset.gzip_body
+                headers["Content-Encoding"] = "gzip"
+            self.send_body(200, asset.content_type, body, head, headers)
+            return
+
+        # الملفات الكبيرة: نسخ مباشر من القرص إلى المقبس دون المرور بالذاكرة
+        with open(asset.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", asset.content_type)
+            self.send_header("Content-Length", str(size))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if not head:
+                self.connection.sendfile(f, 0, size)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 64
+
+
+def serve(port, routes=None, root=None, post_routes=None):
+    """تشغيل الخادم المتعدد الخيوط - كل طلب في خيط مستقل"""
+    root = root or os.path.dirname(os.path.abspath(__file__))
+    handler = type("Handler", (WebHandler,), {
+        "routes": dict(routes or {}),
+        "post_routes": dict(post_routes or {}),
+        "assets": AssetCache(root),
+    })
+    server = WebServer(("0.0.0.0", port), handler)
+    logger.info(f"✅ Server on port {port}")
+    server.serve_forever()